@@ -0,0 +1,61 @@
+"""
+The flat arena AST vs the tree of pyc_ast nodes on a 100k-statement program:
+parsing time, memory, pickling and running a visitor.
+
+usage: python benchmarks/bench_arena.py [number of statements]
+"""
+
+import gc
+import pickle
+import sys
+
+from programs import straight_line, timed
+from bench_memory import traced
+import arena
+from lexer import TokenStream
+from pyc_parser import Parser
+from type_checker import check
+
+
+def parse_tree(stream):
+    return Parser(stream).parse_file_top()
+
+
+def parse_arena(stream):
+    builder = arena.ArenaBuilder()
+    return builder.finish(Parser(stream, builder=builder).parse_file_top())
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    stream = TokenStream(straight_line(size))
+
+    tree_time, tree = timed(parse_tree, stream)
+    arena_time, a = timed(parse_arena, stream)
+    _, tree_bytes = traced(parse_tree, stream)
+    _, arena_bytes = traced(parse_arena, stream)
+    print(f"{size} statements, {len(a)} nodes")
+    header = ("", "parse", "memory", "dumps", "loads", "pickle")
+    print(" ".join(f"{h:>{w}}" for (h, w) in zip(header, (8, 8, 10, 8, 8, 10))))
+    # the garbage collector should only scan the objects being unpickled
+    gc.freeze()
+    for (name, parse_time, used, value) in [
+        ("tree", tree_time, tree_bytes, tree),
+        ("arena", arena_time, arena_bytes, a),
+    ]:
+        dumps_time, data = timed(pickle.dumps, value)
+        loads_time, _ = timed(pickle.loads, data)
+        print(
+            f"{name:>8} {parse_time:>7.2f}s {used / 1e6:>7.1f} MB "
+            f"{dumps_time:>7.2f}s {loads_time:>7.2f}s {len(data) / 1e6:>7.1f} MB"
+        )
+
+    to_tree_time, _ = timed(a.to_tree)
+    print(f"arena -> tree: {to_tree_time:.2f}s")
+    tree_check, _ = timed(check, tree)
+    arena_check, _ = timed(check, a.views())
+    print(f"type checking: tree {tree_check:.2f}s, arena views {arena_check:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+The AST cache: a cold parse (and store) vs a warm load from the cache.
+
+usage: python benchmarks/bench_cache.py [number of statements]
+"""
+
+import sys
+import tempfile
+
+from programs import straight_line, timed
+import ast_cache
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    source = straight_line(size)
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ast_cache.ASTCache(directory)
+        cold, _ = timed(cache.parse_file, source)
+        warm, _ = timed(cache.parse_file, source, repeat=3)
+        [(_, entry_size, _)] = cache.entries()
+        print(
+            f"{size} statements ({len(source) / 1e6:.1f} MB of source): "
+            f"cold {cold:.2f}s, warm {warm:.2f}s ({cold / warm:.1f}x), "
+            f"entry size {entry_size / 1e6:.2f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+The control flow graphs of big functions: the edges, the reverse postorder,
+the dominators and the loops of functions with tens of thousands of blocks.
+
+usage: python benchmarks/bench_cfg.py [size]
+"""
+
+import sys
+
+import programs
+from programs import timed
+from cfg import CFG
+from lowering import lower
+from pyc_parser import parse_file
+
+SHAPES = [
+    programs.loop_sequence,
+    programs.nested_loops,
+    programs.nested_ifs,
+    programs.else_if_chain,
+]
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    for shape in SHAPES:
+        fun = lower(parse_file(shape(size))).function("main")
+        build_time, graph = timed(CFG, fun, repeat=3)
+        depth = max((loop.depth for loop in graph.loops), default=0)
+        print(
+            f"{shape.__name__:>14}({size}): {len(graph)} blocks, "
+            f"{len(graph.loops)} loops (depth {depth}), "
+            f"built in {build_time:.3f}s "
+            f"({build_time / len(graph) * 1e6:.1f}us per block)"
+        )
+
+
+if __name__ == "__main__":
+    main()
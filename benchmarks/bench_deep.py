@@ -0,0 +1,46 @@
+"""
+Deeply nested programs: parse, type check and compile (through the
+intermediate code) programs nested 10^5 levels deep (or with 10^5 long
+expressions), under the default recursion limit.
+
+usage: python benchmarks/bench_deep.py [depth]
+"""
+
+import sys
+
+import programs
+from programs import timed
+from pyc_parser import parse_file
+from type_checker import check
+from lowering import lower
+from backend import compile_program
+
+SHAPES = [
+    programs.nested_ifs,
+    programs.nested_whiles,
+    programs.nested_blocks,
+    programs.else_if_chain,
+    programs.long_sum,
+    programs.deep_parens,
+]
+
+
+def main():
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    print(f"depth {depth}, recursion limit {sys.getrecursionlimit()}")
+    for shape in SHAPES:
+        source = shape(depth)
+        parse_time, defs = timed(parse_file, source)
+        check_time, symbol_table = timed(check, defs)
+        lower_time, program = timed(lower, defs, symbol_table)
+        compile_time, code = timed(compile_program, program)
+        print(
+            f"{shape.__name__:>14}: parse {parse_time:6.2f}s, "
+            f"check {check_time:6.2f}s, lower {lower_time:6.2f}s, "
+            f"compile {compile_time:6.2f}s "
+            f"({len(code.splitlines())} lines of assembly)"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Global value numbering (see gvn) on the examples: the instructions left
+after the other optimizations, without and with it, in the code and run by
+the interpreter (the runs longer than the limit are not counted).
+
+usage: python benchmarks/bench_gvn.py [limit of the run instructions]
+"""
+
+import glob
+import os
+import sys
+
+import programs  # noqa: F401 (makes src importable)
+from interpreter import Interpreter, StepLimitExceeded
+from lowering import lower
+from pyc_parser import parse_file
+import optimizer
+import ssa
+
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
+WITHOUT = ["sccp", "dce"]
+WITH = ["sccp", "gvn", "dce"]
+
+
+def measure(source, passes, limit):
+    program = lower(parse_file(source))
+    ssa.program_to_ssa(program)
+    optimizer.optimize(program, passes)
+    instrs = sum(
+        len(block.instrs) for fun in program.functions for block in fun.blocks
+    )
+    interpreter = Interpreter(program, limit)
+    try:
+        interpreter.run()
+    except StepLimitExceeded:
+        return (instrs, None)
+    return (instrs, interpreter.steps)
+
+
+def main():
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    totals = [0, 0]
+    for path in sorted(glob.glob(os.path.join(EXAMPLES, "*.sil"))):
+        with open(path) as file:
+            source = file.read()
+        (before, steps_before) = measure(source, WITHOUT, limit)
+        (after, steps_after) = measure(source, WITH, limit)
+        totals[0] += before
+        totals[1] += after
+        line = f"{os.path.basename(path):>10}: {before:4} -> {after:4} instrs"
+        if steps_before is not None and steps_after is not None:
+            line += f", run {steps_before} -> {steps_after}"
+        print(line)
+    print(f"     total: {totals[0]} -> {totals[1]} instrs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Inlining (see inline) on a loop calling small helpers: the calls left in
+the program and the instructions run by the interpreter, without and with
+the pass. A call is one instruction of the interpreter, in the generated
+code it is about ten (the pushes of the arguments, the prologue and the
+epilogue of the callee).
+
+usage: python benchmarks/bench_inline.py [n]
+"""
+
+import sys
+
+from programs import timed
+from interpreter import Interpreter
+from ir import Op
+from lowering import lower
+from pyc_parser import parse_file
+import optimizer
+import ssa
+
+SOURCE = """
+long addone(long x) {
+  return x + 1;
+}
+long square(long x) {
+  return x * x;
+}
+long clamp(long x, long low, long high) {
+  if (x < low) {
+    return low;
+  }
+  if (x > high) {
+    return high;
+  }
+  return x;
+}
+int main() {
+  long i = 0;
+  long sum = 0;
+  while (i < N) {
+    sum = sum + clamp(square(i) % 1000, 100, 900);
+    i = addone(i);
+  }
+  print(sum);
+  return 0;
+}
+"""
+WITHOUT = [name for name in optimizer.PASSES if name != "inline"]
+WITH = list(optimizer.PASSES)
+
+
+def run(source, passes):
+    program = lower(parse_file(source))
+    ssa.program_to_ssa(program)
+    optimizer.optimize(program, passes)
+    calls = sum(
+        instr.op == Op.Call
+        for block in program.function("main").blocks
+        for instr in block.instrs
+    )
+    interpreter = Interpreter(program)
+    time, _ = timed(interpreter.run)
+    return (interpreter.output, calls, interpreter.steps, time)
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    source = SOURCE.replace("N", str(n))
+    outputs = []
+    for name, passes in [("off", WITHOUT), ("on", WITH)]:
+        (output, calls, steps, time) = run(source, passes)
+        outputs.append(output)
+        print(
+            f"helpers({n}), inline {name:>3}: {calls} calls in main, "
+            f"{steps} instrs run, {time:.2f}s"
+        )
+    assert outputs[0] == outputs[1]
+
+
+if __name__ == "__main__":
+    main()
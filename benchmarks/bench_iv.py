@@ -0,0 +1,74 @@
+"""
+The induction variables (see induction) on the primes program
+(examples/ex09): the multiplications left in its loops and the instructions
+run by the interpreter, without the pass, with it and with it forced to
+replace cand * cand (a high cost of the multiplications). The interpreter
+runs every instruction at about the same speed, in the generated code an
+add is cheaper than an imul.
+
+usage: python benchmarks/bench_iv.py [limit]
+"""
+
+import os
+import sys
+
+from programs import timed
+from cfg import CFG
+from interpreter import Interpreter
+from ir import Op
+from lowering import lower
+from pyc_parser import parse_file
+import induction
+import optimizer
+import ssa
+
+PRIMES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "examples", "ex09.sil"
+)
+
+
+def loop_muls(program):
+    count = 0
+    for fun in program.functions:
+        graph = CFG(fun)
+        for i, block in enumerate(fun.blocks):
+            if graph.loop_depth(i):
+                count += sum(instr.op == Op.Mul for instr in block.instrs)
+    return count
+
+
+def run(source, mul_cost):
+    program = lower(parse_file(source))
+    ssa.program_to_ssa(program)
+    optimizer.optimize(program, ["sccp", "gvn", "licm"])
+    if mul_cost is not None:
+        for fun in program.functions:
+            induction.reduce_strength(fun, mul_cost)
+    optimizer.optimize(program, ["dce"])
+    interpreter = Interpreter(program)
+    time, _ = timed(interpreter.run)
+    return (interpreter.output, loop_muls(program), interpreter.steps, time)
+
+
+def main():
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    with open(PRIMES) as file:
+        source = file.read()
+    source = source.replace("long limit = 100000;", f"long limit = {limit};")
+    outputs = []
+    for name, mul_cost in [
+        ("off", None),
+        ("on", induction.MUL_COST),
+        ("forced", 20),
+    ]:
+        (output, muls, steps, time) = run(source, mul_cost)
+        outputs.append(output)
+        print(
+            f"primes({limit}), iv {name:>6}: {muls} mul in the loops, "
+            f"{steps} instrs run, {time:.2f}s"
+        )
+    assert all(output == outputs[0] for output in outputs)
+
+
+if __name__ == "__main__":
+    main()
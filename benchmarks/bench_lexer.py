@@ -0,0 +1,55 @@
+"""
+Lexer throughput and memory: the original lexer, the regex-based `tokenize`
+and the array-backed TokenStream.
+
+usage: python benchmarks/bench_lexer.py [size in MB]
+"""
+
+import sys
+import tracemalloc
+
+from programs import straight_line, timed
+from lexer import tokenize, tokenize_reference, TokenStream
+
+
+def all_tokens(lexer, source):
+    tokens = lexer(source)
+    if not isinstance(tokens, TokenStream):
+        tokens = list(tokens)
+    return tokens
+
+
+def peak_memory(lexer, source):
+    """Peak memory (in MB) needed to keep all the tokens in memory"""
+    tracemalloc.start()
+    tokens = all_tokens(lexer, source)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del tokens
+    return peak / 2 ** 20
+
+
+def main():
+    megabytes = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    source = straight_line(1000)
+    source *= max(1, int(megabytes * 2 ** 20 / len(source)))
+    print(f"input: {len(source) / 2 ** 20:.1f} MB")
+
+    lexers = [
+        ("reference", tokenize_reference),
+        ("regex", tokenize),
+        ("stream", TokenStream),
+    ]
+    for name, lexer in lexers:
+        elapsed, tokens = timed(all_tokens, lexer, source)
+        count = len(tokens)
+        del tokens
+        memory = peak_memory(lexer, source)
+        print(
+            f"{name:>10}: {count} tokens in {elapsed:.2f}s, "
+            f"{count / elapsed / 1e6:.2f}M tokens/s, {memory:.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Loop-invariant code motion (see licm) on the primes program (examples/ex09)
+and on a version of it which keeps the limit in a global: the instructions
+run by the interpreter and its time, without and with the pass.
+
+usage: python benchmarks/bench_licm.py [limit]
+"""
+
+import os
+import sys
+
+from programs import timed
+from interpreter import Interpreter
+from lowering import lower
+from pyc_parser import parse_file
+import optimizer
+import ssa
+
+PRIMES = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "examples", "ex09.sil"
+)
+WITHOUT = ["sccp", "gvn", "dce"]
+WITH = ["sccp", "gvn", "licm", "dce"]
+
+
+def sources(limit):
+    with open(PRIMES) as file:
+        source = file.read()
+    source = source.replace("long limit = 100000;", f"long limit = {limit};")
+    yield ("primes", source)
+    source = source.replace(f"long limit = {limit};", f"limit = {limit};")
+    yield ("global limit", "long limit;\n" + source)
+
+
+def run(source, passes):
+    program = lower(parse_file(source))
+    ssa.program_to_ssa(program)
+    optimizer.optimize(program, passes)
+    interpreter = Interpreter(program)
+    time, _ = timed(interpreter.run)
+    return (interpreter.output, interpreter.steps, time)
+
+
+def main():
+    limit = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    for name, source in sources(limit):
+        (output, steps_off, time_off) = run(source, WITHOUT)
+        (output_on, steps_on, time_on) = run(source, WITH)
+        assert output == output_on
+        print(
+            f"{name:>12}({limit}): licm off {steps_off} instrs {time_off:.2f}s, "
+            f"on {steps_on} instrs {time_on:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
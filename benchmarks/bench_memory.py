@@ -0,0 +1,86 @@
+"""
+Memory used by the AST of a generated 100k-statement program.
+
+For every node type we report how many nodes there are and how many bytes
+one node takes (the object itself, its __dict__ if any, and the container of
+its children), as measured by tracemalloc. We also measure the whole
+tree, and the tree together with the renamed copy made by the code
+generator.
+
+usage: python benchmarks/bench_memory.py [number of statements]
+"""
+
+import gc
+import sys
+import tracemalloc
+from collections import Counter, defaultdict
+from dataclasses import fields
+
+from programs import straight_line
+from lexer import TokenStream
+from pyc_parser import Parser
+from rename import rename_vars
+
+
+def all_nodes(tree):
+    """All the nodes of the tree, grouped by type"""
+    nodes = defaultdict(list)
+    todo = [tree]
+    while todo:
+        x = todo.pop()
+        if isinstance(x, (list, tuple)):
+            todo.extend(x)
+        elif hasattr(x, "__dataclass_fields__"):
+            nodes[type(x)].append(x)
+            todo.extend(getattr(x, f.name) for f in fields(x))
+    return nodes
+
+
+def copy_node(node):
+    """A new node with the same fields, the containers of children are copied"""
+    values = []
+    for f in fields(node):
+        value = getattr(node, f.name)
+        if isinstance(value, (list, tuple)):
+            value = type(value)(list(value))
+        values.append(value)
+    return type(node)(*values)
+
+
+def traced(fun, *args):
+    """(the result of fun(*args), bytes allocated and still in use)"""
+    gc.collect()
+    tracemalloc.start()
+    result = fun(*args)
+    used = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, used
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    stream = TokenStream(straight_line(size))
+
+    defs, tree_bytes = traced(lambda: Parser(stream).parse_file_top())
+    nodes = all_nodes(defs)
+    count = sum(len(ns) for ns in nodes.values())
+
+    print(f"{size} statements, {count} nodes")
+    print(f"{'node type':>14} {'count':>9} {'bytes/node':>11} {'total MB':>9}")
+    totals: Counter = Counter()
+    for tp, ns in sorted(nodes.items(), key=lambda item: -len(item[1])):
+        copies, used = traced(lambda: [copy_node(n) for n in ns])
+        per_node = (used - sys.getsizeof(copies)) / len(ns)
+        totals[tp] = per_node * len(ns)
+        print(f"{tp.__name__:>14} {len(ns):>9} {per_node:>11.1f} {totals[tp] / 1e6:>9.2f}")
+        del copies
+
+    print(f"{'all nodes':>14} {count:>9} {sum(totals.values()) / count:>11.1f} "
+          f"{sum(totals.values()) / 1e6:>9.2f}")
+    print(f"parsed tree: {tree_bytes / 1e6:.2f} MB ({tree_bytes / count:.1f} bytes/node)")
+    _, renamed_bytes = traced(rename_vars, defs)
+    print(f"renamed copy: {renamed_bytes / 1e6:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+"""
+Parallel parsing: parse a generated multi-megabyte file with 1, 2, 4, ...
+worker processes (up to twice the number of CPUs).
+
+usage: python benchmarks/bench_parallel.py [number of functions]
+"""
+
+import os
+import sys
+
+from programs import many_functions, timed
+from parallel_parser import parse_file_parallel
+
+
+def main():
+    n_funs = int(sys.argv[1]) if len(sys.argv) > 1 else 20_000
+    source = many_functions(n_funs)
+    cpus = os.cpu_count() or 1
+    print(f"{n_funs} functions, {len(source) / 1e6:.1f} MB of source, {cpus} CPUs")
+    base = None
+    workers = 1
+    while workers <= max(2 * cpus, 4):
+        elapsed, _ = timed(parse_file_parallel, source, workers)
+        base = base or elapsed
+        print(f"{workers:>4} workers: {elapsed:6.2f}s, speedup {base / elapsed:.2f}x")
+        workers *= 2
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""
+Parser scaling: parse generated programs of 1k, 10k and 100k statements.
+
+The time per statement should stay (roughly) the same for all sizes.
+
+usage: python benchmarks/bench_parser.py [max number of statements]
+"""
+
+import sys
+
+from programs import straight_line, timed
+from lexer import TokenStream
+from pyc_parser import Parser
+
+
+def parse(stream):
+    return Parser(stream).parse_file_top()
+
+
+def main():
+    max_size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    size = 1000
+    while size <= max_size:
+        source = straight_line(size)
+        stream = TokenStream(source)
+        repeat = 3 if size < max_size else 1
+        elapsed, _ = timed(parse, stream, repeat=repeat)
+        print(
+            f"{size:>8} statements, {len(stream):>8} tokens: {elapsed:6.2f}s, "
+            f"{elapsed / size * 1e6:.1f} us/statement"
+        )
+        size *= 10
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+The passes after parsing: the semantic analysis (type_checker.check, which
+also resolves every variable and lays out the frames) and code generation,
+straight from the tree or through the intermediate code (lowering and the
+x86-64 backend).
+
+The semantic analysis is compared with a bare walk over the tree, which
+does nothing at the nodes, and with scoping, renaming and collecting the
+local variables as separate walks.
+
+usage: python benchmarks/bench_passes.py [number of statements]
+"""
+
+import sys
+
+from programs import straight_line, many_functions, timed
+import pyc_ast as E
+from backend import compile_program
+from code_generator import compile_top
+from local_vars import get_local_vars
+from lowering import lower
+from pyc_parser import parse_file
+from rename import rename_vars
+from type_checker import check
+from visitor import Walk
+
+
+def separate_walks(defs):
+    check(defs)
+    renamed = rename_vars(defs)
+    for decl in renamed:
+        if type(decl) is E.FunDecl:
+            get_local_vars(decl.body)
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    for (name, source) in [
+        ("straight line", straight_line(size)),
+        ("many functions", many_functions(size // 5)),
+    ]:
+        defs = parse_file(source)
+        bare, _ = timed(Walk([]).run, defs)
+        separate, _ = timed(separate_walks, defs)
+        checking, symbol_table = timed(check, defs)
+        codegen, _ = timed(compile_top, defs, symbol_table)
+        debug, _ = timed(compile_top, defs, symbol_table, True)
+        lowering, program = timed(lower, defs, symbol_table)
+        emitting, _ = timed(compile_program, program)
+        print(
+            f"{name}, {size} statements:\n"
+            f"  bare walk {bare:.2f}s, semantic analysis {checking:.2f}s "
+            f"({checking / bare:.1f} walks), as separate walks {separate:.2f}s\n"
+            f"  codegen {codegen:.2f}s (with the debug checks {debug:.2f}s)\n"
+            f"  lowering {lowering:.2f}s, x86-64 from the IR {emitting:.2f}s"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+The construction and the destruction of the SSA form, for programs of
+growing sizes: the time per instruction should stay about the same.
+
+usage: python benchmarks/bench_ssa.py [size]
+"""
+
+import sys
+
+import programs
+from programs import timed
+from lowering import lower
+from pyc_parser import parse_file
+import ssa
+
+SHAPES = [
+    programs.straight_line,
+    programs.many_functions,
+    programs.loop_sequence,
+    programs.else_if_chain,
+    programs.nested_ifs,
+    programs.nested_loops,
+]
+
+
+def count(program, op=None):
+    return sum(
+        1
+        for fun in program.functions
+        for block in fun.blocks
+        for instr in block.instrs
+        if op is None or instr.op == op
+    )
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 5_000
+    for shape in SHAPES:
+        for n in (size, 2 * size, 4 * size):
+            tree = parse_file(shape(n))
+            program = lower(tree)
+            instrs = count(program)
+            to_time, _ = timed(ssa.program_to_ssa, program)
+            phis = count(program, ssa.Op.Phi)
+            from_time, _ = timed(ssa.program_from_ssa, program)
+            print(
+                f"{shape.__name__:>14}({n}): {instrs} instrs, {phis} phis, "
+                f"to SSA {to_time:.3f}s ({to_time / instrs * 1e6:.1f}us per instr), "
+                f"out of SSA {from_time:.3f}s"
+            )
+
+
+if __name__ == "__main__":
+    main()
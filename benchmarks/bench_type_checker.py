@@ -0,0 +1,34 @@
+"""
+Type checking programs with many global variables: the blocks must not
+copy the environment. Also the two-phase check, with the definitions
+checked by a pool of workers.
+
+usage: python benchmarks/bench_type_checker.py [number of globals]
+"""
+
+import os
+import sys
+
+from programs import many_globals, timed
+from pyc_parser import parse_file
+from type_checker import check
+
+
+def main():
+    n_globals = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    for n_funs in [1000, 2000, 4000]:
+        defs = parse_file(many_globals(n_globals, n_funs))
+        elapsed, _ = timed(check, defs, repeat=3)
+        print(f"{n_globals} globals, {n_funs} functions: {elapsed:.3f}s")
+
+    print(f"two phases ({os.cpu_count()} CPUs):")
+    defs = parse_file(many_globals(n_globals, 40_000))
+    sequential, _ = timed(check, defs)
+    print(f"  {n_globals} globals, 40000 functions, one pass: {sequential:.2f}s")
+    for workers in [1, 2, 4, 8]:
+        elapsed, _ = timed(check, defs, workers)
+        print(f"  {workers} workers: {elapsed:.2f}s ({sequential / elapsed:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""
+Synthetic SIL programs for the benchmarks.
+
+The benchmarks are plain scripts, run them from the repository root, e.g.
+
+    python benchmarks/bench_lexer.py
+
+Importing this module also makes the compiler modules in `src` importable.
+"""
+
+import os
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+
+# A few statements in the style of the examples, we cycle through them
+# to get a body of the requested length.
+_statement_templates = [
+    "x{i} = x{i} + {i} * 3;",
+    "if (x{i} % 2 == 0 && y >= {i}) {{ y += x{i}; }} else {{ y -= 1; }}",
+    "while (x{i} > 0) {{ x{i} -= 1; }}",
+    "print(foo(x{i}, y) + *p);",
+    "y = (y + 7) / 2 - {i};",
+]
+
+
+def straight_line(n_stms):
+    """A `main` function with n_stms statements (declarations included)."""
+    lines = [
+        "// generated",
+        "long foo(long a, long b) {",
+        "  return a + b;",
+        "}",
+        "",
+        "int main() {",
+        "  long y = 0;",
+        "  long* p = &y;",
+    ]
+    templates = _statement_templates
+    for i in range(n_stms):
+        if i % len(templates) == 0:
+            lines.append(f"  long x{i} = {i};")
+        else:
+            k = i - i % len(templates)
+            lines.append("  " + templates[i % len(templates)].format(i=k))
+    lines.append("  return 0;")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def many_functions(n_funs, stms_per_fun=5):
+    """A program with n_funs small functions and a main calling all of them."""
+    chunks = []
+    for f in range(n_funs):
+        body = [f"long fun{f}(long a, long b) {{", "  long s = 0;"]
+        for i in range(stms_per_fun):
+            body.append(f"  if (a > {i}) {{ s += a * {i} + b; }} else {{ s -= b; }}")
+        body.append("  return s;")
+        body.append("}")
+        chunks.append("\n".join(body))
+    calls = "\n".join(f"  print(fun{f}({f}, 2));" for f in range(n_funs))
+    chunks.append(f"int main() {{\n{calls}\n  return 0;\n}}")
+    return "\n\n".join(chunks) + "\n"
+
+
+def many_globals(n_globals, n_funs=1000):
+    """n_globals global variables and n_funs functions with a few blocks each."""
+    chunks = [f"long g{i} = {i};" for i in range(n_globals)]
+    for f in range(n_funs):
+        g = f % n_globals
+        chunks.append(
+            f"long fun{f}(long a) {{\n"
+            f"  if (a > g{g}) {{ long b = a; g{g} += b; }} else {{ a -= 1; }}\n"
+            f"  while (a > 0) {{ {{ a -= 1; }} }}\n"
+            f"  return a;\n}}"
+        )
+    chunks.append("int main() {\n  return fun0(g0);\n}")
+    return "\n".join(chunks) + "\n"
+
+
+def loop_sequence(n_loops):
+    """A `main` function with n_loops loops, one after another, with ifs inside."""
+    loops = [
+        f"  while (x < {k + 2}) {{\n"
+        f"    if (x % 2 == 0) {{ y += x; }} else {{ if (y > x) {{ break; }} }}\n"
+        f"    x += 1;\n"
+        f"  }}"
+        for k in range(n_loops)
+    ]
+    body = "\n".join(loops) + "\n  print(y);"
+    return _main(body, decls="  long x = 1;\n  long y = 0;\n")
+
+
+# Deeply nested programs, every one of them prints 1 when run
+
+
+def _main(body, decls="  long x = 1;\n"):
+    return f"int main() {{\n{decls}{body}\n  return 0;\n}}\n"
+
+
+def nested_ifs(depth):
+    """`if (x > 0) { if (x > 0) { ... print(x); } }`"""
+    return _main("if (x > 0) {\n" * depth + "print(x);" + "\n}" * depth)
+
+
+def nested_whiles(depth):
+    """Nested loops, each one runs once and breaks."""
+    body = "while (x > 0) {\n" * depth + "print(x);"
+    return _main(body + "\nbreak;\n}" * depth)
+
+
+def nested_blocks(depth):
+    """Nested blocks, each one declares its own variable."""
+    body = "{\nlong x = 1;\n" * depth + "print(x);" + "\n}" * depth
+    return _main(body)
+
+
+def else_if_chain(length):
+    """`if (x == 0) ... else if (x == 1) ... else print(x);`"""
+    cases = "".join(f"if (x == {i + 2}) print({i});\nelse " for i in range(length))
+    return _main(cases + "print(x);")
+
+
+def nested_loops(depth):
+    """Nested loops, each one runs once and counts its iterations."""
+    head = "".join(f"long i{k} = 0;\nwhile (i{k} < 1) {{\n" for k in range(depth))
+    tail = "".join(f"\ni{k} += 1;\n}}" for k in reversed(range(depth)))
+    return _main(head + "print(x);" + tail)
+
+
+def long_sum(length):
+    """print(x + x + ... + x - (length - 1));"""
+    return _main(f"print({' + '.join(['x'] * length)} - {length - 1});")
+
+
+def deep_parens(depth):
+    """print((id((id(...(x)...))));"""
+    expr = "(id(" * depth + "x" + "))" * depth
+    fun = "long id(long a) {\n  return a;\n}\n\n"
+    return fun + _main(f"print({expr});")
+
+
+def timed(fun, *args, repeat=1):
+    """Returns the best wall-clock time of running fun(*args) and its result."""
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fun(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
@@ -0,0 +1,385 @@
+"""
+A flat representation of the AST.
+
+All the nodes of a compilation unit live in parallel arrays, and they are
+referred to by integer ids:
+
+- kind: the type of the node, an index into NODE_TYPES
+- op: the operator, or another enum field (e.g. VarKind), an index into ENUMS
+- value: the first constant field (e.g. the identifier or the literal),
+  an index into the table of constants
+- a, b, c: the other fields, in the order given by LAYOUTS. Depending on
+  the field these are ids of child nodes (-1 for None), ids of lists of
+  children, or indices into the constants (e.g. the types).
+
+The children of a list are stored consecutively in the items array.
+
+Children are created before their parents, so the ids are a postorder of
+the tree, and a whole-program pass can be a simple loop over the ids
+instead of a tree walk (see Arena.to_tree).
+
+ArenaBuilder has the same interface as pyc_ast.TreeBuilder, so the Parser
+can build an arena directly. Arena.view gives pyc_ast nodes whose children
+are materialized lazily, so the existing visitors also run on arenas.
+"""
+
+from array import array
+from dataclasses import fields
+from enum import Enum
+from typing import Any, Optional
+
+import pyc_ast as E
+from lexer import TokenStream
+from pyc_parser import Parser
+
+# How the fields of every node type are stored
+NODE = "node"  # a child node, or None
+LIST = "list"  # a list of child nodes
+CONST = "const"  # a constant, e.g. a name, a number or a type
+ENUM = "enum"  # an enum member, kept in the op array (at most one per node)
+
+LAYOUTS: dict[type, tuple[str, ...]] = {
+    E.Var: (CONST,),
+    E.ArithLit: (CONST,),
+    E.ArithUnaryop: (ENUM, NODE),
+    E.ArithBinop: (ENUM, NODE, NODE),
+    E.ArithAssign: (CONST, NODE),
+    E.BoolArithCmp: (ENUM, NODE, NODE),
+    E.BoolNeg: (NODE,),
+    E.BoolBinop: (ENUM, NODE, NODE),
+    E.FunCall: (CONST, LIST),
+    E.StmExpr: (NODE,),
+    E.StmDecl: (CONST, CONST, NODE, ENUM),
+    E.StmIf: (NODE, LIST, LIST),
+    E.StmWhile: (NODE, LIST),
+    E.StmPrint: (NODE,),
+    E.StmReturn: (NODE,),
+    E.StmBreak: (),
+    E.StmContinue: (),
+    E.StmBlock: (LIST,),
+    E.FunDecl: (CONST, CONST, CONST, LIST),
+}
+
+NODE_TYPES = list(LAYOUTS)
+KINDS = {tp: kind for kind, tp in enumerate(NODE_TYPES)}
+
+ENUMS: list[Enum] = [
+    member
+    for tp in (E.ArithUnaryOp, E.ArithOp, E.ArithCmp, E.BoolOp, E.VarKind)
+    for member in tp
+]
+ENUM_IDS = {member: i for i, member in enumerate(ENUMS)}
+
+_DEREF = E.ArithUnaryOp.Deref
+
+
+def _columns(layout) -> list[int]:
+    """Where the fields are stored: -1 is op, 0 is value, 1 is a etc."""
+    columns: list[int] = []
+    free = [1, 2, 3]
+    for storage in layout:
+        if storage is ENUM:
+            columns.append(-1)
+        elif storage is CONST and 0 not in columns:
+            columns.append(0)
+        else:
+            columns.append(free.pop(0))
+    return columns
+
+
+COLUMNS = [_columns(LAYOUTS[tp]) for tp in NODE_TYPES]
+
+# The leaves are always materialized, e.g. the code generator expects
+# a real Var as the argument of & and *
+_LEAVES = (KINDS[E.Var], KINDS[E.ArithLit])
+
+
+class Arena:
+    def __init__(self):
+        self.kind = array("B")
+        self.op = array("B")
+        self.value = array("i")
+        self.a = array("i")
+        self.b = array("i")
+        self.c = array("i")
+        # list i is items[list_bounds[i]:list_bounds[i + 1]]
+        self.items = array("i")
+        self.list_bounds = array("i", [0])
+        self.constants: list[Any] = []
+        # the top-level definitions
+        self.roots: list[int] = []
+
+    def __len__(self) -> int:
+        """The number of nodes"""
+        return len(self.kind)
+
+    def node_type(self, i: int) -> type:
+        return NODE_TYPES[self.kind[i]]
+
+    def list_items(self, i: int) -> array:
+        start = self.list_bounds[i]
+        end = self.list_bounds[i + 1]
+        return self.items[start:end]
+
+    # -----------------------------------
+    # Conversions to pyc_ast nodes
+
+    def _row(self, i: int) -> tuple[int, int, int, int]:
+        return (self.value[i], self.a[i], self.b[i], self.c[i])
+
+    def _fields(self, i: int, node) -> list:
+        """The fields of the i-th node, node(id) gives the child nodes"""
+        kind = self.kind[i]
+        row = self._row(i)
+        values = []
+        for storage, column in zip(LAYOUTS[NODE_TYPES[kind]], COLUMNS[kind]):
+            if storage is ENUM:
+                values.append(ENUMS[self.op[i]])
+                continue
+            x = row[column]
+            if storage is CONST:
+                values.append(self.constants[x])
+            elif storage is NODE:
+                values.append(node(x) if x >= 0 else None)
+            else:
+                start = self.list_bounds[x]
+                end = self.list_bounds[x + 1]
+                values.append(tuple(node(y) for y in self.items[start:end]))
+        return values
+
+    def view(self, i: int):
+        """
+        The i-th node as a pyc_ast node, but its children (except for the
+        leaves) are ArenaNodes, which are converted only when visited.
+        """
+        return NODE_TYPES[self.kind[i]](*self._fields(i, self._child))
+
+    def _child(self, i: int):
+        if self.kind[i] in _LEAVES:
+            return self.view(i)
+        return ArenaNode(self, i)
+
+    def subtree(self, i: int):
+        """The i-th node as an ordinary pyc_ast tree"""
+        # the ids of all the descendants
+        ids = [i]
+        for j in ids:
+            kind = self.kind[j]
+            row = self._row(j)
+            for storage, column in zip(LAYOUTS[NODE_TYPES[kind]], COLUMNS[kind]):
+                if storage is NODE and row[column] >= 0:
+                    ids.append(row[column])
+                elif storage is LIST:
+                    ids.extend(self.list_items(row[column]))
+        nodes: dict[int, Any] = {}
+        for j in sorted(ids):
+            tp = NODE_TYPES[self.kind[j]]
+            nodes[j] = tp(*self._fields(j, nodes.__getitem__))
+        return nodes[i]
+
+    def views(self) -> list:
+        """The top-level definitions, e.g. for check or compile_top"""
+        return [self.view(root) for root in self.roots]
+
+    def to_tree(self) -> list:
+        """The top-level definitions as ordinary pyc_ast trees"""
+        nodes: list = []
+        add = nodes.append
+        node = nodes.__getitem__
+        # children come first, so a single loop suffices
+        for i in range(len(self.kind)):
+            add(NODE_TYPES[self.kind[i]](*self._fields(i, node)))
+        return [nodes[root] for root in self.roots]
+
+    @staticmethod
+    def from_tree(defs) -> "Arena":
+        """An arena with the given top-level definitions"""
+        builder = ArenaBuilder()
+        done: dict[int, int] = {}
+        todo = list(reversed(defs))
+        while todo:
+            node = todo[-1]
+            layout = LAYOUTS[type(node)]
+            values = [getattr(node, f.name) for f in fields(node)]
+            children = [
+                child
+                for (storage, value) in zip(layout, values)
+                if storage is NODE or storage is LIST
+                for child in (value if storage is LIST else [value])
+                if child is not None and id(child) not in done
+            ]
+            if children:
+                todo.extend(reversed(children))
+                continue
+            todo.pop()
+            for k, storage in enumerate(layout):
+                if storage is NODE and values[k] is not None:
+                    values[k] = done[id(values[k])]
+                elif storage is LIST:
+                    values[k] = [done[id(child)] for child in values[k]]
+            done[id(node)] = builder.add(type(node), values)
+        return builder.finish([done[id(decl)] for decl in defs])
+
+
+class ArenaNode:
+    """A node of an arena, which visitors see as the pyc_ast node"""
+
+    __slots__ = ("arena", "id")
+
+    def __init__(self, arena: Arena, i: int):
+        self.arena = arena
+        self.id = i
+
+    def materialize(self):
+        return self.arena.view(self.id)
+
+    def accept(self, visitor):
+        return self.materialize().accept(visitor)
+
+    def __repr__(self):
+        return f"ArenaNode({self.arena.node_type(self.id).__name__}, {self.id})"
+
+
+# -----------------------------------------
+# Building arenas
+# -----------------------------------------
+
+
+class ArenaBuilder:
+    """Adds nodes to an arena, see pyc_ast.TreeBuilder"""
+
+    def __init__(self):
+        self.arena = Arena()
+        self._constant_ids: dict[Any, int] = {}
+
+    def finish(self, roots: list[int]) -> Arena:
+        self.arena.roots = list(roots)
+        return self.arena
+
+    def constant(self, value) -> int:
+        # 1 and True are equal keys, so the type is a part of the key
+        key = (type(value), value)
+        i = self._constant_ids.get(key)
+        if i is None:
+            i = self._constant_ids[key] = len(self.arena.constants)
+            self.arena.constants.append(value)
+        return i
+
+    def add_list(self, ids) -> int:
+        arena = self.arena
+        arena.items.extend(ids)
+        arena.list_bounds.append(len(arena.items))
+        return len(arena.list_bounds) - 2
+
+    def add(self, tp: type, values) -> int:
+        """Adds a node of the given type, the child nodes are given by ids"""
+        arena = self.arena
+        kind = KINDS[tp]
+        op = 0
+        row = [-1, -1, -1, -1]
+        for storage, column, value in zip(LAYOUTS[tp], COLUMNS[kind], values):
+            if storage is ENUM:
+                op = ENUM_IDS[value]
+            elif storage is CONST:
+                row[column] = self.constant(value)
+            elif storage is NODE:
+                row[column] = value if value is not None else -1
+            else:
+                row[column] = self.add_list(value)
+        arena.kind.append(kind)
+        arena.op.append(op)
+        arena.value.append(row[0])
+        arena.a.append(row[1])
+        arena.b.append(row[2])
+        arena.c.append(row[3])
+        return len(arena.kind) - 1
+
+    # The constructors, with the same arguments as the pyc_ast classes
+
+    def Var(self, var):
+        return self.add(E.Var, (var,))
+
+    def ArithLit(self, num):
+        return self.add(E.ArithLit, (num,))
+
+    def ArithUnaryop(self, op, a):
+        return self.add(E.ArithUnaryop, (op, a))
+
+    def ArithBinop(self, op, a1, a2):
+        return self.add(E.ArithBinop, (op, a1, a2))
+
+    def ArithAssign(self, lvalue, a):
+        return self.add(E.ArithAssign, (lvalue, a))
+
+    def BoolArithCmp(self, op, a1, a2):
+        return self.add(E.BoolArithCmp, (op, a1, a2))
+
+    def BoolNeg(self, b):
+        return self.add(E.BoolNeg, (b,))
+
+    def BoolBinop(self, op, b1, b2):
+        return self.add(E.BoolBinop, (op, b1, b2))
+
+    def FunCall(self, name, args):
+        return self.add(E.FunCall, (name, args))
+
+    def StmExpr(self, a):
+        return self.add(E.StmExpr, (a,))
+
+    def StmDecl(self, tp, var, a, kind=E.VarKind.Local):
+        return self.add(E.StmDecl, (tp, var, a, kind))
+
+    def StmIf(self, b, ss1, ss2):
+        return self.add(E.StmIf, (b, ss1, ss2))
+
+    def StmWhile(self, b, ss):
+        return self.add(E.StmWhile, (b, ss))
+
+    def StmPrint(self, a):
+        return self.add(E.StmPrint, (a,))
+
+    def StmReturn(self, a):
+        return self.add(E.StmReturn, (a,))
+
+    def StmBreak(self):
+        return self.add(E.StmBreak, ())
+
+    def StmContinue(self):
+        return self.add(E.StmContinue, ())
+
+    def StmBlock(self, ss):
+        return self.add(E.StmBlock, (ss,))
+
+    def FunDecl(self, tp, name, params, body):
+        return self.add(E.FunDecl, (tp, name, tuple(params), body))
+
+    # What the parser needs to know about the nodes
+
+    def as_lvalue(self, i: int) -> Optional[E.LValue]:
+        arena = self.arena
+        kind = arena.kind[i]
+        if kind == KINDS[E.Var]:
+            return E.lvalue_var(arena.constants[arena.value[i]])
+        elif kind == KINDS[E.ArithUnaryop] and ENUMS[arena.op[i]] == _DEREF:
+            child = arena.a[i]
+            assert arena.kind[child] == KINDS[E.Var]
+            return E.lvalue_pointer(arena.constants[arena.value[child]])
+        else:
+            return None
+
+    def lvalue_expr(self, lvalue: E.LValue) -> int:
+        var = self.Var(lvalue.loc)
+        if lvalue.kind == E.LValueKind.Var:
+            return var
+        else:
+            return self.ArithUnaryop(E.ArithUnaryOp.Deref, var)
+
+    def describe(self, i: int) -> str:
+        return str(self.arena.subtree(i))
+
+
+def parse_file(s: str) -> Arena:
+    """pyc_parser.parse_file, but the result is an arena"""
+    builder = ArenaBuilder()
+    defs = Parser(TokenStream(s), builder=builder).parse_file_top()
+    return builder.finish(defs)
@@ -0,0 +1,323 @@
+"""
+An on-disk cache of parsed programs.
+
+The cache maps the contents of a source file to its AST, as returned by
+pyc_parser.parse_file. The entries are content-addressed: the key is a hash
+of the source and of the compiler version (the sources of the frontend
+modules), so a changed file or a changed parser never gets a stale AST.
+
+The ASTs are stored in a compact binary format (see encode/decode) and the
+total size of the cache is bounded, the least recently used entries are
+removed first.
+"""
+
+import hashlib
+import marshal
+import os
+import tempfile
+import zlib
+from array import array
+from dataclasses import is_dataclass
+from enum import Enum
+from operator import attrgetter
+from typing import Optional
+
+import pyc_ast as E
+from gc_pause import gc_paused
+import pyc_parser
+
+# Bump when the binary format changes
+FORMAT_VERSION = 1
+
+# The modules whose changes make the cached ASTs invalid
+FRONTEND_MODULES = ["lexer.py", "pyc_parser.py", "pyc_ast.py", "ast_cache.py"]
+
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+SUFFIX = ".ast"
+
+
+def default_cache_dir() -> str:
+    cache_home = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return os.path.join(cache_home, "pyc")
+
+
+_compiler_version = None
+
+
+def compiler_version() -> bytes:
+    """A hash of the format version and the sources of the frontend"""
+    global _compiler_version
+    if _compiler_version is None:
+        digest = hashlib.sha256(f"pyc-ast-{FORMAT_VERSION}".encode())
+        src_dir = os.path.dirname(os.path.abspath(__file__))
+        for module in FRONTEND_MODULES:
+            with open(os.path.join(src_dir, module), "rb") as f:
+                digest.update(f.read())
+        _compiler_version = digest.digest()
+    return _compiler_version
+
+
+# -----------------------------------------
+# Binary serialization of the AST
+# -----------------------------------------
+#
+# The tree is flattened in postorder to a sequence of (opcode, argument)
+# pairs, which rebuild it when executed on a stack machine:
+#
+#   NONE            push None
+#   INT n           push n
+#   BIGINT i        push int(strings[i]), for numbers which don't fit 64 bits
+#   STR i           push strings[i]
+#   ENUM i          push _enum_members[i]
+#   LIST n          pop n values and push them as a list (the nodes keep their
+#                   children in tuples, but their constructors convert lists)
+#   NODE i          pop the fields of _node_classes[i] and push the node
+#
+# The opcodes and arguments are kept in two arrays, the strings are deduped.
+# Neither encoding nor decoding is recursive, so deep trees are fine.
+
+(_NONE, _INT, _BIGINT, _STR, _ENUM, _LIST, _NODE) = range(7)
+
+_node_classes = [
+    cls for cls in vars(E).values() if isinstance(cls, type) and is_dataclass(cls)
+]
+_node_ids = {cls: i for i, cls in enumerate(_node_classes)}
+_node_fields = [tuple(cls.__dataclass_fields__) for cls in _node_classes]
+# the fields of the nodes which have more than one, as tuples
+_node_getters = {
+    i: attrgetter(*fields) for i, fields in enumerate(_node_fields) if len(fields) > 1
+}
+
+_enum_members = [
+    member
+    for cls in vars(E).values()
+    if isinstance(cls, type) and issubclass(cls, Enum) and cls is not Enum
+    for member in cls
+]
+_enum_ids = {member: i for i, member in enumerate(_enum_members)}
+
+_INT_MIN = -(2**63)
+_INT_MAX = 2**63 - 1
+
+
+# marks the end of a LIST or NODE on the encoder's stack, followed by its
+# opcode and argument
+_CLOSE = object()
+
+
+def encode(tree) -> bytes:
+    """Serializes an AST (or a list of them)"""
+    ops = array("B")
+    args = array("q")
+    strings: list[str] = []
+    string_ids: dict[str, int] = {}
+
+    todo = [tree]
+    pop = todo.pop
+    while todo:
+        x = pop()
+        tp = type(x)
+        if x is _CLOSE:
+            ops.append(pop())
+            args.append(pop())
+        elif tp is str:
+            i = string_ids.get(x)
+            if i is None:
+                i = string_ids[x] = len(strings)
+                strings.append(x)
+            ops.append(_STR)
+            args.append(i)
+        elif tp in _node_ids:
+            i = _node_ids[tp]
+            fields = _node_fields[i]
+            todo += (i, _NODE, _CLOSE)
+            if len(fields) == 1:
+                todo.append(getattr(x, fields[0]))
+            elif fields:
+                todo += _node_getters[i](x)[::-1]
+        elif tp is tuple or tp is list:
+            todo += (len(x), _LIST, _CLOSE)
+            todo += x[::-1]
+        elif x is None:
+            ops.append(_NONE)
+            args.append(0)
+        elif tp is int:
+            if _INT_MIN <= x <= _INT_MAX:
+                ops.append(_INT)
+                args.append(x)
+            else:
+                ops.append(_BIGINT)
+                args.append(len(strings))
+                strings.append(str(x))
+        elif x in _enum_ids:
+            ops.append(_ENUM)
+            args.append(_enum_ids[x])
+        else:
+            raise TypeError(f"cannot serialize {tp.__name__}: {x!r}")
+
+    payload = marshal.dumps((ops.tobytes(), args.tobytes(), strings))
+    return zlib.compress(payload, 1)
+
+
+def decode(data: bytes):
+    """The inverse of encode"""
+    with gc_paused():
+        return _decode(data)
+
+
+def _decode(data: bytes):
+    (ops_bytes, args_bytes, strings) = marshal.loads(zlib.decompress(data))
+    ops = array("B")
+    ops.frombytes(ops_bytes)
+    args = array("q")
+    args.frombytes(args_bytes)
+
+    node_classes = _node_classes
+    node_arity = [len(fields) for fields in _node_fields]
+    enum_members = _enum_members
+
+    stack: list = []
+    push = stack.append
+    for op, arg in zip(ops, args):
+        if op == _NODE:
+            n = node_arity[arg]
+            if n:
+                fields = stack[-n:]
+                del stack[-n:]
+                push(node_classes[arg](*fields))
+            else:
+                push(node_classes[arg]())
+        elif op == _STR:
+            push(strings[arg])
+        elif op == _ENUM:
+            push(enum_members[arg])
+        elif op == _INT:
+            push(arg)
+        elif op == _LIST:
+            if arg:
+                items = stack[-arg:]
+                del stack[-arg:]
+                push(items)
+            else:
+                push([])
+        elif op == _NONE:
+            push(None)
+        elif op == _BIGINT:
+            push(int(strings[arg]))
+        else:
+            raise ValueError(f"unknown opcode {op}")
+
+    if len(stack) != 1:
+        raise ValueError("malformed AST data")
+    return stack[0]
+
+
+# -----------------------------------------
+# The cache
+# -----------------------------------------
+
+
+class ASTCache:
+    def __init__(self, directory: Optional[str] = None, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory if directory is not None else default_cache_dir()
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, source: bytes) -> str:
+        digest = hashlib.sha256(compiler_version())
+        digest.update(source)
+        return digest.hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key + SUFFIX)
+
+    def load(self, key: str):
+        """The cached AST, or None if there is no (valid) entry"""
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            tree = decode(data)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, EOFError, TypeError, IndexError, zlib.error):
+            # a damaged entry, e.g. a partial write from a crashed process
+            self.remove(path)
+            return None
+        # mark as recently used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return tree
+
+    def store(self, key: str, tree):
+        """Adds the entry, a failure to write only means a miss next time"""
+        data = encode(tree)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(tmp_path, self.path(key))
+            except BaseException:
+                self.remove(tmp_path)
+                raise
+        except OSError:
+            return
+        self.evict()
+
+    def remove(self, path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        """(last use, size, path) of all the entries"""
+        entries = []
+        try:
+            with os.scandir(self.directory) as it:
+                for entry in it:
+                    if entry.name.endswith(SUFFIX):
+                        try:
+                            stat = entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            pass
+        return entries
+
+    def evict(self):
+        """Removes the least recently used entries until the cache fits max_size"""
+        entries = self.entries()
+        total = sum(size for (_, size, _) in entries)
+        if total <= self.max_size:
+            return
+        entries.sort()
+        for (_, size, path) in entries:
+            if total <= self.max_size:
+                break
+            self.remove(path)
+            total -= size
+
+    def parse_file(self, s: str, parse=pyc_parser.parse_file):
+        """parse(s), but the result comes from the cache if possible"""
+        key = self.key(s.encode("utf-8"))
+        tree = self.load(key)
+        if tree is not None:
+            self.hits += 1
+            return tree
+        self.misses += 1
+        tree = parse(s)
+        self.store(key, tree)
+        return tree
+
+    def stats(self) -> str:
+        return f"AST cache: {self.hits} hits, {self.misses} misses"
@@ -0,0 +1,306 @@
+"""
+The x86-64 backend: compiles the intermediate code (see ir) to NASM.
+
+The calling convention is the one of the old code generator (see
+code_generator): the arguments are pushed from right to left and popped by
+the caller, the result is returned in rax.
+
+There is no register allocation yet: every temporary has a slot in the
+stack frame (the params are where the caller pushed them), every
+instruction loads its operands into registers and stores its result.
+"""
+
+from collections import Counter
+
+from code_generator import asm_file, mangle, mangle_fun
+from division import divide_by_constant
+from ir import BINARY, COMPARISONS, INIT, Const, MemKind, Op, Temp, word
+
+WORD = 8
+
+CONDITIONS = {
+    Op.Eq: "e",
+    Op.Ne: "ne",
+    Op.Lt: "l",
+    Op.Le: "le",
+    Op.Gt: "g",
+    Op.Ge: "ge",
+}
+
+NEGATED = {"e": "ne", "ne": "e", "l": "ge", "ge": "l", "g": "le", "le": "g"}
+
+
+def fits_imm32(value: int) -> bool:
+    """Most instructions only take 32-bit immediate values"""
+    return -(1 << 31) <= value < (1 << 31)
+
+
+class FunctionCompiler:
+    def __init__(self, fun):
+        self.fun = fun
+        self.code: list[str] = []
+
+        # the addresses of the temporaries and the local slots,
+        # e.g. "rbp - 16", and the number of uses of the temporaries
+        self.addresses: dict = {}
+        self.uses: Counter = Counter()
+        self.frame_size = 0
+        for i, param in enumerate(fun.params):
+            # skip the stored rbp and the return address
+            self.addresses[param] = f"rbp + {WORD * (i + 2)}"
+        for slot in fun.slots:
+            self.allocate(slot)
+        for block in fun.blocks:
+            for instr in block.instrs:
+                if instr.dst is not None and instr.dst not in self.addresses:
+                    self.allocate(instr.dst)
+                for arg in instr.args:
+                    if type(arg) is Temp:
+                        self.uses[arg] += 1
+                        # e.g. a variable which is read before it is written
+                        if arg not in self.addresses:
+                            self.allocate(arg)
+
+    def allocate(self, var):
+        self.frame_size += WORD
+        self.addresses[var] = f"rbp - {self.frame_size}"
+
+    def emit(self, line):
+        self.code.append(f"    {line}")
+
+    # Operands
+
+    def address(self, var):
+        if var.kind == MemKind.Global:
+            return mangle(var.name)
+        return self.addresses[var]
+
+    def operand(self, x):
+        """The operand as an immediate value or a memory reference"""
+        if type(x) is Const:
+            return str(word(x.value))
+        return f"[{self.addresses[x]}]"
+
+    def source(self, x, scratch="rcx"):
+        """The operand, in a form which any instruction takes"""
+        if type(x) is Const and not fits_imm32(word(x.value)):
+            self.emit(f"mov {scratch}, {word(x.value)}")
+            return scratch
+        return self.operand(x)
+
+    def load(self, reg, x):
+        self.emit(f"mov {reg}, {self.operand(x)}")
+
+    def store(self, dst, reg="rax"):
+        self.emit(f"mov [{self.addresses[dst]}], {reg}")
+
+    def store_to(self, address, x):
+        """Stores the operand to the given memory address"""
+        if type(x) is Const and fits_imm32(word(x.value)):
+            self.emit(f"mov qword [{address}], {word(x.value)}")
+        else:
+            self.load("rax", x)
+            self.emit(f"mov [{address}], rax")
+
+    # Instructions
+
+    def compile_Copy(self, instr):
+        self.store_to(self.addresses[instr.dst], instr.args[0])
+
+    def compile_binary(self, instr):
+        (a, b) = instr.args
+        op = instr.op
+        self.load("rax", a)
+        if op == Op.Add:
+            self.emit(f"add rax, {self.source(b)}")
+        elif op == Op.Sub:
+            self.emit(f"sub rax, {self.source(b)}")
+        elif op == Op.Mul:
+            if type(b) is Const and fits_imm32(word(b.value)):
+                self.emit(f"imul rax, rax, {word(b.value)}")
+            else:
+                self.emit(f"imul rax, {self.source(b)}")
+        elif op == Op.Div or op == Op.Mod:
+            # unsigned, as in the old code generator
+            code = None
+            if type(b) is Const:
+                code = divide_by_constant(b.value, op == Op.Mod)
+            if code is not None:
+                for line in code:
+                    self.emit(line)
+            else:
+                self.load("rcx", b)
+                self.emit("xor rdx, rdx")
+                self.emit("div rcx")
+                if op == Op.Mod:
+                    self.emit("mov rax, rdx")
+        else:
+            self.emit(f"cmp rax, {self.source(b)}")
+            self.emit(f"set{CONDITIONS[op]} al")
+            self.emit("movzx rax, al")
+        self.store(instr.dst)
+
+    def compile_Addr(self, instr):
+        var = instr.args[0]
+        if var.kind == MemKind.Global:
+            self.emit(f"mov rax, {self.address(var)}")
+        else:
+            self.emit(f"lea rax, [{self.address(var)}]")
+        self.store(instr.dst)
+
+    def compile_Load(self, instr):
+        pointer = instr.args[0]
+        if type(pointer) is Temp or type(pointer) is Const:
+            self.load("rax", pointer)
+            self.emit("mov rax, [rax]")
+        else:
+            self.emit(f"mov rax, [{self.address(pointer)}]")
+        self.store(instr.dst)
+
+    def compile_Store(self, instr):
+        (pointer, value) = instr.args
+        if type(pointer) is Temp or type(pointer) is Const:
+            self.load("rcx", pointer)
+            self.store_to("rcx", value)
+        else:
+            self.store_to(self.address(pointer), value)
+
+    def push_args(self, args):
+        for arg in reversed(args):
+            if type(arg) is Temp:
+                self.emit(f"push qword {self.operand(arg)}")
+            else:
+                self.emit(f"push {self.source(arg, 'rax')}")
+
+    def compile_Call(self, instr):
+        (name, *args) = instr.args
+        self.push_args(args)
+        self.emit(f"call {mangle_fun(name)}")
+        if args:
+            self.emit(f"add rsp, {WORD * len(args)}")
+        if instr.dst is not None and self.uses[instr.dst] > 0:
+            self.store(instr.dst)
+
+    def compile_Print(self, instr):
+        self.emit(f"printint {self.operand(instr.args[0])}")
+
+    def compile_Ret(self, instr):
+        self.load("rax", instr.args[0])
+        self.emit("mov rsp, rbp")
+        self.emit("pop rbp")
+        self.emit("ret")
+
+    # Calls in tail positions (call, then return its result)
+
+    def is_tail_call(self, instrs):
+        """
+        The callee can reuse the stack frame if its arguments fit where ours
+        are, and no pointer to the frame may be passed to it (see tail)
+        """
+        if len(instrs) < 2:
+            return False
+        call = instrs[-2]
+        return (
+            call.op == Op.Call
+            and call.dst is not None
+            and instrs[-1].args[0] is call.dst
+            and len(call.args) - 1 <= len(self.fun.params)
+            and not self.fun.slots
+        )
+
+    def compile_tail_call(self, instr):
+        # the arguments replace ours (they are all pushed first, as they may
+        # be ours), then the callee returns straight to our caller
+        (name, *args) = instr.args
+        self.push_args(args)
+        for param in self.fun.params[: len(args)]:
+            self.emit(f"pop qword [{self.addresses[param]}]")
+        self.emit("mov rsp, rbp")
+        self.emit("pop rbp")
+        self.emit(f"jmp {mangle_fun(name)}")
+
+    # Jumps, the next block is reached by falling through
+
+    def jump(self, target, next_block):
+        if target is not next_block:
+            self.emit(f"jmp .{target.label}")
+
+    def branch(self, cond, if_true, if_false, next_block):
+        if if_true is next_block:
+            self.emit(f"j{NEGATED[cond]} .{if_false.label}")
+        else:
+            self.emit(f"j{cond} .{if_true.label}")
+            self.jump(if_false, next_block)
+
+    def compile_block(self, block, next_block):
+        self.code.append(f".{block.label}:")
+        instrs = block.instrs
+        last = instrs[-1]
+        compare = instrs[-2] if len(instrs) > 1 else last
+        fused = (
+            last.op == Op.Br
+            and compare.op in COMPARISONS
+            and compare.dst is last.args[0]
+            and self.uses[compare.dst] == 1
+        )
+        tail_call = last.op == Op.Ret and self.is_tail_call(instrs)
+        for instr in instrs[: -2 if fused or tail_call else -1]:
+            if instr.op in BINARY:
+                self.compile_binary(instr)
+            else:
+                COMPILERS[instr.op](self, instr)
+
+        if last.op == Op.Jmp:
+            self.jump(last.args[0], next_block)
+        elif last.op == Op.Br:
+            (cond, if_true, if_false) = last.args
+            if fused:
+                # compare and jump, without computing the 0 or 1
+                (a, b) = compare.args
+                self.load("rax", a)
+                self.emit(f"cmp rax, {self.source(b)}")
+                self.branch(CONDITIONS[compare.op], if_true, if_false, next_block)
+            elif type(cond) is Const:
+                self.jump(if_true if cond.value else if_false, next_block)
+            else:
+                self.emit(f"cmp qword {self.operand(cond)}, 0")
+                self.branch("ne", if_true, if_false, next_block)
+        elif tail_call:
+            self.compile_tail_call(instrs[-2])
+        else:
+            self.compile_Ret(last)
+
+    def compile(self):
+        self.code.append(f"\n{mangle_fun(self.fun.name)}:")
+        self.emit("push rbp")
+        self.emit("mov rbp, rsp")
+        if self.frame_size > 0:
+            self.emit(f"sub rsp, {self.frame_size}")
+        blocks = self.fun.blocks
+        for i, block in enumerate(blocks):
+            next_block = blocks[i + 1] if i + 1 < len(blocks) else None
+            self.compile_block(block, next_block)
+        return "\n".join(self.code) + "\n"
+
+
+COMPILERS = {
+    Op.Copy: FunctionCompiler.compile_Copy,
+    Op.Addr: FunctionCompiler.compile_Addr,
+    Op.Load: FunctionCompiler.compile_Load,
+    Op.Store: FunctionCompiler.compile_Store,
+    Op.Call: FunctionCompiler.compile_Call,
+    Op.Print: FunctionCompiler.compile_Print,
+}
+
+
+def compile_function(fun) -> str:
+    return FunctionCompiler(fun).compile()
+
+
+def compile_program(program) -> str:
+    data = "\n".join(
+        f"  {mangle(var.name)} dq {word(var.init)}" for var in program.globals
+    )
+    text = "".join(map(compile_function, program.functions))
+    init = any(fun.name == INIT for fun in program.functions)
+    return asm_file(data, text, init)
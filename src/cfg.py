@@ -0,0 +1,307 @@
+"""
+The control flow graph of a function of the intermediate code (see ir).
+
+The lowering already splits the code into basic blocks, which end with
+explicit jumps, so the graph only has to collect the edges. On top of it we
+compute:
+- the reverse postorder of the blocks reachable from the entry,
+- the dominator tree and the dominance frontiers (Cooper, Harvey and
+  Kennedy, "A Simple, Fast Dominance Algorithm"),
+- the natural loops, their nesting and depth.
+
+The blocks are numbered by their positions in the function and everything
+is kept in lists indexed by these numbers, so big functions (with tens of
+thousands of blocks) are cheap. None of the algorithms is recursive.
+
+The graph is a snapshot: it must be built again after a pass changes the
+jumps of the function.
+"""
+
+from __future__ import annotations
+
+from typing import Optional
+
+from ir import Block, Const, Function, Instr, Op
+
+
+class Loop:
+    """
+    A natural loop: the header and the blocks which can reach a back edge to
+    the header without going through it. The blocks of the inner loops are
+    the blocks of their children.
+    """
+
+    def __init__(self, header: int):
+        self.header = header
+        # the blocks of this loop which are not in an inner loop, header first
+        self.blocks: list[int] = [header]
+        self.back_edges: list[int] = []
+        self.parent: Optional[Loop] = None
+        self.children: list[Loop] = []
+        self.depth = 1
+
+    def __repr__(self):
+        return f"Loop(header={self.header}, depth={self.depth})"
+
+    def all_blocks(self) -> list[int]:
+        """The blocks of the loop, including the blocks of the inner loops"""
+        result = []
+        todo: list[Loop] = [self]
+        while todo:
+            loop = todo.pop()
+            result.extend(loop.blocks)
+            todo.extend(loop.children)
+        return result
+
+
+class CFG:
+    def __init__(self, fun: Function):
+        self.fun = fun
+        self.blocks: list[Block] = fun.blocks
+        self.number: dict[Block, int] = {b: i for i, b in enumerate(fun.blocks)}
+
+        n = len(self.blocks)
+        number = self.number
+        self.succs: list[list[int]] = [
+            [number[target] for target in block.successors] for block in self.blocks
+        ]
+        self.preds: list[list[int]] = [[] for _ in range(n)]
+        for i, succs in enumerate(self.succs):
+            for j in succs:
+                self.preds[j].append(i)
+
+        self.rpo: list[int] = self._reverse_postorder()
+        # the positions of the blocks in rpo, -1 for the unreachable ones
+        self.rpo_number: list[int] = [-1] * n
+        for k, i in enumerate(self.rpo):
+            self.rpo_number[i] = k
+
+        self.idom: list[int] = self._dominators()
+        self.dom_children: list[list[int]] = [[] for _ in range(n)]
+        for i in self.rpo[1:]:
+            self.dom_children[self.idom[i]].append(i)
+        self._number_dominator_tree()
+
+        self.loops: list[Loop] = []
+        # the innermost loop of every block
+        self.loop_of: list[Optional[Loop]] = [None] * n
+        self._find_loops()
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def reachable(self, i: int) -> bool:
+        return self.rpo_number[i] >= 0
+
+    # Reverse postorder
+
+    def _reverse_postorder(self) -> list[int]:
+        if not self.blocks:
+            return []
+        succs = self.succs
+        visited = [False] * len(self.blocks)
+        postorder = []
+        # the blocks with the positions of their next successors to visit
+        visited[0] = True
+        stack = [(0, 0)]
+        while stack:
+            (i, k) = stack[-1]
+            if k < len(succs[i]):
+                stack[-1] = (i, k + 1)
+                j = succs[i][k]
+                if not visited[j]:
+                    visited[j] = True
+                    stack.append((j, 0))
+            else:
+                stack.pop()
+                postorder.append(i)
+        postorder.reverse()
+        return postorder
+
+    # Dominators
+
+    def _dominators(self) -> list[int]:
+        """The immediate dominators, the entry is its own, -1 if unreachable"""
+        n = len(self.blocks)
+        idom = [-1] * n
+        if not n:
+            return idom
+        rpo_number = self.rpo_number
+        preds = self.preds
+        idom[0] = 0
+        changed = True
+        while changed:
+            changed = False
+            for i in self.rpo[1:]:
+                new_idom = -1
+                for p in preds[i]:
+                    if idom[p] == -1:
+                        # not processed yet, or unreachable
+                        continue
+                    if new_idom == -1:
+                        new_idom = p
+                        continue
+                    # the nearest common dominator of p and new_idom
+                    (a, b) = (p, new_idom)
+                    while a != b:
+                        while rpo_number[a] > rpo_number[b]:
+                            a = idom[a]
+                        while rpo_number[b] > rpo_number[a]:
+                            b = idom[b]
+                    new_idom = a
+                if idom[i] != new_idom:
+                    idom[i] = new_idom
+                    changed = True
+        return idom
+
+    def _number_dominator_tree(self):
+        """The preorder and postorder numbers, for the dominance checks"""
+        n = len(self.blocks)
+        self._pre = [-1] * n
+        self._post = [-1] * n
+        if not n:
+            return
+        counter = 0
+        stack = [(0, False)]
+        while stack:
+            (i, done) = stack.pop()
+            if done:
+                self._post[i] = counter
+                counter += 1
+                continue
+            self._pre[i] = counter
+            counter += 1
+            stack.append((i, True))
+            stack.extend((child, False) for child in reversed(self.dom_children[i]))
+
+    def dominates(self, a: int, b: int) -> bool:
+        """Every path from the entry to b goes through a (reachable a and b)"""
+        return self._pre[a] <= self._pre[b] and self._post[b] <= self._post[a]
+
+    def dominance_frontiers(self) -> list[list[int]]:
+        """
+        The dominance frontier of every block: the blocks where its dominance
+        ends, i.e. the joins with a predecessor which it dominates (the block
+        itself may be one of them, e.g. a loop header).
+        """
+        idom = self.idom
+        frontiers: list[list[int]] = [[] for _ in self.blocks]
+        for i in self.rpo:
+            preds = [p for p in self.preds[i] if idom[p] != -1]
+            if len(preds) < 2:
+                continue
+            for p in preds:
+                runner = p
+                while runner != idom[i]:
+                    frontier = frontiers[runner]
+                    if not frontier or frontier[-1] != i:
+                        frontier.append(i)
+                    runner = idom[runner]
+        return frontiers
+
+    # Loops
+
+    def _find_loops(self):
+        """
+        Finds the natural loops, the inner ones first (their headers come
+        later in the reverse postorder). The blocks of the inner loops which
+        were found already are collapsed into their headers (with a union-find
+        structure), so every block is visited a few times in total, however
+        deep the loops are nested.
+        """
+        preds = self.preds
+        loop_of = self.loop_of
+        # every block points to the header of the outermost loop found so far
+        # which contains it (or to itself)
+        outer = list(range(len(self.blocks)))
+
+        def find(i):
+            root = i
+            while outer[root] != root:
+                root = outer[root]
+            while outer[i] != root:
+                (outer[i], i) = (root, outer[i])
+            return root
+
+        found = []
+        for h in reversed(self.rpo):
+            back_edges = [p for p in preds[h] if self.dominates(h, p)]
+            if not back_edges:
+                continue
+            loop = Loop(h)
+            loop.back_edges = back_edges
+            found.append(loop)
+            loop_of[h] = loop
+            todo = [p for p in back_edges if p != h]
+            while todo:
+                i = find(todo.pop())
+                if i == h:
+                    continue
+                inner = loop_of[i]
+                if inner is None:
+                    loop_of[i] = loop
+                    loop.blocks.append(i)
+                else:
+                    # the header of an inner loop, which is now a part of this
+                    # one, the other blocks of the inner loop point to it
+                    inner.parent = loop
+                    loop.children.append(inner)
+                outer[i] = h
+                todo.extend(p for p in preds[i] if self.rpo_number[p] >= 0)
+
+        # the outer loops first, so the parents know their depths
+        found.reverse()
+        for loop in found:
+            if loop.parent is not None:
+                loop.depth = loop.parent.depth + 1
+        self.loops = found
+
+    def loop_depth(self, i: int) -> int:
+        """The number of loops containing the block"""
+        loop = self.loop_of[i]
+        return 0 if loop is None else loop.depth
+
+    def in_loop(self, i: int, loop: Loop) -> bool:
+        inner = self.loop_of[i]
+        while inner is not None and inner.depth > loop.depth:
+            inner = inner.parent
+        return inner is loop
+
+
+def remove_unreachable(fun: Function) -> int:
+    """
+    Removes the blocks which cannot be reached from the entry (and the values
+    coming from them to the phis), returns the number of removed blocks.
+    """
+    graph = CFG(fun)
+    if len(graph.rpo) == len(graph):
+        return 0
+    reachable = {fun.blocks[i] for i in graph.rpo}
+    for block in fun.blocks:
+        if block not in reachable:
+            for target in block.successors:
+                remove_incoming(target, block)
+    removed = len(fun.blocks) - len(reachable)
+    fun.blocks = [block for block in fun.blocks if block in reachable]
+    return removed
+
+
+def remove_incoming(block: Block, source: Block):
+    """The phis of the block forget the values coming from the source"""
+    for phi in block.phis:
+        phi.args = tuple(
+            x for (b, v) in phi.incoming if b is not source for x in (b, v)
+        )
+
+
+def fold_branch(block: Block) -> bool:
+    """Replaces a branch on a constant with a jump, returns True if it did"""
+    last = block.instrs[-1]
+    if last.op != Op.Br or type(last.args[0]) is not Const:
+        return False
+    (cond, if_true, if_false) = last.args
+    (target, other) = (if_true, if_false) if cond.value else (if_false, if_true)
+    if other is not target:
+        remove_incoming(other, block)
+    block.instrs[-1] = Instr(Op.Jmp, None, (target,))
+    return True
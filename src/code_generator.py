@@ -1,4 +1,4 @@
-from collections import defaultdict, namedtuple
+from collections import Counter, namedtuple
 from enum import Enum
 from typing import NamedTuple, Optional
 
@@ -6,8 +6,10 @@ import pyc_ast as E
 from visitor import Visitor
 
 # from optimize import optimize
+from division import divide_by_constant
+from ir import INIT, word
 from local_vars import get_local_vars
-from rename import rename_vars
+from type_checker import BindingKind, Frame, check
 
 # Variables addresses in memory
 # They are of one of three forms:
@@ -60,20 +62,63 @@ class CompileVisitor(Visitor):
         CompileVisitor.labelId += 1
         return CompileVisitor.labelId
 
-    def __init__(self):
+    def __init__(self, symbol_table):
+        self._symbol_table = symbol_table
+
         # static vars
         self._static_vars = set()
 
-        # symbol table for parameters
-        # we keep a separate stack for every variable
-        self._var_addr = defaultdict(list)
+        # the addresses of the variables, and their text for the
+        # instructions, by the ids of the nodes which use them
+        self._var_addr = {}
+        self._operands = {}
+        addresses = {}
+        labels = global_labels(symbol_table)
+        for node_id, binding in symbol_table.bindings.items():
+            if binding not in addresses:
+                addresses[binding] = var_addr(binding, labels)
+            addr = addresses[binding]
+            self._var_addr[node_id] = addr
+            self._operands[node_id] = addr.text
 
         # a stack of function epilogue labels
         self._epilogues = []
 
+        # the name and the frame of the current function, and whether it
+        # calls itself in a tail position (see visit_StmReturn)
+        self._function: tuple[str, Frame]
+        self._self_tail_call = False
+
         # a stack of loop end labels
         self._loop_labels = []
 
+        # the generated code, as a list of fragments
+        self._code = []
+
+    # Generated code
+    #
+    # The visit methods append the code to a buffer instead of returning it,
+    # as concatenating the code of the children is quadratic for deep trees.
+
+    def emit(self, code):
+        self._code.append(code)
+
+    def reserve(self):
+        """
+        Reserves a place for a fragment which depends on the
+        children that will be visited later (e.g. on the label ids)
+        """
+        self._code.append(None)
+        return len(self._code) - 1
+
+    def fill(self, slot, code):
+        assert self._code[slot] is None
+        self._code[slot] = code
+
+    @property
+    def code(self):
+        return "".join(self._code)
+
     # Function epilogue stack
 
     def push_epilogue(self, label):
@@ -113,49 +158,30 @@ class CompileVisitor(Visitor):
     def static_vars(self):
         return self._static_vars
 
-    # Local variables and function parameters
+    # Variables, resolved by the type checker
 
-    def global_var_addr(self, var):
-        base = mangle(var)
-        return VarAddr(base)
+    def get_var_addr(self, node):
+        return self._var_addr[id(node)]
 
-    def is_parameter_or_local(self, var):
-        """
-        Checks if the given variable comes from
-        binding the current functions formal parameters
-        """
-        return self._var_addr[var] != []
-
-    def get_parameter_or_local_addr(self, var):
-        return self._var_addr[var][-1]
-
-    def get_var_addr(self, var):
-        if self.is_parameter_or_local(var):
-            return self.get_parameter_or_local_addr(var)
-        else:
-            return self.global_var_addr(var)
-
-    def get_var_addr_text(self, var):
-        return self.get_var_addr(var).text
-
-    def add_parameter_of_local(self, var, addr):
-        self._var_addr[var].append(addr)
-
-    def remove_parameter_or_local(self, var):
-        self._var_addr[var].pop()
+    def get_param_addr_text(self, node):
+        return self._operands[id(node)]
 
     # Code generation, case by case
 
     def visit_ArithLit(self, val):
-        return f"""\
+        self.emit(
+            f"""\
     push {val}\n"""
+        )
 
     def visit_Var(self, var):
-        var_addr = self.get_var_addr_text(var)
-        return f"""\
+        var_addr = self.get_param_addr_text(self.node)
+        self.emit(
+            f"""\
     mov rax, [{var_addr}]
     push rax\n\
 """
+        )
 
     # VERSION 1: we put all args on the stack
     # NOTE: we also have to pop them off
@@ -164,9 +190,8 @@ class CompileVisitor(Visitor):
     def visit_FunCall(self, name, args):
         # first prepare the arguments on the stack
         # we evaluate them right-to-left (seems natural here)
-        cc = ""
         for arg in reversed(args):
-            cc += arg.accept(self)  # we have implicit pushes over here
+            yield arg  # we have implicit pushes over here
 
         # adjust the stack to remove the arguments
         count = len(args)
@@ -176,9 +201,8 @@ class CompileVisitor(Visitor):
         # next - call the function
         funname = mangle_fun(name)
 
-        return (
-            cc
-            + f"""\
+        self.emit(
+            f"""\
     call {funname}
 {arg_popping}
     push rax
@@ -188,7 +212,7 @@ class CompileVisitor(Visitor):
     def visit_ArithUnaryop(self, op, a):
         if op == E.ArithUnaryOp.Addr:
             assert type(a) is E.Var
-            var_addr = self.get_var_addr(a.var)
+            var_addr = self.get_var_addr(a)
             base = var_addr.base
             if var_addr.offset is not None:
                 (sign, size, count) = var_addr.offset
@@ -206,24 +230,40 @@ mov rax, {size}
             # rax = base - size * count
             else:
                 load_addr = f"mov rax, {base}"
-            return f"""\
+            self.emit(
+                f"""\
     {load_addr}
     push rax\n\
 """
+            )
         elif op == E.ArithUnaryOp.Deref:
             assert type(a) is E.Var
-            var_addr = self.get_var_addr_text(a.var)
-            return f"""\
+            var_addr = self.get_param_addr_text(a)
+            self.emit(
+                f"""\
     mov rax, [{var_addr}]
     mov rax, [rax]
     push rax
 """
+            )
         else:
             raise TypeError
 
     def visit_ArithBinop(self, op, a1, a2):
-        c1 = a1.accept(self)
-        c2 = a2.accept(self)
+        yield a1
+        if op in (E.ArithOp.Div, E.ArithOp.Mod) and type(a2) is E.ArithLit:
+            code = divide_by_constant(a2.num, op == E.ArithOp.Mod)
+            if code is not None:
+                lines = "".join(f"    {line}\n" for line in code)
+                self.emit(
+                    f"""\
+    pop rax
+{lines}\
+    push rax\n\
+"""
+                )
+                return
+        yield a2
 
         operation = ""
         if op == E.ArithOp.Add:
@@ -253,10 +293,8 @@ mov rax, {size}
     mov r10, rdx
             """
 
-        return (
-            c1
-            + c2
-            + f"""\
+        self.emit(
+            f"""\
     pop r11
     pop r10
     {operation}
@@ -265,8 +303,8 @@ mov rax, {size}
         )
 
     def visit_BoolArithCmp(self, op, a1, a2):
-        c1 = a1.accept(self)
-        c2 = a2.accept(self)
+        yield a1
+        yield a2
 
         label_id = CompileVisitor.fresh_id()
         label = f"_cmp_change{label_id}"
@@ -285,10 +323,8 @@ mov rax, {size}
         if op == E.ArithCmp.Gt:
             operator = "jg"
 
-        return (
-            c1
-            + c2
-            + f"""
+        self.emit(
+            f"""
     pop r11
     pop r10
     mov r9, 0
@@ -307,10 +343,9 @@ _cmp_ret{label_id}:
         # given not 0 = 1
         #       not 1 = 0
         # we can implement not b as 1 - b = -(b - 1)
-        c = b.accept(self)
-        return (
-            c
-            + """
+        yield b
+        self.emit(
+            """
     pop rax
     dec rax
     neg rax
@@ -319,60 +354,57 @@ _cmp_ret{label_id}:
         )
 
     def visit_BoolBinop(self, op, b1, b2):
-        c1 = b1.accept(self)
-        c2 = b2.accept(self)
+        yield b1
+        right = self.reserve()
+        yield b2
         label_id = CompileVisitor.fresh_id()
 
         if op == E.BoolOp.And:
-            return (
-                c1
-                + f"""
+            self.fill(
+                right,
+                f"""
     pop rax
     cmp rax, 0
     jne _and_right{label_id}
     push 0
     jmp _and_ret{label_id}
 _and_right{label_id}:
-{c2}
+""",
+            )
+            self.emit(
+                f"""
 _and_ret{label_id}:
 """
             )
         elif op == E.BoolOp.Or:
-            return (
-                c1
-                + f"""
+            self.fill(
+                right,
+                f"""
     pop rax
     cmp rax, 0
     je _or_right{label_id}
     push 1
     jmp _or_ret{label_id}
 _or_right{label_id}:
-{c2}
+""",
+            )
+            self.emit(
+                f"""
 _or_ret{label_id}:
 """
             )
 
     def visit_ArithAssign(self, lvalue, a):
+        var_addr = self.get_param_addr_text(self.node)
         if lvalue.kind == E.LValueKind.Var:
-            var = lvalue.loc
-            c = a.accept(self)
-            var_addr = self.get_var_addr_text(var)
-            return (
-                c
-                + f"""\
-    pop rax
-    mov [{var_addr}], rax
-    push rax\n"""
-            )
+            yield a
+            self.emit_assign(var_addr)
 
         elif lvalue.kind == E.LValueKind.Pointer:
-            var = lvalue.loc
             # *n = a
-            c = a.accept(self)
-            var_addr = self.get_var_addr_text(var)
-            return (
-                c
-                + f"""\
+            yield a
+            self.emit(
+                f"""\
     pop rbx
     mov rax, [{var_addr}]
     mov [rax], rbx
@@ -382,12 +414,22 @@ _or_ret{label_id}:
         else:
             raise NotImplementedError
 
+    def emit_assign(self, var_addr):
+        self.emit(
+            f"""\
+    pop rax
+    mov [{var_addr}], rax
+    push rax\n"""
+        )
+
     def visit_StmExpr(self, a):
         # we simply ignore the return value and pop the stack
-        c = a.accept(self)
-        return (
-            c
-            + """
+        yield a
+        self.emit_pop()
+
+    def emit_pop(self):
+        self.emit(
+            """
     pop rax
         """
         )
@@ -401,28 +443,39 @@ _or_ret{label_id}:
         # self.extend_environment(var)
         # self.add_static_var(self.add_occur_suffix(var))
 
+        var_addr = self.get_param_addr_text(self.node)
         if a is not None:
-            return self.visit_StmExpr(E.ArithAssign(E.lvalue_var(var), a))
-        else:
-            return ""
+            # the same as the statement var = a;
+            yield a
+            self.emit_assign(var_addr)
+            self.emit_pop()
 
     def visit_StmIf(self, b, ss1, ss2):
-        bc = b.accept(self)
-        cc1 = self.visit_many(ss1)
-        cc2 = self.visit_many(ss2)
+        yield b
+        if_true = self.reserve()
+        yield self.visit_many(ss1)
+        if_false = self.reserve()
+        yield self.visit_many(ss2)
         label_id = CompileVisitor.fresh_id()
 
-        return (
-            bc
-            + f"""
+        self.fill(
+            if_true,
+            f"""
     pop rax
     cmp rax, 0
     je _if_false{label_id}
 _if_true{label_id}:
-{cc1}\
+""",
+        )
+        self.fill(
+            if_false,
+            f"""\
     jmp _if_ret{label_id}
 _if_false{label_id}:
-{cc2}\
+""",
+        )
+        self.emit(
+            f"""\
 _if_ret{label_id}:
 """
         )
@@ -432,58 +485,133 @@ _if_ret{label_id}:
         while_start_lbl = f"_loop_while{label_id}"
         while_end_lbl = f"_while_ret{label_id}"
         labels = (while_start_lbl, while_end_lbl)
-        bc = b.accept(self)
+        self.emit(f"{while_start_lbl}:\n")
+        yield b
+        self.emit(
+            f"""
+    pop rax
+    cmp rax, 0
+    je {while_end_lbl}
+"""
+        )
 
         self.push_loop_labels(labels)
-        cc = self.visit_many(ss)
+        yield self.visit_many(ss)
         self.pop_loop_labels(labels)
 
-        return (
-            f"{while_start_lbl}:\n"
-            + bc
-            + f"""
-    pop rax
-    cmp rax, 0
-    je {while_end_lbl}
-{cc}\
+        self.emit(
+            f"""\
     jmp {while_start_lbl}
 {while_end_lbl}:\n\
 """
         )
 
     def visit_StmPrint(self, a):
-        cval = a.accept(self)
-        cval += """\
+        yield a
+        self.emit(
+            """\
     pop rax
     printint rax
 """
-        return cval
+        )
 
     def visit_StmReturn(self, a):
         epilogue_lbl = self.top_epilogue
-        cval = a.accept(self)
-        cval += f"""\
+        if self.is_tail_call(a):
+            yield self.visit_tail_call(a.name, a.args)
+            return
+        yield a
+        self.emit(
+            f"""\
     pop rax
     jmp {epilogue_lbl}
 """
-        return cval
+        )
+
+    def is_tail_call(self, a):
+        """
+        The callee of return f(...) can reuse the stack frame if its arguments
+        fit where ours are, and no pointer to the frame may be passed to it
+        """
+        (_name, frame) = self._function
+        return (
+            type(a) is E.FunCall
+            and len(a.args) <= len(frame.params)
+            and not frame.address_taken
+        )
+
+    def visit_tail_call(self, name, args):
+        # the arguments replace ours (they are all evaluated first, as they
+        # may read ours), then the callee returns straight to our caller
+        for arg in reversed(args):
+            yield arg
+        pops = "".join(
+            f"""\
+    pop rax
+    mov [{param_addr_text(i)}], rax
+"""
+            for i in range(len(args))
+        )
+        (fun_name, frame) = self._function
+        funname = mangle_fun(name)
+        if name == fun_name:
+            # a loop: the body starts again, in the same frame
+            self._self_tail_call = True
+            jump = f"jmp {funname}_body"
+        else:
+            word_len = 8
+            jump = f"""\
+add rsp, {word_len * len(frame.locals)}
+    pop rbp
+    jmp {funname}"""
+        self.emit(
+            f"""\
+{pops}\
+    {jump}
+"""
+        )
 
     def visit_StmBreak(self):
         loop_end_lbl = self.top_loop_end_label
-        return f"jmp {loop_end_lbl}\n"
+        self.emit(f"jmp {loop_end_lbl}\n")
 
     def visit_StmContinue(self):
         loop_start_lbl = self.top_loop_start_label
-        return f"jmp {loop_start_lbl}\n"
+        self.emit(f"jmp {loop_start_lbl}\n")
 
     def visit_StmBlock(self, stms):
-        return self.visit_many(stms)
+        yield self.visit_many(stms)
 
     def visit_many(self, stms):
-        ss = "\n".join([stm.accept(self) for stm in stms])
-        return ss
+        for i, stm in enumerate(stms):
+            if i > 0:
+                self.emit("\n")
+            yield stm
+
+    def visit_many_defs(self, defs):
+        yield self.visit_many([decl for decl in defs if isinstance(decl, E.FunDecl)])
+        # the globals whose initial values are not numbers (those are in the
+        # data section) are stored by INIT, which runs before main
+        initialized = [decl for decl in defs if is_initialized_global(decl)]
+        if not initialized:
+            return
+        self.emit(
+            f"""
+{mangle_fun(INIT)}:
+    push rbp
+    mov rbp, rsp
+"""
+        )
+        yield self.visit_many(initialized)
+        self.emit(
+            """
+    pop rbp
+    ret
+"""
+        )
 
     def visit_FunDecl(self, _type, name, params, body):
+        frame = self._symbol_table.frames[id(self.node)]
         funname = mangle_fun(name)
         # prepare the prologue
         #
@@ -512,24 +640,11 @@ _if_ret{label_id}:
         # [rbp - 16] == second local variable
         # etc!
 
-        # Bind the parameters
-        word_len = 8
-        for i, param in enumerate(params):
-            var = param.var
-            index = i + 2
-            # offset = word_len * index
-            addr = VarAddr("rbp", MemOffset(Sign.Plus, word_len, index))
-            self.add_parameter_of_local(var, addr)
-
-        # Allocate local variables
-        local_vars = get_local_vars(body)
-        for i, var in enumerate(local_vars):
-            index = i + 1
-            addr = VarAddr("rbp", MemOffset(Sign.Minus, word_len, index))
-            self.add_parameter_of_local(var, addr)
+        # (see var_addr for the addresses of the parameters and locals)
 
         # update the rsp to make space for local variables
-        locals_size = word_len * len(local_vars)
+        word_len = 8
+        locals_size = word_len * len(frame.locals)
         local_vars_add_space = f"sub rsp, {locals_size}"
         local_vars_dec_space = f"add rsp, {locals_size}"
 
@@ -545,9 +660,22 @@ _if_ret{label_id}:
 
         self.push_epilogue(epilogue_lbl)
 
+        self.emit(
+            f"""
+{funname}:\
+{prologue}\
+"""
+        )
+        # the label of the body, if the function calls itself in a tail position
+        body_slot = self.reserve()
+        self._function = (name, frame)
+        self._self_tail_call = False
+
         # The main body of the function
         # the result of the function call is the content of the rax register
-        body_code = self.visit_many(body)
+        yield self.visit_many(body)
+
+        self.fill(body_slot, f"{funname}_body:\n" if self._self_tail_call else "")
 
         # we pass the label as a correctness check
         self.pop_epilogue(epilogue_lbl)
@@ -559,78 +687,138 @@ _if_ret{label_id}:
     pop rbp
 """
 
-        # remove the bindings for the local vars:
-        for var in local_vars:
-            self.remove_parameter_or_local(var)
-
-        # remove the bindings for the params
-        for param in params:
-            self.remove_parameter_or_local(param.var)
-
-        return f"""
-{funname}:\
-{prologue}\
-{body_code}\
+        self.emit(
+            f"""\
 {epilogue_lbl}:\
 {epilogue}\
     ret\
 """
-
-    def visit_many_defs(self, defs):
-        ss = "\n".join([defn.accept(self) for defn in defs])
-        return ss
+        )
 
 
 # End of code generator cases
 
 
+def var_addr(binding, labels):
+    """labels are the labels of the globals by their uids, see global_labels"""
+    word_len = 8
+    if binding.kind == BindingKind.Param:
+        # skip the stored rbp and the return address
+        index = binding.index + 2
+        return VarAddr("rbp", MemOffset(Sign.Plus, word_len, index))
+    elif binding.kind == BindingKind.Local:
+        index = binding.index + 1
+        return VarAddr("rbp", MemOffset(Sign.Minus, word_len, index))
+    else:
+        return VarAddr(labels[binding.uid])
+
+
+def param_addr_text(index):
+    """The address of the parameter with the given index"""
+    return VarAddr("rbp", MemOffset(Sign.Plus, 8, index + 2)).text
+
+
 def mangle(var):
     return f"var_{var}"
 
 
+def global_labels(symbol_table):
+    """
+    The labels of the global variables by the uids of their bindings, a
+    variable declared again gets a suffix (var_x, var_x.1, ...) as in ir
+    """
+    labels = {}
+    count = Counter()
+    for decl in symbol_table.defs:
+        if isinstance(decl, E.StmDecl):
+            k = count[decl.var]
+            count[decl.var] += 1
+            uid = symbol_table.bindings[id(decl)].uid
+            labels[uid] = mangle(decl.var if k == 0 else f"{decl.var}.{k}")
+    return labels
+
+
 def mangle_fun(name):
     return f"__{name}__"
 
 
-def define_vars(vars):
-    return "\n".join([f"  {mangle(var)} dq 0" for var in vars])
+def define_vars(labels, values):
+    return "\n".join(f"  {label} dq {value}" for label, value in zip(labels, values))
 
 
-def compile_global_defs(defs):
-    visitor = CompileVisitor()
-    code = visitor.visit_many_defs(defs)
+def is_initialized_global(decl):
+    """A global whose initial value is not a number, see INIT"""
+    return (
+        isinstance(decl, E.StmDecl)
+        and decl.a is not None
+        and not isinstance(decl.a, E.ArithLit)
+    )
+
+
+def compile_global_defs(defs, symbol_table):
+    visitor = CompileVisitor(symbol_table)
+    visitor.visit(visitor.visit_many_defs(defs))
+    code = visitor.code
     static_vars = visitor.static_vars
     return code, static_vars
 
 
-def compile_file(defs):
-    global_vars = [decl.var for decl in defs if type(decl) == E.StmDecl]
+def compile_file(defs, symbol_table):
+    global_decls = [decl for decl in defs if type(decl) == E.StmDecl]
+    labels = list(global_labels(symbol_table).values())
+    # the numbers are in the data section
+    values = [
+        word(decl.a.num) if isinstance(decl.a, E.ArithLit) else 0
+        for decl in global_decls
+    ]
 
     # TODO: check that all functions have different names
     # TODO: implement static vars
 
-    global_defs, _static_vars = compile_global_defs(defs)
-    static_vars_decl = define_vars(global_vars)
+    global_defs, _static_vars = compile_global_defs(defs, symbol_table)
+    static_vars_decl = define_vars(labels, values)
+    init = any(map(is_initialized_global, global_decls))
+    return asm_file(static_vars_decl, global_defs, init)
 
+
+def asm_file(data, text, init=False):
+    """
+    The assembly file with the given data section and code, which has the
+    function INIT (storing the initial values of the globals) if init is set
+    """
+    init_call = f"    call {mangle_fun(INIT)}\n" if init else ""
     template = f"""\
 %include "asm/std.asm"
 
 section .data
-{static_vars_decl}
+{data}
 
 section .text
     global _start
 
 _start:
+{init_call}\
     call __main__
     exit rax
-{global_defs}\
+{text}\
     """
 
     return template
 
 
-def compile_top(decls):
-    renamed_decls = rename_vars(decls)
-    assert renamed_decls == rename_vars(renamed_decls)
-    return compile_file(renamed_decls)
+def compile_top(decls, symbol_table=None, debug=False):
+    """
+    Compiles the program, symbol_table is the result of check(decls),
+    it is computed if not given.
+    """
+    if symbol_table is None:
+        symbol_table = check(decls)
+    defs = symbol_table.defs
+    if debug:
+        # every declaration got its own slot
+        for decl in defs:
+            if isinstance(decl, E.FunDecl):
+                frame = symbol_table.frames[id(decl)]
+                local_vars = [binding.name for binding in frame.locals]
+                assert local_vars == get_local_vars(decl.body)
+    return compile_file(defs, symbol_table)
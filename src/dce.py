@@ -0,0 +1,199 @@
+"""
+Dead code elimination on the SSA form (see ssa).
+
+- The branches on constants become jumps (e.g. the ones found by gvn), the
+  blocks which cannot be reached are removed, and a block which only
+  jumps to a block with no other predecessors is merged with it (e.g. the
+  blocks left after the constant branches are folded, see sccp).
+- A store to a variable in memory is dead if the variable is stored to
+  again before anything can read it, or if the function returns first and
+  the variable is a local. The locals which are never read and whose
+  address is never taken are removed, with all their stores.
+- An instruction is dead if it has no side effects and its result is not
+  used by a live instruction. The live ones are found from the ones with
+  side effects (stores, calls, prints, jumps, returns and the divisions
+  which may divide by 0), so dead cycles (e.g. a counter which is never
+  read) are removed as well. Calls stay, but an unused result is dropped.
+
+Every temporary and local has its own slot in the stack frame (see
+backend), so the frame shrinks as well.
+"""
+
+from collections import Counter
+
+import backend
+from cfg import CFG, fold_branch, remove_unreachable
+from ir import Const, Function, Mem, MemKind, Op, Temp, word
+
+# the instructions which cannot be removed, even if their results are unused
+SIDE_EFFECTS = frozenset({Op.Store, Op.Call, Op.Print, Op.Jmp, Op.Br, Op.Ret})
+
+
+def eliminate_dead_code(fun: Function) -> Counter:
+    """Removes the dead code, returns the saved instructions and frame bytes"""
+    instrs = _count(fun)
+    frame_size = backend.FunctionCompiler(fun).frame_size
+    for block in fun.blocks:
+        fold_branch(block)
+    remove_unreachable(fun)
+    _merge_blocks(fun)
+    _remove_dead_stores(fun)
+    _remove_dead_instrs(fun)
+    if _remove_unused_slots(fun):
+        # the values which were stored there may be dead now
+        _remove_dead_instrs(fun)
+    return Counter(
+        instrs=instrs - _count(fun),
+        frame_bytes=frame_size - backend.FunctionCompiler(fun).frame_size,
+    )
+
+
+def _count(fun: Function) -> int:
+    return sum(len(block.instrs) for block in fun.blocks)
+
+
+def _merge_blocks(fun: Function):
+    """Merges the blocks with their only predecessors, which jump to them"""
+    if not fun.blocks:
+        return
+    graph = CFG(fun)
+    # the merged blocks, by the blocks which took their code
+    merged_into = {}
+    # the phis of the merged blocks have one value, which replaces them
+    values = {}
+    for a in fun.blocks:
+        if a in merged_into:
+            continue
+        while True:
+            last = a.instrs[-1]
+            if last.op != Op.Jmp:
+                break
+            b = last.args[0]
+            j = graph.number[b]
+            if b is a or j == 0 or len(graph.preds[j]) != 1:
+                break
+            phis = b.phis
+            for phi in phis:
+                values[phi.dst] = phi.args[1]
+            start = len(phis)
+            a.instrs[-1:] = b.instrs[start:]
+            merged_into[b] = a
+    if not merged_into:
+        return
+
+    def value(x):
+        while x in values:
+            x = values[x]
+        return x
+
+    def block(b):
+        while b in merged_into:
+            b = merged_into[b]
+        return b
+
+    fun.blocks = [b for b in fun.blocks if b not in merged_into]
+    for b in fun.blocks:
+        for instr in b.instrs:
+            if instr.op == Op.Phi:
+                instr.args = tuple(
+                    block(arg) if k % 2 == 0 else value(arg)
+                    for k, arg in enumerate(instr.args)
+                )
+            elif values and any(type(arg) is Temp for arg in instr.args):
+                instr.args = tuple(value(arg) for arg in instr.args)
+
+
+def _remove_dead_stores(fun: Function):
+    """Removes the stores which are overwritten before they are read"""
+    for block in fun.blocks:
+        # the positions of the last stores to the variables, not read yet
+        pending: dict[Mem, int] = {}
+        dead = set()
+        for k, instr in enumerate(block.instrs):
+            op = instr.op
+            if op == Op.Store:
+                target = instr.args[0]
+                if type(target) is Mem:
+                    if target in pending:
+                        dead.add(pending[target])
+                    pending[target] = k
+            elif op == Op.Load:
+                source = instr.args[0]
+                if type(source) is Mem:
+                    pending.pop(source, None)
+                else:
+                    # a pointer, to any of them
+                    pending.clear()
+            elif op == Op.Call or op == Op.Jmp or op == Op.Br:
+                # the callee or the next blocks may read them
+                pending.clear()
+            elif op == Op.Ret:
+                # the locals are gone
+                dead.update(
+                    k for (var, k) in pending.items() if var.kind == MemKind.Local
+                )
+        if dead:
+            block.instrs = [
+                instr for k, instr in enumerate(block.instrs) if k not in dead
+            ]
+
+
+def _remove_unused_slots(fun: Function) -> bool:
+    """Removes the locals which are never read, returns True if there were any"""
+    used = set()
+    for block in fun.blocks:
+        for instr in block.instrs:
+            if instr.op != Op.Store:
+                used.update(arg for arg in instr.args if type(arg) is Mem)
+    unused = [slot for slot in fun.slots if slot not in used]
+    if not unused:
+        return False
+    unused_set = set(unused)
+    fun.slots = [slot for slot in fun.slots if slot not in unused_set]
+    for block in fun.blocks:
+        block.instrs = [
+            instr
+            for instr in block.instrs
+            if not (instr.op == Op.Store and instr.args[0] in unused_set)
+        ]
+    return True
+
+
+def _has_side_effects(instr) -> bool:
+    op = instr.op
+    if op in SIDE_EFFECTS:
+        return True
+    if op == Op.Div or op == Op.Mod:
+        divisor = instr.args[1]
+        return not (type(divisor) is Const and word(divisor.value) != 0)
+    return False
+
+
+def _remove_dead_instrs(fun: Function):
+    """Removes the instructions without side effects whose results are unused"""
+    definition = {}
+    for block in fun.blocks:
+        for instr in block.instrs:
+            if instr.dst is not None:
+                definition[instr.dst] = instr
+    live = set()
+    todo = []
+    for block in fun.blocks:
+        for instr in block.instrs:
+            if _has_side_effects(instr):
+                live.add(instr)
+                todo.append(instr)
+    used = set()
+    while todo:
+        for arg in todo.pop().args:
+            if type(arg) is Temp:
+                used.add(arg)
+                instr = definition.get(arg)
+                if instr is not None and instr not in live:
+                    live.add(instr)
+                    todo.append(instr)
+    for block in fun.blocks:
+        block.instrs = [instr for instr in block.instrs if instr in live]
+        for instr in block.instrs:
+            if instr.op == Op.Call and instr.dst not in used:
+                instr.dst = None
@@ -0,0 +1,92 @@
+"""
+The division and the remainder by constants, without div.
+
+Both code generators divide unsigned 64-bit words (div takes 20 to 90
+cycles). When the divisor is a constant d, the quotient can be computed
+with a multiplication and shifts instead (Granlund and Montgomery,
+"Division by Invariant Integers using Multiplication"):
+- d = 2^k: n >> k, and the remainder is n & (d - 1),
+- d >= 2^63: the quotient is 1 if n >= d, 0 otherwise,
+- otherwise n / d = (n * m) >> (64 + s) for a magic number m, which is the
+  high word of the product (the rdx of mul) shifted by s. When m does not
+  fit into 64 bits, m - 2^64 is used and the missing n * 2^64 is added back
+  (without overflowing) as (t + ((n - t) >> 1)) >> (s - 1), where t is the
+  high word of n * (m - 2^64).
+The remainder is n - (n / d) * d.
+
+The results are the same as those of div for every dividend (see
+tests.DivisionTests). A division by 0 is left to div, it fails at run time.
+"""
+
+from typing import Optional
+
+from ir import MASK
+
+
+def magic(d: int) -> tuple[int, int, bool]:
+    """
+    The magic number m and the shift s of the divisor (2 <= d < 2^63, not a
+    power of 2), and whether m is 65 bits long (then only m - 2^64 is given)
+    """
+    s = d.bit_length() - 1
+    # the smallest m for this shift, it is exact if the error is small
+    m = ((1 << (64 + s)) + d - 1) // d
+    if m * d - (1 << (64 + s)) <= 1 << s:
+        return (m, s, False)
+    s += 1
+    m = ((1 << (64 + s)) + d - 1) // d
+    return (m - (1 << 64), s, True)
+
+
+def divide_by_constant(divisor: int, remainder: bool) -> Optional[list[str]]:
+    """
+    The instructions which replace rax with rax / divisor (or rax % divisor),
+    unsigned, using rcx and rdx, or None for a division by 0
+    """
+    d = divisor & MASK
+    if d == 0:
+        return None
+    if d == 1:
+        return ["xor rax, rax"] if remainder else []
+    if d & (d - 1) == 0:
+        k = d.bit_length() - 1
+        if not remainder:
+            return [f"shr rax, {k}"]
+        if k < 31:
+            return [f"and rax, {d - 1}"]
+        # the mask does not fit into an immediate
+        return [f"shl rax, {64 - k}", f"shr rax, {64 - k}"]
+    if d >= 1 << 63:
+        if remainder:
+            return [
+                f"mov rcx, {d}",
+                "mov rdx, rax",
+                "sub rdx, rcx",
+                "cmp rax, rcx",
+                "cmovae rax, rdx",
+            ]
+        return [
+            f"mov rcx, {d}",
+            "mov rdx, rax",
+            "xor rax, rax",
+            "cmp rdx, rcx",
+            "setae al",
+        ]
+
+    (m, s, long_magic) = magic(d)
+    code = ["mov rcx, rax", f"mov rdx, {m}", "mul rdx"]
+    if long_magic:
+        code += ["mov rax, rcx", "sub rax, rdx", "shr rax, 1", "add rax, rdx"]
+        if s > 1:
+            code.append(f"shr rax, {s - 1}")
+    else:
+        if s:
+            code.append(f"shr rdx, {s}")
+        code.append("mov rax, rdx")
+    if remainder:
+        if d < 1 << 31:
+            code.append(f"imul rax, rax, {d}")
+        else:
+            code += [f"mov rdx, {d}", "imul rax, rdx"]
+        code += ["sub rcx, rax", "mov rax, rcx"]
+    return code
@@ -0,0 +1,25 @@
+"""
+Pausing the garbage collector.
+
+The compiler builds big structures without cycles (the trees, the
+instructions), so there is nothing for the garbage collector to find in
+them, but it would repeatedly scan all the objects created so far.
+"""
+
+import gc
+from contextlib import contextmanager
+
+
+@contextmanager
+def gc_paused():
+    """
+    Disables the garbage collector in the block, it is enabled again at the
+    end unless it was disabled before
+    """
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
@@ -0,0 +1,232 @@
+"""
+Global value numbering on the SSA form (see ssa), the dominator based one
+of Briggs, Cooper and Simpson, "Value Numbering".
+
+The blocks are visited in a walk of the dominator tree. Every expression
+(the operation and the value numbers of its operands) which was computed in
+a dominating block is available: an instruction computing it again is
+removed and its uses get the earlier result. The value number of a
+temporary is the temporary computing its value first, so on the way
+- the copies are propagated,
+- the operands of the commutative operations are sorted (e.g. a * b and
+  b * a are the same, and so are a < b and b > a),
+- a few identities are simplified, e.g. x + 0 and x * 1 are x,
+- the phis in the same block with the same values are merged, and a phi
+  whose values are all the same (or the phi itself) is that value.
+
+The memory is different: a load is only available while nothing can
+change the loaded word, which is known inside an extended basic block (a
+block and the dominated blocks which can only be entered from it, in a
+chain). A store makes its value available for the loads from the same
+address, a store through a pointer may change any variable whose address
+is taken (the globals, the locals of the function with addr), a store to
+such a variable may change the word at any pointer, and a call may change
+anything.
+"""
+
+from collections import Counter
+
+from cfg import CFG
+from ir import Const, Function, Instr, Mem, MemKind, Op, Temp, word
+
+COMMUTATIVE = frozenset({Op.Add, Op.Mul, Op.Eq, Op.Ne})
+# a op b is b swapped(op) a
+SWAPPED = {Op.Lt: Op.Gt, Op.Gt: Op.Lt, Op.Le: Op.Ge, Op.Ge: Op.Le}
+PURE = frozenset(
+    {
+        Op.Add,
+        Op.Sub,
+        Op.Mul,
+        Op.Div,
+        Op.Mod,
+        Op.Eq,
+        Op.Ne,
+        Op.Lt,
+        Op.Le,
+        Op.Gt,
+        Op.Ge,
+        Op.Addr,
+    }
+)
+
+
+def order(a, b) -> bool:
+    """True if the operands of a commutative operation are in order"""
+    if type(a) is Const:
+        return True
+    if type(b) is Const:
+        return False
+    return id(a) <= id(b)
+
+
+def simplify(op, a, b):
+    """The operand equal to a op b, if it is obvious, or None"""
+    if type(b) is Const:
+        value = word(b.value)
+        if value == 0 and op in (Op.Add, Op.Sub):
+            return a
+        if value == 0 and op == Op.Mul:
+            return b
+        if value == 1 and op in (Op.Mul, Op.Div):
+            return a
+        if value == 1 and op == Op.Mod:
+            return Const(0)
+    if type(a) is Const and word(a.value) == 0 and op in (Op.Add, Op.Mul):
+        return b if op == Op.Add else a
+    if type(a) is Const and word(a.value) == 1 and op == Op.Mul:
+        return b
+    if a is b and type(a) is Temp and op in (Op.Sub, Op.Ne, Op.Lt, Op.Gt):
+        return Const(0)
+    if a is b and type(a) is Temp and op in (Op.Eq, Op.Le, Op.Ge):
+        return Const(1)
+    return None
+
+
+def number_values(fun: Function) -> Counter:
+    """Removes the redundant instructions, returns their number"""
+    if not fun.blocks:
+        return Counter()
+    graph = CFG(fun)
+    blocks = fun.blocks
+    # the variables which may be changed through a pointer
+    aliased = {
+        instr.args[0]
+        for block in blocks
+        for instr in block.instrs
+        if instr.op == Op.Addr
+    }
+
+    def may_alias(var):
+        return var.kind == MemKind.Global or var in aliased
+
+    # the value numbers of the replaced temporaries
+    number: dict[Temp, object] = {}
+    # the available expressions, the keys added by every block are removed
+    # after its dominator subtree
+    available: dict[tuple, Temp] = {}
+    added: list[list[tuple]] = [[] for _ in blocks]
+    # the words in memory at the end of every block, while they are needed
+    memory_at_end: list = [None] * len(blocks)
+    removed = 0
+
+    def value(x):
+        return number.get(x, x) if type(x) is Temp else x
+
+    todo = [(0, False)]
+    while todo:
+        (i, done) = todo.pop()
+        if done:
+            for key in added[i]:
+                del available[key]
+            continue
+        todo.append((i, True))
+        todo.extend((child, False) for child in graph.dom_children[i])
+
+        block = blocks[i]
+        preds = graph.preds[i]
+        if len(preds) == 1 and memory_at_end[preds[0]] is not None:
+            memory = dict(memory_at_end[preds[0]])
+        else:
+            memory = {}
+        instrs = []
+        for instr in block.instrs:
+            op = instr.op
+            dst = instr.dst
+            if op == Op.Phi:
+                key = _number_phi(instr, number, value)
+                if key is None:
+                    removed += 1
+                    continue
+            else:
+                if any(type(arg) is Temp and arg in number for arg in instr.args):
+                    instr.args = tuple(value(arg) for arg in instr.args)
+                args = instr.args
+                key = None
+                if op == Op.Copy:
+                    assert dst is not None
+                    number[dst] = args[0]
+                    removed += 1
+                    continue
+                elif op in PURE:
+                    assert dst is not None
+                    if op == Op.Addr:
+                        key = (op, args[0])
+                    else:
+                        (a, b) = args
+                        same = simplify(op, a, b)
+                        if same is not None:
+                            number[dst] = same
+                            removed += 1
+                            continue
+                        if op in COMMUTATIVE and not order(a, b):
+                            (a, b) = (b, a)
+                        elif op in SWAPPED and not order(a, b):
+                            (op, a, b) = (SWAPPED[op], b, a)
+                        key = (op, a, b)
+                elif op == Op.Load:
+                    assert dst is not None
+                    known = memory.get(args[0])
+                    if known is not None:
+                        number[dst] = known
+                        removed += 1
+                        continue
+                    memory[args[0]] = dst
+                elif op == Op.Store:
+                    (target, stored) = args
+                    if type(target) is Mem:
+                        if may_alias(target):
+                            for k in [k for k in memory if type(k) is not Mem]:
+                                del memory[k]
+                    else:
+                        for k in [
+                            k for k in memory if type(k) is not Mem or may_alias(k)
+                        ]:
+                            del memory[k]
+                    memory[target] = stored
+                elif op == Op.Call:
+                    memory.clear()
+            if key is not None:
+                assert dst is not None
+                known = available.get(key)
+                if known is not None:
+                    number[dst] = known
+                    removed += 1
+                    continue
+                available[key] = dst
+                added[i].append(key)
+            instrs.append(instr)
+        block.instrs = instrs
+        memory_at_end[i] = memory
+
+    # the values coming along the back edges are known now
+    for block in blocks:
+        for phi in block.phis:
+            phi.args = tuple(
+                _resolve(arg, number) if k % 2 else arg
+                for k, arg in enumerate(phi.args)
+            )
+    return Counter(removed=removed)
+
+
+def _resolve(x, number):
+    while type(x) is Temp and x in number:
+        x = number[x]
+    return x
+
+
+def _number_phi(phi: Instr, number, value):
+    """
+    The key of the phi, or None if it is the same as one of its values (then
+    its value number is recorded)
+    """
+    args = tuple(value(arg) if k % 2 else arg for k, arg in enumerate(phi.args))
+    phi.args = args
+    # the constants are equal by their values, the others by identity
+    values = {
+        v if type(v) is Const else id(v): v for v in args[1::2] if v is not phi.dst
+    }
+    if len(values) == 1:
+        [same] = values.values()
+        number[phi.dst] = same
+        return None
+    return (Op.Phi, args)
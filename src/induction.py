@@ -0,0 +1,408 @@
+"""
+Induction variables and strength reduction on the SSA form (see ssa).
+
+A basic induction variable of a loop is a phi at its header which every
+iteration increases by the same constant, e.g. i in
+
+    while (i < n) { ... i += 1; }
+
+A multiplication of a basic induction variable in the loop is derived from
+it, and can become a new induction variable of its own, which is updated
+with additions next to the update of i:
+- i * k (k is the same in the whole loop, e.g. a constant) increases by
+  step * k,
+- i * i increases by 2 * step * i + step * step, which increases by
+  2 * step * step (e.g. cand * cand in the primes example).
+The starting values are computed in front of the loop (see licm).
+
+If the loop only uses i to test whether it should end, e.g. i < 100 and
+i * 8 is the only other use, the test becomes i * 8 < 800 and i is removed
+with the dead code (see dce). The test is only replaced when it is known to
+give the same results, i.e. the start, the step and the bound are constants,
+the loop is left when the test fails and every iteration passes it (so i
+stays below the bound, plus a step) and the new variable does not wrap
+around.
+
+The new variables are not free: every one is an addition and a phi, which
+is a copy at the end of every iteration (see ssa), and every temporary
+lives in the stack frame (see backend). So the multiplications of i are
+only replaced if they cost more than the new variables, less what is saved
+if i is removed. With the default costs (in the instructions of the
+generated code, imul counts as its latency) this is the case when i is
+removed, e.g. cand * cand is cheaper than the two variables it would need.
+
+Two basic induction variables with the same start and step are always
+merged.
+"""
+
+from collections import Counter
+from typing import Optional
+
+from cfg import CFG, Loop
+from gvn import simplify
+from ir import EVALUATE, Block, Const, Function, Instr, Op, Operand, Temp, word
+from licm import find_preheader
+
+# the costs of the instructions in a loop, see above
+ADD_COST = 3
+COPY_COST = 2
+MUL_COST = 5
+
+# the comparisons of i with a bound, when i is on the left and on the right
+BOUND_RIGHT = frozenset({Op.Lt, Op.Le})
+BOUND_LEFT = frozenset({Op.Gt, Op.Ge})
+
+
+class Induction:
+    """A basic induction variable: the phi and the update, by a constant step"""
+
+    def __init__(self, phi: Instr, update: Instr, step: int, start: Operand):
+        assert phi.dst is not None and update.dst is not None
+        self.phi = phi
+        self.update = update
+        # i and its next value
+        self.var: Temp = phi.dst
+        self.next: Temp = update.dst
+        self.step = step
+        self.start = start
+
+
+def reduce_strength(fun: Function, mul_cost: int = MUL_COST) -> Counter:
+    """
+    Rewrites the induction variables of the loops, returns the numbers of
+    the reduced multiplications, of the merged variables and of the replaced
+    tests
+    """
+    if not fun.blocks:
+        return Counter()
+    graph = CFG(fun)
+    if not graph.loops:
+        return Counter()
+    reducer = _Reducer(fun, graph, mul_cost)
+    for loop in reversed(graph.loops):
+        if loop.header != 0:
+            reducer.run(loop)
+    if reducer.inserted:
+        fun.blocks = [
+            b
+            for block in graph.blocks
+            for b in [reducer.inserted.get(block), block]
+            if b is not None
+        ]
+    return reducer.counts
+
+
+def _key(x: Operand):
+    # the constants are equal by their values, the others by identity
+    return x if type(x) is Const else id(x)
+
+
+class _Reducer:
+    def __init__(self, fun: Function, graph: CFG, mul_cost: int):
+        self.fun = fun
+        self.graph = graph
+        self.mul_cost = mul_cost
+        self.counts = Counter()
+        # the definitions, their blocks and the users of the temporaries
+        self.definition: dict[Temp, Instr] = {}
+        self.block_of: dict[Instr, Block] = {}
+        self.users: dict[Temp, list[Instr]] = {}
+        for block in fun.blocks:
+            for instr in block.instrs:
+                self.add(instr, block)
+        # the blocks of every loop, with the preheaders of the inner loops
+        self.loop_blocks = {
+            loop: {graph.blocks[i] for i in loop.all_blocks()} for loop in graph.loops
+        }
+        # the inserted preheaders, by their headers
+        self.inserted: dict[Block, Block] = {}
+        # the loop which is rewritten, and its preheader once it is needed
+        self.loop: Loop
+        self.preheader: Optional[Block] = None
+
+    def add(self, instr: Instr, block: Block):
+        self.block_of[instr] = block
+        if instr.dst is not None:
+            self.definition[instr.dst] = instr
+        for arg in instr.args:
+            if type(arg) is Temp:
+                self.users.setdefault(arg, []).append(instr)
+
+    def remove(self, instr: Instr):
+        block = self.block_of.pop(instr)
+        block.instrs.remove(instr)
+
+    def replace(self, old: Temp, new: Operand):
+        """Replaces the uses of old with new"""
+        users = self.users.pop(old, [])
+        for instr in users:
+            instr.args = tuple(new if arg is old else arg for arg in instr.args)
+        if type(new) is Temp:
+            self.users.setdefault(new, []).extend(users)
+
+    def uses(self, var: Temp) -> list[Instr]:
+        """The instructions using the temporary, which were not removed"""
+        return [instr for instr in self.users.get(var, []) if instr in self.block_of]
+
+    def run(self, loop: Loop):
+        self.loop = loop
+        self.preheader = None
+        members = self.loop_blocks[loop]
+        header = self.graph.blocks[loop.header]
+        inductions = self.find_inductions(header, members)
+        if not inductions:
+            return
+        self.merge(inductions)
+        # the multiplications of every induction variable
+        products: dict[Temp, list[Instr]] = {var: [] for var in inductions}
+        blocks = [b for b in self.graph.blocks if b in members]
+        blocks.extend(b for b in self.inserted.values() if b in members)
+        for block in blocks:
+            for instr in block.instrs:
+                if instr.op != Op.Mul:
+                    continue
+                (a, b) = instr.args
+                if b in inductions and a not in inductions:
+                    (a, b) = (b, a)
+                if a in inductions and (
+                    b is a or type(b) is Const or self.outside(b, members)
+                ):
+                    products[a].append(instr)
+        for var, muls in products.items():
+            if muls:
+                self.reduce(inductions[var], muls, members)
+
+    def find_inductions(self, header: Block, members) -> dict[Temp, Induction]:
+        """The basic induction variables of the loop, by their phis"""
+        result = {}
+        for phi in header.phis:
+            inside = set()
+            outside = {}
+            for source, value in phi.incoming:
+                if source in members:
+                    inside.add(value)
+                else:
+                    outside[_key(value)] = value
+            if len(inside) != 1 or len(outside) != 1:
+                continue
+            [value] = inside
+            [start] = outside.values()
+            update = self.definition.get(value)
+            if update is None or self.block_of[update] not in members:
+                continue
+            (a, b) = update.args if update.op in (Op.Add, Op.Sub) else (None, None)
+            if update.op == Op.Add and type(a) is Const and b is phi.dst:
+                (a, b) = (b, a)
+            if a is phi.dst and type(b) is Const:
+                step = word(b.value) if update.op == Op.Add else word(-b.value)
+                result[phi.dst] = Induction(phi, update, step, start)
+        return result
+
+    def merge(self, inductions: dict[Temp, Induction]):
+        """Removes the variables with the same start and step as earlier ones"""
+        seen: dict[tuple, Induction] = {}
+        for var, induction in list(inductions.items()):
+            key = (_key(induction.start), induction.step)
+            first = seen.get(key)
+            if first is None:
+                seen[key] = induction
+                continue
+            del inductions[var]
+            self.remove(induction.phi)
+            self.replace(var, first.var)
+            if self.dominates(first.update, induction.update):
+                self.remove(induction.update)
+                self.replace(induction.next, first.next)
+            self.counts["merged"] += 1
+
+    def reduce(self, induction: Induction, muls: list[Instr], members):
+        """Replaces the multiplications of the variable, if it pays off"""
+        var = induction.var
+        # the other operands, var itself for the squares
+        factors = {}
+        for instr in muls:
+            (a, b) = instr.args
+            k = b if a is var else a
+            factors[_key(k)] = k
+        new_cost = (ADD_COST + COPY_COST) * sum(
+            2 if k is var else 1 for k in factors.values()
+        )
+        saved = self.mul_cost * len(muls)
+        test = self.find_test(induction, muls, members)
+        if test is not None:
+            # i and its update are dead
+            saved += ADD_COST + COPY_COST
+        if saved <= new_cost:
+            return
+        new = {
+            key: self.square(induction) if k is var else self.linear(induction, k)
+            for key, k in factors.items()
+        }
+        for instr in muls:
+            assert instr.dst is not None
+            (a, b) = instr.args
+            self.remove(instr)
+            self.replace(instr.dst, new[_key(b if a is var else a)])
+            self.counts["reduced"] += 1
+        if test is not None:
+            (test, k, bound) = test
+            product = new[_key(k)]
+            bound = Const(bound * word(k.value))
+            if test.args[0] is var:
+                test.args = (product, bound)
+            else:
+                test.args = (bound, product)
+            self.users.setdefault(product, []).append(test)
+            self.counts["tests"] += 1
+
+    def find_test(self, induction: Induction, muls: list[Instr], members):
+        """
+        The test of the loop which can use i * k instead of i (if i is not
+        used otherwise), with k and the bound
+        """
+        var = induction.var
+        start = induction.start
+        step = induction.step
+        if type(start) is not Const or step <= 0:
+            return None
+        start = word(start.value)
+        others = [
+            instr
+            for instr in self.uses(var)
+            if instr is not induction.update and instr not in muls
+        ]
+        if len(others) != 1:
+            return None
+        [test] = others
+        (a, b) = test.args
+        if test.op in BOUND_RIGHT and a is var and type(b) is Const:
+            bound = word(b.value)
+        elif test.op in BOUND_LEFT and b is var and type(a) is Const:
+            bound = word(a.value)
+        else:
+            return None
+        block = self.block_of[test]
+        if block not in members or not self.ends_loop(test, block, members):
+            return None
+        # the values of i while the loop runs, and the one ending it
+        last = max(start, bound + step)
+        for instr in muls:
+            (a, b) = instr.args
+            k = b if a is var else a
+            if type(k) is not Const or word(k.value) <= 0:
+                continue
+            value = word(k.value)
+            products = (start * value, last * value, bound * value)
+            if all(word(x) == x for x in (last, *products)):
+                return (test, k, bound)
+        return None
+
+    def ends_loop(self, test: Instr, block: Block, members) -> bool:
+        """
+        The loop is left when the test fails, and every iteration passes it,
+        so i never gets past the bound (by more than a step)
+        """
+        branch = block.terminator
+        if branch is None or branch.op != Op.Br or branch.args[0] is not test.dst:
+            return False
+        (_, if_true, if_false) = branch.args
+        if if_true not in members or if_false in members:
+            return False
+        graph = self.graph
+        header = graph.blocks[self.loop.header]
+        if block not in graph.number:
+            return False
+        return all(
+            b in graph.number and graph.dominates(graph.number[block], graph.number[b])
+            for b in members
+            if header in b.successors
+        )
+
+    def linear(self, induction: Induction, k: Operand) -> Temp:
+        """The new variable i * k"""
+        start = self.compute(Op.Mul, induction.start, k)
+        step = self.compute(Op.Mul, Const(induction.step), k)
+        return self.new_variable(induction, start, step)
+
+    def square(self, induction: Induction) -> Temp:
+        """The new variable i * i"""
+        step = induction.step
+        start = self.compute(Op.Mul, induction.start, induction.start)
+        difference = self.compute(
+            Op.Add,
+            self.compute(Op.Mul, induction.start, Const(word(2 * step))),
+            Const(word(step * step)),
+        )
+        difference = self.new_variable(
+            induction, difference, Const(word(2 * step * step))
+        )
+        return self.new_variable(induction, start, difference)
+
+    def new_variable(self, induction: Induction, start, step) -> Temp:
+        """A new phi next to the one of the induction, updated by the step"""
+        old = induction.phi
+        var = self.fun.new_temp(induction.var.type)
+        next_var = self.fun.new_temp(induction.var.type)
+        update = Instr(Op.Add, next_var, (var, step))
+        header = self.block_of[old]
+        # the start comes from outside of the loop, the update along the back
+        # edges
+        args = tuple(
+            x
+            for (source, value) in old.incoming
+            for x in (source, next_var if value is induction.next else start)
+        )
+        phi = Instr(Op.Phi, var, args)
+        header.instrs.insert(len(header.phis), phi)
+        self.add(phi, header)
+        block = self.block_of[induction.update]
+        block.instrs.insert(block.instrs.index(induction.update) + 1, update)
+        self.add(update, block)
+        return var
+
+    def compute(self, op: Op, a: Operand, b: Operand) -> Operand:
+        """a op b, computed in the preheader if it is not obvious"""
+        if type(a) is Const and type(b) is Const:
+            return Const(EVALUATE[op](word(a.value), word(b.value)))
+        same = simplify(op, a, b)
+        if same is not None:
+            return same
+        preheader = self.find_preheader()
+        dst = self.fun.new_temp()
+        instr = Instr(op, dst, (a, b))
+        preheader.instrs.insert(-1, instr)
+        self.add(instr, preheader)
+        return dst
+
+    def find_preheader(self) -> Block:
+        if self.preheader is not None:
+            return self.preheader
+        loop = self.loop
+        header = self.graph.blocks[loop.header]
+        members = self.loop_blocks[loop]
+        preheader = find_preheader(self.fun, self.graph, loop, members, self.inserted)
+        if preheader is self.inserted.get(header):
+            for instr in preheader.instrs:
+                self.add(instr, preheader)
+            parent = loop.parent
+            while parent is not None:
+                self.loop_blocks[parent].add(preheader)
+                parent = parent.parent
+        self.preheader = preheader
+        return preheader
+
+    def outside(self, x: Temp, members) -> bool:
+        """x is computed outside of the loop"""
+        instr = self.definition.get(x)
+        return instr is None or self.block_of[instr] not in members
+
+    def dominates(self, a: Instr, b: Instr) -> bool:
+        """The instruction a runs before b, on every path"""
+        block_a = self.block_of[a]
+        block_b = self.block_of[b]
+        if block_a is block_b:
+            return block_a.instrs.index(a) < block_b.instrs.index(b)
+        number = self.graph.number
+        if block_a not in number or block_b not in number:
+            return False
+        return self.graph.dominates(number[block_a], number[block_b])
@@ -0,0 +1,252 @@
+"""
+Inlining of the calls on the SSA form (see ssa).
+
+A call of a small function is replaced with a copy of its code: the block
+of the call jumps to the copy of the entry of the callee, the returns of the
+copy jump to the rest of the block, where a phi picks the returned value.
+The parameters of the callee are replaced with the arguments, its
+temporaries and the locals in its stack frame get new names in the caller
+(e.g. x becomes x.1 if the caller has an x already).
+
+A call is inlined if the callee grows the caller by at most growth
+instructions: its size, less the instructions of the call itself (see
+CALL_COST), which go away. The limit is LOOP_BONUS times higher for the
+calls in loops, they run many times.
+
+The callees are inlined into their callers before the callers are inlined
+into theirs (bottom-up, in the order of the strongly connected components
+of the call graph), so a small function keeps its inlined calls when it is
+inlined itself. The functions in a cycle of the call graph (the recursive
+ones) are never inlined.
+"""
+
+from collections import Counter
+from typing import Optional
+
+from cfg import CFG
+from ir import Block, Function, Instr, Mem, Op, Program, Temp
+
+# the instructions which run for a call and go away when it is inlined:
+# call, push rbp, mov rbp rsp, sub rsp, add rsp, pop rbp, ret, the add rsp
+# of the caller and the push of the result, and a push for every argument
+CALL_COST = 9
+# how much bigger a caller may get for a call
+GROWTH = 10
+LOOP_BONUS = 4
+# the callers stop growing at this size
+MAX_SIZE = 2000
+
+
+def inline_calls(program: Program, growth: int = GROWTH) -> dict[str, Counter]:
+    """
+    Inlines the calls of the small functions, returns the statistics of every
+    function: its inlined calls, by the callees and the places of the calls
+    (e.g. twice() at L1:3 is the fourth instruction of the block L1)
+    """
+    functions = {fun.name: fun for fun in program.functions}
+    stats = {fun.name: Counter() for fun in program.functions}
+    recursive = set()
+    for component in call_graph_components(program):
+        if len(component) > 1 or calls(component[0], component[0].name):
+            recursive.update(fun.name for fun in component)
+        for fun in component:
+            inliner = Inliner(fun, functions, recursive, growth)
+            stats[fun.name].update(inliner.run())
+    return stats
+
+
+def size(fun: Function) -> int:
+    return sum(len(block.instrs) for block in fun.blocks)
+
+
+def calls(fun: Function, name: str) -> bool:
+    return any(
+        instr.op == Op.Call and instr.args[0] == name
+        for block in fun.blocks
+        for instr in block.instrs
+    )
+
+
+def call_graph_components(program: Program) -> list[list[Function]]:
+    """
+    The strongly connected components of the call graph, the callees before
+    their callers (Tarjan's algorithm, without recursion)
+    """
+    functions = {fun.name: fun for fun in program.functions}
+    callees = {
+        fun.name: list(
+            dict.fromkeys(
+                instr.args[0]
+                for block in fun.blocks
+                for instr in block.instrs
+                if instr.op == Op.Call and instr.args[0] in functions
+            )
+        )
+        for fun in program.functions
+    }
+    index: dict[str, int] = {}
+    low: dict[str, int] = {}
+    stack: list[str] = []
+    on_stack = set()
+    components = []
+    for root in functions:
+        if root in index:
+            continue
+        # the functions being visited, with the positions in their callees
+        path = [(root, 0)]
+        index[root] = low[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        while path:
+            (name, i) = path[-1]
+            if i < len(callees[name]):
+                path[-1] = (name, i + 1)
+                callee = callees[name][i]
+                if callee not in index:
+                    index[callee] = low[callee] = len(index)
+                    stack.append(callee)
+                    on_stack.add(callee)
+                    path.append((callee, 0))
+                elif callee in on_stack:
+                    low[name] = min(low[name], index[callee])
+                continue
+            path.pop()
+            if path:
+                caller = path[-1][0]
+                low[caller] = min(low[caller], low[name])
+            if low[name] == index[name]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.remove(member)
+                    component.append(functions[member])
+                    if member == name:
+                        break
+                components.append(component)
+    return components
+
+
+class Inliner:
+    def __init__(self, fun: Function, functions, recursive, growth: int):
+        self.fun = fun
+        self.functions = functions
+        self.recursive = recursive
+        self.growth = growth
+        self.size = size(fun)
+
+    def run(self) -> Counter:
+        fun = self.fun
+        if not fun.blocks:
+            return Counter()
+        graph = CFG(fun)
+        depth = {block: graph.loop_depth(i) for i, block in enumerate(fun.blocks)}
+        inlined = Counter()
+        blocks = fun.blocks
+        # the blocks as they were before the calls were inlined, with their
+        # sizes (the rest of a block after a call ends like the block did)
+        origin = {block: (block.label, len(block.instrs)) for block in blocks}
+        i = 0
+        while i < len(blocks):
+            block = blocks[i]
+            for j, instr in enumerate(block.instrs):
+                if instr.op != Op.Call:
+                    continue
+                callee = self.inlinable(instr, depth[block])
+                if callee is None:
+                    continue
+                (label, length) = origin[block]
+                position = length - len(block.instrs) + j
+                (copies, rest) = self.inline(block, j, callee)
+                start = i + 1
+                blocks[start:start] = [*copies, rest]
+                for new in copies:
+                    depth[new] = depth[block]
+                depth[rest] = depth[block]
+                origin[rest] = origin[block]
+                inlined[f"{callee.name}() at {label}:{position}"] += 1
+                # the rest of the block may have more calls
+                i += len(copies)
+                break
+            i += 1
+        return inlined
+
+    def inlinable(self, call: Instr, loop_depth: int) -> Optional[Function]:
+        """The callee, if the call should be inlined"""
+        name = call.args[0]
+        callee = self.functions.get(name)
+        if callee is None or name in self.recursive or callee is self.fun:
+            return None
+        if not callee.blocks or len(call.args) - 1 != len(callee.params):
+            return None
+        # the copy of the entry is entered from the caller, so nothing may
+        # jump to it, and something has to return
+        entry = callee.blocks[0]
+        if any(entry in block.successors for block in callee.blocks):
+            return None
+        if not any(block.instrs[-1].op == Op.Ret for block in callee.blocks):
+            return None
+        callee_size = size(callee)
+        limit = self.growth * (LOOP_BONUS if loop_depth else 1)
+        if callee_size - CALL_COST - len(callee.params) > limit:
+            return None
+        if self.size + callee_size > MAX_SIZE:
+            return None
+        self.size += callee_size
+        return callee
+
+    def inline(self, block: Block, position: int, callee: Function):
+        """
+        Replaces the call at the position in the block with a copy of the
+        callee, returns the copied blocks and the block with the rest of the
+        instructions
+        """
+        fun = self.fun
+        call = block.instrs[position]
+        rest = fun.new_block()
+        after = position + 1
+        rest.instrs = block.instrs[after:]
+        # the successors of the block now come from the rest
+        for target in rest.successors:
+            for phi in target.phis:
+                phi.args = tuple(rest if arg is block else arg for arg in phi.args)
+
+        values: dict = dict(zip(callee.params, call.args[1:]))
+        copies = {}
+        for old in callee.blocks:
+            copies[old] = fun.new_block()
+            for instr in old.instrs:
+                dst = instr.dst
+                if dst is not None:
+                    name = None if dst.name.isdigit() else dst.name
+                    values[dst] = fun.new_temp(dst.type, name)
+        for slot in callee.slots:
+            values[slot] = fun.new_slot(slot.name, slot.type)
+
+        def value(arg):
+            if type(arg) is Block:
+                return copies[arg]
+            if type(arg) is Temp or type(arg) is Mem:
+                # the globals stay
+                return values.get(arg, arg)
+            return arg
+
+        returned = []
+        for old, new in copies.items():
+            for instr in old.instrs:
+                args = tuple(value(arg) for arg in instr.args)
+                if instr.op == Op.Ret:
+                    returned.append((new, args[0]))
+                    new.instrs.append(Instr(Op.Jmp, None, (rest,)))
+                else:
+                    dst = None if instr.dst is None else values[instr.dst]
+                    new.instrs.append(Instr(instr.op, dst, args))
+
+        if call.dst is not None:
+            if len(returned) == 1:
+                result = Instr(Op.Copy, call.dst, (returned[0][1],))
+            else:
+                args = tuple(x for pair in returned for x in pair)
+                result = Instr(Op.Phi, call.dst, args)
+            rest.instrs.insert(0, result)
+        block.instrs[position:] = [Instr(Op.Jmp, None, (copies[callee.blocks[0]],))]
+        return (list(copies.values()), rest)
@@ -0,0 +1,165 @@
+"""
+An interpreter of the intermediate code (see ir).
+
+It runs programs the way the compiled code does (64-bit words, unsigned
+division, the locals in memory have addresses in a stack), so it is used to
+test the passes which transform the intermediate code, without assembling
+anything.
+
+The calls are not recursive in Python, the frames are kept on a list.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+from ir import (
+    EVALUATE,
+    INIT,
+    Block,
+    Const,
+    Function,
+    Mem,
+    MemKind,
+    Op,
+    Program,
+    Temp,
+    word,
+)
+from slots import add_slots
+
+WORD = 8
+GLOBALS_START = 0x1000
+STACK_START = 0x7FFF0000
+
+
+class StepLimitExceeded(Exception):
+    pass
+
+
+@add_slots
+@dataclass
+class Frame:
+    fun: Function
+    values: dict
+    # the addresses of the slots of the function, in the stack
+    addresses: dict
+    block: Block
+    pc: int
+    # where the result goes, in the caller's frame
+    dst: Optional[Temp] = None
+
+
+class Interpreter:
+    def __init__(self, program: Program, max_steps: Optional[int] = None):
+        self.program = program
+        self.functions = {fun.name: fun for fun in program.functions}
+        self.max_steps = max_steps
+        self.steps = 0
+        self.output: list[int] = []
+        # the words in memory, by their addresses
+        self.memory: dict[int, int] = {}
+        # the addresses of the globals
+        self.addresses: dict = {}
+        for i, var in enumerate(program.globals):
+            address = GLOBALS_START + WORD * i
+            self.addresses[var] = address
+            self.memory[address] = word(var.init)
+        # the number of frames on the stack, at most
+        self.max_depth = 0
+        # the other initial values are stored before main runs, as in _start
+        if INIT in self.functions:
+            self.run(INIT)
+
+    def new_frame(self, fun: Function, args, sp: int) -> Frame:
+        values = dict(zip(fun.params, args))
+        addresses = {slot: sp - WORD * (i + 1) for i, slot in enumerate(fun.slots)}
+        return Frame(fun, values, addresses, fun.blocks[0], 0)
+
+    def run(self, name: str = "main", args=()) -> int:
+        """Calls the function and returns its result"""
+        frames: list[Frame] = []
+        sp = STACK_START
+        frame = self.new_frame(self.functions[name], args, sp)
+        sp -= WORD * len(frame.fun.slots)
+        memory = self.memory
+
+        def value(x):
+            if type(x) is Const:
+                return word(x.value)
+            # e.g. a variable which is read before it is written
+            return values.get(x, 0)
+
+        def address(x):
+            """The address of a Mem, or the pointer"""
+            if type(x) is not Mem:
+                return value(x)
+            if x.kind == MemKind.Global:
+                return self.addresses[x]
+            return frame.addresses[x]
+
+        def jump(target):
+            """Goes to the block, its phis take their values at the same time"""
+            source = frame.block
+            (frame.block, frame.pc) = (target, 0)
+            incoming = []
+            for phi in target.instrs:
+                if phi.op != Op.Phi:
+                    break
+                args = phi.args
+                k = args.index(source)
+                incoming.append((phi.dst, value(args[k + 1])))
+                frame.pc += 1
+            values.update(incoming)
+
+        values = frame.values
+        while True:
+            instr = frame.block.instrs[frame.pc]
+            frame.pc += 1
+            self.steps += 1
+            if self.max_steps is not None and self.steps > self.max_steps:
+                raise StepLimitExceeded(self.steps)
+            op = instr.op
+            args = instr.args
+            evaluate = EVALUATE.get(op)
+            if evaluate is not None:
+                values[instr.dst] = evaluate(value(args[0]), value(args[1]))
+            elif op == Op.Copy:
+                values[instr.dst] = value(args[0])
+            elif op == Op.Br:
+                jump(args[1] if value(args[0]) != 0 else args[2])
+            elif op == Op.Jmp:
+                jump(args[0])
+            elif op == Op.Load:
+                values[instr.dst] = memory.get(address(args[0]), 0)
+            elif op == Op.Store:
+                memory[address(args[0])] = value(args[1])
+            elif op == Op.Addr:
+                values[instr.dst] = address(args[0])
+            elif op == Op.Print:
+                self.output.append(value(args[0]))
+            elif op == Op.Call:
+                callee = self.functions[args[0]]
+                frame.dst = instr.dst
+                frames.append(frame)
+                self.max_depth = max(self.max_depth, len(frames))
+                frame = self.new_frame(callee, [value(a) for a in args[1:]], sp)
+                sp -= WORD * len(callee.slots)
+                values = frame.values
+            elif op == Op.Ret:
+                result = value(args[0])
+                sp += WORD * len(frame.fun.slots)
+                if not frames:
+                    return result
+                frame = frames.pop()
+                values = frame.values
+                if frame.dst is not None:
+                    values[frame.dst] = result
+            else:
+                raise NotImplementedError(op)
+
+
+def run(program: Program, max_steps: Optional[int] = None) -> list[int]:
+    """Runs the main function of the program, returns the printed numbers"""
+    interpreter = Interpreter(program, max_steps)
+    interpreter.run()
+    return interpreter.output
@@ -0,0 +1,339 @@
+"""
+The intermediate language of the compiler: three-address code.
+
+A Program is a list of global variables and functions. The code of a
+Function is a list of basic blocks, the first one is the entry. A Block is a
+list of instructions, its last instruction (the terminator) jumps to other
+blocks or returns, no other instruction does.
+
+An instruction (Instr) computes at most one result, a temporary (Temp). Its
+arguments are operands: temporaries, constants (Const), memory locations
+(Mem: the global variables and the locals whose address is taken), and, for
+the terminators and calls, blocks and function names.
+
+Every value is a 64-bit word, the temporaries are typed only to tell the
+pointers from the numbers.
+
+The textual form (str of a Program, a Function or an Instr) is meant for
+debugging, e.g.
+
+    function inc(%n) {
+    L0:
+        %1 = add %n, 1
+        ret %1
+    }
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from enum import Enum
+from typing import Optional, Union
+
+from slots import add_slots
+
+
+class Type(Enum):
+    Long = "long"
+    Ptr = "ptr"
+
+    def __str__(self):
+        return self.value
+
+
+class Op(Enum):
+    Copy = "copy"  # dst = a
+    # arithmetic, dst = a op b; div and mod are unsigned, like the old backend
+    Add = "add"
+    Sub = "sub"
+    Mul = "mul"
+    Div = "div"
+    Mod = "mod"
+    # signed comparisons, dst = 1 if a op b else 0
+    Eq = "eq"
+    Ne = "ne"
+    Lt = "lt"
+    Le = "le"
+    Gt = "gt"
+    Ge = "ge"
+    # memory
+    Addr = "addr"  # dst = the address of the Mem a
+    Load = "load"  # dst = the word at a (a Mem or a pointer)
+    Store = "store"  # the word at a (a Mem or a pointer) = b
+    # the others
+    Call = "call"  # dst = the function a called with the other args
+    Print = "print"  # prints a
+    # SSA form: dst = the value coming from the block which jumped here,
+    # the args are pairs of a block and a value (b1, v1, b2, v2, ...)
+    Phi = "phi"
+    # terminators
+    Jmp = "jmp"  # jumps to the block a
+    Br = "br"  # jumps to the block b if a is not 0, to the block c otherwise
+    Ret = "ret"  # returns a
+
+    def __str__(self):
+        return self.value
+
+
+ARITHMETIC = frozenset({Op.Add, Op.Sub, Op.Mul, Op.Div, Op.Mod})
+COMPARISONS = frozenset({Op.Eq, Op.Ne, Op.Lt, Op.Le, Op.Gt, Op.Ge})
+BINARY = ARITHMETIC | COMPARISONS
+TERMINATORS = frozenset({Op.Jmp, Op.Br, Op.Ret})
+
+
+# -----------------------------------------
+# Semantics
+# -----------------------------------------
+
+MASK = (1 << 64) - 1
+
+
+def word(value: int) -> int:
+    """The value as a signed 64-bit word"""
+    return ((value + (1 << 63)) & MASK) - (1 << 63)
+
+
+# the results of the binary instructions, for the words a and b
+# (a division by 0 raises ZeroDivisionError)
+EVALUATE = {
+    Op.Add: lambda a, b: word(a + b),
+    Op.Sub: lambda a, b: word(a - b),
+    Op.Mul: lambda a, b: word(a * b),
+    Op.Div: lambda a, b: word((a & MASK) // (b & MASK)),
+    Op.Mod: lambda a, b: word((a & MASK) % (b & MASK)),
+    Op.Eq: lambda a, b: int(a == b),
+    Op.Ne: lambda a, b: int(a != b),
+    Op.Lt: lambda a, b: int(a < b),
+    Op.Le: lambda a, b: int(a <= b),
+    Op.Gt: lambda a, b: int(a > b),
+    Op.Ge: lambda a, b: int(a >= b),
+}
+
+
+# -----------------------------------------
+# Operands
+# -----------------------------------------
+
+# Temps, Mems and Blocks are compared by identity, their names are only
+# for the textual form (and unique in their function).
+
+
+@add_slots
+@dataclass(frozen=True)
+class Const:
+    value: int
+    type = Type.Long
+
+    def __str__(self):
+        return str(self.value)
+
+
+@add_slots
+@dataclass(eq=False)
+class Temp:
+    name: str
+    type: Type = Type.Long
+
+    def __str__(self):
+        return f"%{self.name}"
+
+
+class MemKind(Enum):
+    Global = "global"
+    Local = "local"
+
+    def __str__(self):
+        return self.value
+
+
+@add_slots
+@dataclass(eq=False)
+class Mem:
+    """A variable in memory, global or in the stack frame of a function"""
+
+    name: str
+    kind: MemKind
+    type: Type = Type.Long
+    init: int = 0  # the initial value of a global
+
+    def __str__(self):
+        sigil = "@" if self.kind == MemKind.Global else "$"
+        return f"{sigil}{self.name}"
+
+
+Operand = Union[Const, Temp, Mem]
+
+
+# -----------------------------------------
+# Code
+# -----------------------------------------
+
+
+@add_slots
+@dataclass(eq=False)
+class Instr:
+    op: Op
+    dst: Optional[Temp]
+    args: tuple
+
+    def __str__(self):
+        op = self.op
+        args = self.args
+        if op == Op.Call:
+            operands = ", ".join(map(str, args[1:]))
+            text = f"call {args[0]}({operands})"
+        elif op == Op.Phi:
+            pairs = zip(args[::2], args[1::2])
+            text = "phi " + ", ".join(f"[{b.label}: {v}]" for (b, v) in pairs)
+        elif op in TERMINATORS:
+            text = " ".join([str(op), ", ".join(map(label, args))])
+        else:
+            text = " ".join([str(op), ", ".join(map(str, args))])
+        if self.dst is None:
+            return text
+        if self.dst.type != Type.Long:
+            return f"{self.dst}:{self.dst.type} = {text}"
+        return f"{self.dst} = {text}"
+
+    @property
+    def uses(self) -> list[Temp]:
+        """The temporaries read by the instruction"""
+        return [arg for arg in self.args if type(arg) is Temp]
+
+    @property
+    def incoming(self) -> list[tuple[Block, Operand]]:
+        """The blocks and values of a phi"""
+        args = self.args
+        return list(zip(args[::2], args[1::2]))
+
+
+def label(target) -> str:
+    return target.label if type(target) is Block else str(target)
+
+
+@add_slots
+@dataclass(eq=False)
+class Block:
+    label: str
+    instrs: list[Instr] = field(default_factory=list)
+
+    def __str__(self):
+        lines = [f"{self.label}:"]
+        lines.extend(f"    {instr}" for instr in self.instrs)
+        return "\n".join(lines)
+
+    @property
+    def phis(self) -> list[Instr]:
+        """The phis, which come first in the block"""
+        result = []
+        for instr in self.instrs:
+            if instr.op != Op.Phi:
+                break
+            result.append(instr)
+        return result
+
+    @property
+    def terminator(self) -> Optional[Instr]:
+        instrs = self.instrs
+        if instrs and instrs[-1].op in TERMINATORS:
+            return instrs[-1]
+        return None
+
+    @property
+    def successors(self) -> list[Block]:
+        terminator = self.terminator
+        if terminator is None:
+            return []
+        return [arg for arg in terminator.args if type(arg) is Block]
+
+
+class Function:
+    """
+    A function: its parameters (temporaries), the locals which live in the
+    stack frame (the variables whose address is taken) and the blocks.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.params: list[Temp] = []
+        self.slots: list[Mem] = []
+        self.blocks: list[Block] = []
+        self._temp_count = 0
+        self._block_count = 0
+        self._names: dict[str, int] = {}
+
+    def __str__(self):
+        params = ", ".join(map(str, self.params))
+        lines = [f"function {self.name}({params}) {{"]
+        if self.slots:
+            lines.append(f"    slots {', '.join(map(str, self.slots))}")
+        lines.extend(map(str, self.blocks))
+        lines.append("}")
+        return "\n".join(lines)
+
+    def unique_name(self, name: str) -> str:
+        """The name, with a suffix if it was used before in this function"""
+        count = self._names.get(name, 0)
+        self._names[name] = count + 1
+        if count == 0:
+            return name
+        # e.g. the versions of x.1 (see ssa) are x.1.1, ...
+        unique = f"{name}.{count}"
+        self._names[unique] = 1
+        return unique
+
+    def new_temp(self, type: Type = Type.Long, name: Optional[str] = None) -> Temp:
+        """A temporary for a variable (named) or an intermediate value"""
+        if name is None:
+            self._temp_count += 1
+            return Temp(str(self._temp_count), type)
+        return Temp(self.unique_name(name), type)
+
+    def new_param(self, name: str, type: Type = Type.Long) -> Temp:
+        param = self.new_temp(type, name)
+        self.params.append(param)
+        return param
+
+    def new_slot(self, name: str, type: Type = Type.Long) -> Mem:
+        slot = Mem(self.unique_name(name), MemKind.Local, type)
+        self.slots.append(slot)
+        return slot
+
+    def new_block(self) -> Block:
+        """A new block, which is not added to the function yet"""
+        block = Block(f"L{self._block_count}")
+        self._block_count += 1
+        return block
+
+
+# The function storing the initial values of the globals which are not
+# numbers, it runs once before main. Its name is not an identifier, so no
+# function of the program has it.
+INIT = "globals.init"
+
+
+class Program:
+    def __init__(self):
+        self.globals: list[Mem] = []
+        self.functions: list[Function] = []
+        # the number of globals by their names
+        self._names: dict[str, int] = {}
+
+    def __str__(self):
+        lines = [f"global {var} = {var.init}" for var in self.globals]
+        lines.extend(map(str, self.functions))
+        return "\n".join(lines) + "\n"
+
+    def new_global(self, name: str, type: Type = Type.Long) -> Mem:
+        """A global, with a suffix if a global was declared with the name before"""
+        count = self._names.get(name, 0)
+        self._names[name] = count + 1
+        var = Mem(name if count == 0 else f"{name}.{count}", MemKind.Global, type)
+        self.globals.append(var)
+        return var
+
+    def function(self, name: str) -> Function:
+        for fun in self.functions:
+            if fun.name == name:
+                return fun
+        raise KeyError(name)
@@ -1,3 +1,6 @@
+import re
+from array import array
+from bisect import bisect_right
 from enum import Enum, auto
 from typing import Any, Iterator, NamedTuple
 
@@ -51,6 +54,9 @@ class Token(AutoName):
 # I always wanted to do this!!
 all_tokens = list(Token)
 
+# Tokens are stored in a TokenStream as indices into all_tokens
+token_ids = {tag: i for i, tag in enumerate(all_tokens)}
+
 class TokenInfo(NamedTuple):
     tag: Token
     value: Any
@@ -60,8 +66,336 @@ class TokenInfo(NamedTuple):
 # TokenInfo = namedtuple("TokenInfo", ["tag", "value", "line", "offset"])
 
 
+# Every token is recognized by one of the alternatives of a single master
+# regex, so the whole input is scanned in one pass by the `re` engine.
+# Leading whitespace is consumed by the same match as the token after it.
+# The order of the alternatives matters: numbers before names, comments
+# before the `/` operator and two-character operators before one-character ones.
+_token_re = re.compile(
+    r"""
+    [ \t]*
+    (?:
+        (\d+)                          # NUMBER
+      | (\w+)                          # NAME
+      | (//[^\n]*)                     # COMMENT
+      | (&&|\|\||[-+*/%!=<>]=?|&)      # OPERATOR
+      | ([(){};,])                     # PUNCTUATION
+      | (\n)                           # NEWLINE
+      | ([^ \t\n])                     # ERROR
+    )
+""",
+    re.VERBOSE,
+)
+_NUMBER, _NAME, _COMMENT, _OPERATOR, _PUNCTUATION, _NEWLINE, _ERROR = range(1, 8)
+
+# These tokens are a single character, the old lexer did not need to look
+# ahead to recognize them.
+punctuation = {
+    "(": Token.LPAREN,
+    ")": Token.RPAREN,
+    "{": Token.LBRACE,
+    "}": Token.RBRACE,
+    ";": Token.SEMI,
+    ",": Token.COMMA,
+}
+
+# These tokens (might) need one character of lookahead.
+operators = {
+    "+": Token.PLUS,
+    "-": Token.MINUS,
+    "*": Token.TIMES,
+    "/": Token.DIVIDE,
+    "%": Token.MOD,
+    "+=": Token.PLUS_EQ,
+    "-=": Token.MINUS_EQ,
+    "*=": Token.TIMES_EQ,
+    "/=": Token.DIVIDE_EQ,
+    "%=": Token.MOD_EQ,
+    "!": Token.BANG,
+    "!=": Token.NOT_EQ,
+    "=": Token.EQUAL,
+    "==": Token.DBL_EQ,
+    ">": Token.GREATER,
+    ">=": Token.GREATER_EQ,
+    "<": Token.LESS,
+    "<=": Token.LESS_EQ,
+    "&": Token.AMPERSAND,
+    "&&": Token.AND,
+    "||": Token.OR,
+}
+
+keywords = {
+    "while": (Token.WHILE, None),
+    "if": (Token.IF, None),
+    "else": (Token.ELSE, None),
+    "print": (Token.PRINT, None),
+    "return": (Token.RETURN, None),
+    "break": (Token.BREAK, None),
+    "continue": (Token.CONTINUE, None),
+    "long": (Token.TYPE, "long"),
+    "int": (Token.TYPE, "int"),
+    "char": (Token.TYPE, "char"),
+    "void": (Token.TYPE, "void"),
+}
+
+
 def tokenize(s) -> Iterator[TokenInfo]:
-    """Tokenize the given string s into a generator of tokens."""
+    """
+    Tokenize the given string s into a generator of tokens.
+
+    The offset of a token is the number of characters of its line that had
+    to be read to recognize it, i.e. it includes the lookahead character
+    for numbers, names and operators (this is what the original lexer
+    reported, so error messages stay the same).
+    """
+    line_no = 1
+    line_start = 0
+    # same as TokenInfo(...), but skips the python-level __new__ of NamedTuple
+    new = tuple.__new__
+
+    for match in _token_re.finditer(s):
+        kind = match.lastindex
+        if kind == _NAME:
+            value = match.group(_NAME)
+            offset = match.end() - line_start + 1
+            keyword = keywords.get(value)
+            if keyword is None:
+                yield new(TokenInfo, (Token.ID, value, line_no, offset))
+            else:
+                yield new(TokenInfo, (keyword[0], keyword[1], line_no, offset))
+        elif kind == _OPERATOR:
+            tag = operators[match.group(_OPERATOR)]
+            offset = match.start(_OPERATOR) - line_start + 2
+            yield new(TokenInfo, (tag, None, line_no, offset))
+        elif kind == _PUNCTUATION:
+            tag = punctuation[match.group(_PUNCTUATION)]
+            offset = match.end() - line_start
+            yield new(TokenInfo, (tag, None, line_no, offset))
+        elif kind == _NEWLINE:
+            line_no += 1
+            line_start = match.end()
+        elif kind == _NUMBER:
+            value = int(match.group(_NUMBER))
+            offset = match.end() - line_start + 1
+            yield new(TokenInfo, (Token.NUMBER, value, line_no, offset))
+        elif kind == _ERROR:
+            char = match.group(_ERROR)
+            raise Exception(f"found unknown character while tokenizing: [{char}]")
+
+    # the old lexer read a sentinel character and then hit the end of input
+    offset = len(s) - line_start + 2
+    yield TokenInfo(Token.EOF, None, line_no, offset)
+
+
+class TokenStream:
+    """
+    All the tokens of a source string, stored compactly.
+
+    Instead of one TokenInfo per token we keep three parallel arrays:
+    - the tags, as indices into all_tokens
+    - the positions, as character offsets into the source
+    - the values, as indices into a table of (deduplicated) values,
+      where 0 stands for None
+
+    Line numbers and offsets within a line are only needed for error
+    messages, so they are calculated on demand from an index of the
+    line starts, which is itself built on first use.
+
+    Indexing (and iterating over) a stream gives TokenInfo objects, so it can
+    be used wherever a sequence of tokens is expected.
+    """
+
+    def __init__(self, s: str):
+        self._source = s
+        self._line_starts = None
+        self._first_line = 1
+
+        tags = array("B")
+        positions = array("I")
+        values = array("I")
+        self._tags = tags
+        self._positions = positions
+        self._values = values
+        self._constants: list[Any] = [None]
+
+        add_tag = tags.append
+        add_position = positions.append
+        add_value = values.append
+        constants = self._constants
+        constant_ids: dict[Any, int] = {}
+
+        def value_id(value):
+            i = constant_ids.get(value)
+            if i is None:
+                i = constant_ids[value] = len(constants)
+                constants.append(value)
+            return i
+
+        id_tag = token_ids[Token.ID]
+        number_tag = token_ids[Token.NUMBER]
+        keyword_ids = {
+            name: (token_ids[tag], value_id(value) if value is not None else 0)
+            for name, (tag, value) in keywords.items()
+        }
+        operator_ids = {op: token_ids[tag] for op, tag in operators.items()}
+        punctuation_ids = {p: token_ids[tag] for p, tag in punctuation.items()}
+
+        # Positions are stored the way `tokenize` reports offsets: they
+        # include the lookahead character (see TokenStream.position).
+        for match in _token_re.finditer(s):
+            kind = match.lastindex
+            if kind == _NAME:
+                value = match.group(_NAME)
+                keyword = keyword_ids.get(value)
+                if keyword is None:
+                    add_tag(id_tag)
+                    i = constant_ids.get(value)
+                    add_value(value_id(value) if i is None else i)
+                else:
+                    add_tag(keyword[0])
+                    add_value(keyword[1])
+                add_position(match.end() + 1)
+            elif kind == _OPERATOR:
+                add_tag(operator_ids[match.group(_OPERATOR)])
+                add_value(0)
+                add_position(match.start(_OPERATOR) + 2)
+            elif kind == _PUNCTUATION:
+                add_tag(punctuation_ids[match.group(_PUNCTUATION)])
+                add_value(0)
+                add_position(match.end())
+            elif kind == _NUMBER:
+                add_tag(number_tag)
+                add_value(value_id(int(match.group(_NUMBER))))
+                add_position(match.end() + 1)
+            elif kind == _ERROR:
+                char = match.group(_ERROR)
+                raise Exception(f"found unknown character while tokenizing: [{char}]")
+
+        add_tag(token_ids[Token.EOF])
+        add_value(0)
+        add_position(len(s) + 2)
+
+    def __len__(self) -> int:
+        return len(self._tags)
+
+    def tag(self, i: int) -> Token:
+        return all_tokens[self._tags[i]]
+
+    def value(self, i: int) -> Any:
+        return self._constants[self._values[i]]
+
+    @property
+    def line_starts(self) -> array:
+        """Offsets of the first characters of all lines"""
+        if self._line_starts is None:
+            starts = array("I", [0])
+            starts.extend(m.end() for m in re.finditer("\n", self._source))
+            self._line_starts = starts
+        return self._line_starts
+
+    def position(self, i: int) -> tuple[int, int]:
+        """
+        Returns the line and the offset in that line of the i-th token.
+
+        The stored position is one past the last character that was read,
+        which is on the same line as the token (or is the newline that ends it).
+        """
+        pos = self._positions[i]
+        line_starts = self.line_starts
+        line = bisect_right(line_starts, pos - 1) - 1
+        return line + self._first_line, pos - line_starts[line]
+
+    def __getitem__(self, i: int) -> TokenInfo:
+        if i < 0:
+            i += len(self)
+        line, offset = self.position(i)
+        return TokenInfo(self.tag(i), self.value(i), line, offset)
+
+    def __iter__(self) -> Iterator[TokenInfo]:
+        # Sequential access, so we can walk the line index instead of
+        # searching it for every token.
+        line_starts = self.line_starts
+        line = 0
+        last_line = len(line_starts) - 1
+        constants = self._constants
+        for tag, pos, value in zip(self._tags, self._positions, self._values):
+            while line < last_line and line_starts[line + 1] <= pos - 1:
+                line += 1
+            yield TokenInfo(
+                all_tokens[tag],
+                constants[value],
+                line + self._first_line,
+                pos - line_starts[line],
+            )
+
+    def cursor(self) -> "TokenCursor":
+        return TokenCursor(self)
+
+
+class TokenList(list):
+    """
+    A list of TokenInfo objects with the accessors of TokenStream,
+    so that a TokenCursor can be used over any sequence of tokens.
+    """
+
+    def tag(self, i: int) -> Token:
+        return self[i].tag
+
+    def value(self, i: int) -> Any:
+        return self[i].value
+
+
+class TokenCursor:
+    """
+    A position in a TokenStream (or a TokenList).
+
+    Looking ahead and advancing are O(1), and the cursor never moves past
+    the final EOF token. The cursor is also an iterator of TokenInfo
+    objects, which are created only when a token is consumed or peeked at.
+    """
+
+    def __init__(self, stream, pos: int = 0):
+        self.stream = stream
+        self.pos = pos
+        self._last = len(stream) - 1
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> TokenInfo:
+        pos = self.pos
+        if pos > self._last:
+            raise StopIteration
+        self.pos = pos + 1
+        return self.stream[pos]
+
+    def _index(self, k: int) -> int:
+        i = self.pos + k
+        return i if i < self._last else self._last
+
+    def peek(self, k: int = 0) -> TokenInfo:
+        """The k-th token after the current one, the EOF token is repeated"""
+        return self.stream[self._index(k)]
+
+    def peek_tag(self, k: int = 0) -> Token:
+        return self.stream.tag(self._index(k))
+
+    def peek_value(self, k: int = 0) -> Any:
+        return self.stream.value(self._index(k))
+
+    def advance(self, k: int = 1):
+        """Moves k tokens forward"""
+        pos = self.pos + k
+        self.pos = pos if pos <= self._last else self._last
+
+
+def tokenize_reference(s) -> Iterator[TokenInfo]:
+    """
+    The original character-by-character lexer.
+
+    It is no longer used by the parser, but it is kept as the reference
+    implementation that `tokenize` is tested and benchmarked against.
+    """
 
     line_no = 1
     offset = 0
@@ -0,0 +1,218 @@
+"""
+Loop-invariant code motion on the SSA form (see ssa).
+
+An instruction in a natural loop (see cfg) is invariant if its operands are
+constants, or are computed outside of the loop or by other invariant
+instructions. The invariant ones are moved to the preheader of the loop: a
+block which only jumps to the header and through which the loop is always
+entered, so they run once before the loop instead of in every iteration.
+If there is no such block, one is inserted in front of the header (the phis
+of the header get the values coming from outside of the loop through it).
+The inner loops go first, so what they hoist may leave the outer loops as
+well.
+
+The moved instructions run even if the loop body does not (e.g. a while
+loop whose condition is false at once), so only the ones which cannot fail
+are moved: the pure operations (but not a division by a variable), and the
+loads whose value the loop cannot change. The loads from variables are
+always safe, a load through a pointer only if it runs whenever the loop is
+entered (its block dominates the exits of the loop). The loop may change
+- the variables it stores to,
+- the variables whose address is taken (the globals, the locals of the
+  function with addr), if it stores through a pointer or calls a function,
+- the words at any pointer, if it stores through a pointer or to such a
+  variable, or calls a function.
+"""
+
+from collections import Counter
+from typing import Optional
+
+from cfg import CFG, Loop
+from ir import Block, Const, Function, Instr, Mem, MemKind, Op, Temp, word
+
+PURE = frozenset(
+    {
+        Op.Add,
+        Op.Sub,
+        Op.Mul,
+        Op.Div,
+        Op.Mod,
+        Op.Eq,
+        Op.Ne,
+        Op.Lt,
+        Op.Le,
+        Op.Gt,
+        Op.Ge,
+        Op.Addr,
+    }
+)
+
+
+def hoist_invariants(fun: Function) -> Counter:
+    """Moves the loop invariants to the preheaders, returns their number"""
+    if not fun.blocks:
+        return Counter()
+    graph = CFG(fun)
+    if not graph.loops:
+        return Counter()
+    blocks = fun.blocks
+    aliased = {
+        instr.args[0]
+        for block in blocks
+        for instr in block.instrs
+        if instr.op == Op.Addr
+    }
+
+    def may_alias(var):
+        return var.kind == MemKind.Global or var in aliased
+
+    # the block computing every temporary
+    defined_in: dict[Temp, Optional[Block]] = {}
+    for block in blocks:
+        for instr in block.instrs:
+            if instr.dst is not None:
+                defined_in[instr.dst] = block
+    # the blocks of every loop, the inserted preheaders of the inner loops
+    # are added to them
+    loop_blocks = {
+        loop: {blocks[i] for i in loop.all_blocks()} for loop in graph.loops
+    }
+    # the inserted preheaders take the places of their headers in the
+    # dominator tree and the reverse postorder
+    position = {block: i for i, block in enumerate(blocks)}
+    # the inserted blocks, by the headers they go in front of
+    inserted: dict[Block, Block] = {}
+    # the moved instructions, some move out of several loops
+    hoisted = set()
+
+    for loop in reversed(graph.loops):
+        if loop.header == 0:
+            # there is nothing in front of the entry
+            continue
+        members = loop_blocks[loop]
+        exits = {
+            position[block]
+            for block in members
+            if any(target not in members for target in block.successors)
+        }
+        # what the loop may change
+        calls = False
+        through_pointer = False
+        to_aliased = False
+        stored = set()
+        for block in members:
+            for instr in block.instrs:
+                if instr.op == Op.Call:
+                    calls = True
+                elif instr.op == Op.Store:
+                    target = instr.args[0]
+                    if type(target) is not Mem:
+                        through_pointer = True
+                    else:
+                        stored.add(target)
+                        to_aliased = to_aliased or may_alias(target)
+
+        def invariant(instr, block):
+            op = instr.op
+            if op in PURE:
+                if op == Op.Div or op == Op.Mod:
+                    divisor = instr.args[1]
+                    if not (type(divisor) is Const and word(divisor.value) != 0):
+                        return False
+            elif op == Op.Load:
+                source = instr.args[0]
+                if type(source) is Mem:
+                    if source in stored:
+                        return False
+                    if may_alias(source) and (calls or through_pointer):
+                        return False
+                elif calls or through_pointer or to_aliased:
+                    return False
+                elif not all(graph.dominates(position[block], i) for i in exits):
+                    return False
+            else:
+                return False
+            return all(
+                type(arg) is not Temp or defined_in.get(arg) not in members
+                for arg in instr.args
+            )
+
+        # the definitions come before their uses in the reverse postorder
+        preheaders = set(inserted.values())
+        order = sorted(
+            members, key=lambda b: (graph.rpo_number[position[b]], b not in preheaders)
+        )
+        moved: list[Instr] = []
+        for block in order:
+            kept = []
+            for instr in block.instrs:
+                if instr.dst is not None and invariant(instr, block):
+                    moved.append(instr)
+                    # the later instructions may use it
+                    defined_in[instr.dst] = None
+                else:
+                    kept.append(instr)
+            if len(kept) != len(block.instrs):
+                block.instrs = kept
+        if not moved:
+            continue
+        preheader = find_preheader(fun, graph, loop, members, inserted)
+        position.setdefault(preheader, loop.header)
+        preheader.instrs[-1:-1] = moved
+        for instr in moved:
+            assert instr.dst is not None
+            defined_in[instr.dst] = preheader
+        parent = loop.parent
+        while parent is not None:
+            loop_blocks[parent].add(preheader)
+            parent = parent.parent
+        hoisted.update(moved)
+
+    if inserted:
+        fun.blocks = [
+            b for block in blocks for b in [inserted.get(block), block] if b is not None
+        ]
+    return Counter(hoisted=len(hoisted))
+
+
+def find_preheader(fun, graph, loop: Loop, members, inserted) -> Block:
+    """
+    The block which enters the loop (members are its blocks), inserted if
+    there is none: the inserted blocks are recorded by their headers, the
+    caller puts them into the function.
+    """
+    header = graph.blocks[loop.header]
+    if header in inserted:
+        return inserted[header]
+    entries = list(
+        dict.fromkeys(
+            graph.blocks[p]
+            for p in graph.preds[loop.header]
+            if graph.blocks[p] not in members
+        )
+    )
+    if len(entries) == 1 and entries[0].terminator.op == Op.Jmp:
+        return entries[0]
+    preheader = fun.new_block()
+    preheader.instrs.append(Instr(Op.Jmp, None, (header,)))
+    for block in entries:
+        terminator = block.terminator
+        terminator.args = tuple(
+            preheader if arg is header else arg for arg in terminator.args
+        )
+    for phi in header.phis:
+        outside = []
+        inside = []
+        for source, value in phi.incoming:
+            (inside if source in members else outside).append((source, value))
+        values = {v if type(v) is Const else id(v): v for (_, v) in outside}
+        if len(values) == 1:
+            [value] = values.values()
+        else:
+            dst = phi.dst
+            value = fun.new_temp(dst.type, None if dst.name.isdigit() else dst.name)
+            args = tuple(x for pair in outside for x in pair)
+            preheader.instrs.insert(-1, Instr(Op.Phi, value, args))
+        phi.args = tuple(x for pair in [*inside, (preheader, value)] for x in pair)
+    inserted[header] = preheader
+    return preheader
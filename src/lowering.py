@@ -0,0 +1,372 @@
+"""
+Lowering of the checked program to the intermediate language (see ir).
+
+The variables become temporaries, except for the globals and the locals
+whose address is taken, which stay in memory (Mem) and are read and written
+with loads and stores. Every expression is lowered to an operand, the
+conditions of ifs and loops are lowered to jumps (with && and || short
+circuiting to the targets).
+
+The expressions are evaluated in the same order as in the old code generator
+(e.g. the arguments of calls from right to left) and they give the same
+results (e.g. a && b is b if a is not 0, !a is 1 - a).
+"""
+
+
+import ir
+import pyc_ast as E
+from gc_pause import gc_paused
+from ir import Const, Instr, Op, Temp
+from type_checker import BindingKind, CTypeError, Frame, check
+from visitor import Visitor
+
+
+ARITH_OPS = {
+    E.ArithOp.Add: Op.Add,
+    E.ArithOp.Sub: Op.Sub,
+    E.ArithOp.Mul: Op.Mul,
+    E.ArithOp.Div: Op.Div,
+    E.ArithOp.Mod: Op.Mod,
+}
+
+CMP_OPS = {
+    E.ArithCmp.Eq: Op.Eq,
+    E.ArithCmp.Neq: Op.Ne,
+    E.ArithCmp.Lt: Op.Lt,
+    E.ArithCmp.Leq: Op.Le,
+    E.ArithCmp.Gt: Op.Gt,
+    E.ArithCmp.Geq: Op.Ge,
+}
+
+
+def ir_type(c_type: E.CType) -> ir.Type:
+    if c_type.kind == E.TypeKind.Pointer:
+        return ir.Type.Ptr
+    return ir.Type.Long
+
+
+class LoweringVisitor(Visitor):
+    def __init__(self, symbol_table):
+        self._bindings = symbol_table.bindings
+        self._frames = symbol_table.frames
+        self.program = ir.Program()
+
+        # where the variables live (a Temp or a Mem), by the uids of the bindings
+        self._storage: dict = {}
+
+        # the current function, block and frame (set when a function is
+        # lowered), and a stack of the (continue, break) targets of the loops
+        self.fun: ir.Function
+        self.block: ir.Block
+        self._frame: Frame
+        self._loops: list[tuple[ir.Block, ir.Block]] = []
+
+        # the variables (temporaries) by the number of the last assignment
+        self._assigned: dict[Temp, int] = {}
+        self._assignments = 0
+
+        # the globals whose initial values are not numbers, with the values
+        self._initializers: list = []
+
+    # Code
+
+    def emit(self, op, dst, *args):
+        self.block.instrs.append(Instr(op, dst, args))
+
+    def new_temp(self, type=ir.Type.Long):
+        return self.fun.new_temp(type)
+
+    def start_block(self, block):
+        self.fun.blocks.append(block)
+        self.block = block
+
+    def end_block(self, op, *args):
+        """Ends the block with a terminator, the code after it is dead"""
+        self.emit(op, None, *args)
+        # dead code goes to a block which is not in the function
+        self.block = ir.Block("dead")
+
+    def jump(self, target):
+        self.end_block(Op.Jmp, target)
+
+    # Variables
+
+    def storage(self, binding):
+        """The Temp or Mem of a variable, created when it is first seen"""
+        storage = self._storage.get(binding.uid)
+        if storage is None:
+            # a local (the globals and params are known in advance)
+            assert binding.kind == BindingKind.Local
+            tp = ir_type(binding.type)
+            if binding.uid in self._frame.address_taken:
+                storage = self.fun.new_slot(binding.name, tp)
+            else:
+                storage = self.fun.new_temp(tp, binding.name)
+            self._storage[binding.uid] = storage
+        return storage
+
+    def read(self, binding):
+        storage = self.storage(binding)
+        if type(storage) is Temp:
+            return storage
+        value = self.new_temp(storage.type)
+        self.emit(Op.Load, value, storage)
+        return value
+
+    def write(self, binding, value):
+        storage = self.storage(binding)
+        if type(storage) is Temp:
+            self.emit(Op.Copy, storage, value)
+            self._assigned[storage] = self._assignments
+            self._assignments += 1
+        else:
+            self.emit(Op.Store, None, storage, value)
+
+    # Evaluation order
+    #
+    # An operand which is a variable is only read when the instruction using
+    # it runs, so if the variable is assigned in between (e.g. x + (x = 1))
+    # its value has to be copied right after the operand is evaluated.
+
+    def checkpoint(self):
+        return (self.block, len(self.block.instrs), self._assignments)
+
+    def stable(self, operand, checkpoint):
+        """The operand, as evaluated at the checkpoint"""
+        (block, position, assignments) = checkpoint
+        if self._assigned.get(operand, -1) >= assignments:
+            copy = self.new_temp(operand.type)
+            block.instrs.insert(position, Instr(Op.Copy, copy, (operand,)))
+            return copy
+        return operand
+
+    # Expressions, lowered to operands
+
+    def visit_ArithLit(self, val):
+        return Const(val)
+
+    def visit_Var(self, var):
+        return self.read(self._bindings[id(self.node)])
+
+    def visit_FunCall(self, name, args):
+        # the arguments are evaluated from right to left
+        operands: list = [None] * len(args)
+        checkpoints = []
+        for i in reversed(range(len(args))):
+            operands[i] = yield args[i]
+            checkpoints.append((i, self.checkpoint()))
+        # the later checkpoints first, so the earlier positions stay valid
+        for i, checkpoint in reversed(checkpoints):
+            operands[i] = self.stable(operands[i], checkpoint)
+        result = self.new_temp()
+        self.emit(Op.Call, result, name, *operands)
+        return result
+
+    def visit_ArithUnaryop(self, op, a):
+        if not isinstance(a, E.Var):
+            raise CTypeError(f"{op.value} expects a variable, but found {a}")
+        binding = self._bindings[id(a)]
+        if op == E.ArithUnaryOp.Addr:
+            result = self.new_temp(ir.Type.Ptr)
+            self.emit(Op.Addr, result, self.storage(binding))
+        elif op == E.ArithUnaryOp.Deref:
+            result = self.new_temp()
+            self.emit(Op.Load, result, self.read(binding))
+        else:
+            raise TypeError
+        return result
+
+    def visit_ArithBinop(self, op, a1, a2):
+        o1 = yield a1
+        checkpoint = self.checkpoint()
+        o2 = yield a2
+        o1 = self.stable(o1, checkpoint)
+        pointers = ir.Type.Ptr in (o1.type, o2.type)
+        if pointers and op in (E.ArithOp.Add, E.ArithOp.Sub):
+            result = self.new_temp(ir.Type.Ptr)
+        else:
+            result = self.new_temp()
+        self.emit(ARITH_OPS[op], result, o1, o2)
+        return result
+
+    def visit_BoolArithCmp(self, op, a1, a2):
+        o1 = yield a1
+        checkpoint = self.checkpoint()
+        o2 = yield a2
+        o1 = self.stable(o1, checkpoint)
+        result = self.new_temp()
+        self.emit(CMP_OPS[op], result, o1, o2)
+        return result
+
+    def visit_BoolNeg(self, b):
+        # !b is 1 - b, as in the old code generator
+        o = yield b
+        result = self.new_temp()
+        self.emit(Op.Sub, result, Const(1), o)
+        return result
+
+    def visit_BoolBinop(self, op, b1, b2):
+        # b1 && b2 is 0 if b1 is 0, otherwise b2
+        # b1 || b2 is 1 if b1 is not 0, otherwise b2
+        result = self.new_temp()
+        o1 = yield b1
+        fun = self.fun
+        (right, short, end) = (fun.new_block(), fun.new_block(), fun.new_block())
+        if op == E.BoolOp.And:
+            self.end_block(Op.Br, o1, right, short)
+        else:
+            self.end_block(Op.Br, o1, short, right)
+        self.start_block(short)
+        self.emit(Op.Copy, result, Const(0 if op == E.BoolOp.And else 1))
+        self.jump(end)
+        self.start_block(right)
+        o2 = yield b2
+        self.emit(Op.Copy, result, o2)
+        self.jump(end)
+        self.start_block(end)
+        return result
+
+    def visit_ArithAssign(self, lvalue, a):
+        binding = self._bindings[id(self.node)]
+        value = yield a
+        if lvalue.kind == E.LValueKind.Var:
+            self.write(binding, value)
+        elif lvalue.kind == E.LValueKind.Pointer:
+            # *p = a
+            self.emit(Op.Store, None, self.read(binding), value)
+        else:
+            raise NotImplementedError
+        return value
+
+    def visit_cond(self, b, if_true, if_false):
+        """Jumps to if_true if b is not 0, otherwise to if_false"""
+        if isinstance(b, E.BoolBinop):
+            right = self.fun.new_block()
+            if b.op == E.BoolOp.And:
+                yield self.visit_cond(b.b1, right, if_false)
+            else:
+                yield self.visit_cond(b.b1, if_true, right)
+            self.start_block(right)
+            yield self.visit_cond(b.b2, if_true, if_false)
+        else:
+            o = yield b
+            self.end_block(Op.Br, o, if_true, if_false)
+
+    # Statements
+
+    def visit_StmExpr(self, a):
+        yield a
+
+    def visit_StmDecl(self, tp, var, a, kind):
+        binding = self._bindings[id(self.node)]
+        if a is not None:
+            value = yield a
+            self.write(binding, value)
+
+    def visit_StmIf(self, b, ss1, ss2):
+        fun = self.fun
+        (if_true, end) = (fun.new_block(), fun.new_block())
+        if_false = fun.new_block() if ss2 else end
+        yield self.visit_cond(b, if_true, if_false)
+        self.start_block(if_true)
+        yield self.visit_many(ss1)
+        self.jump(end)
+        if ss2:
+            self.start_block(if_false)
+            yield self.visit_many(ss2)
+            self.jump(end)
+        self.start_block(end)
+
+    def visit_StmWhile(self, b, ss):
+        fun = self.fun
+        (head, body, end) = (fun.new_block(), fun.new_block(), fun.new_block())
+        self.jump(head)
+        self.start_block(head)
+        yield self.visit_cond(b, body, end)
+        self.start_block(body)
+        self._loops.append((head, end))
+        yield self.visit_many(ss)
+        self._loops.pop()
+        self.jump(head)
+        self.start_block(end)
+
+    def visit_StmPrint(self, a):
+        o = yield a
+        self.emit(Op.Print, None, o)
+
+    def visit_StmReturn(self, a):
+        o = yield a
+        self.end_block(Op.Ret, o)
+
+    def visit_StmBreak(self):
+        self.jump(self._loops[-1][1])
+
+    def visit_StmContinue(self):
+        self.jump(self._loops[-1][0])
+
+    def visit_StmBlock(self, stms):
+        yield self.visit_many(stms)
+
+    def visit_many(self, stms):
+        for stm in stms:
+            yield stm
+
+    def visit_FunDecl(self, _type, name, params, body):
+        frame = self._frames[id(self.node)]
+        fun = self.fun = ir.Function(name)
+        self._frame = frame
+        self.start_block(fun.new_block())
+        for binding in frame.params:
+            param = fun.new_param(binding.name, ir_type(binding.type))
+            if binding.uid in frame.address_taken:
+                slot = fun.new_slot(binding.name, param.type)
+                self.emit(Op.Store, None, slot, param)
+                self._storage[binding.uid] = slot
+            else:
+                self._storage[binding.uid] = param
+
+        yield self.visit_many(body)
+
+        # falling off the end of a function returns 0
+        if fun.blocks[-1] is self.block and self.block.terminator is None:
+            self.end_block(Op.Ret, Const(0))
+        self.program.functions.append(fun)
+
+    def lower_global(self, decl):
+        binding = self._bindings[id(decl)]
+        var = self.program.new_global(binding.name, ir_type(binding.type))
+        if isinstance(decl.a, E.ArithLit):
+            # the numbers are in the data section
+            var.init = decl.a.num
+        elif decl.a is not None:
+            self._initializers.append((var, decl.a))
+        self._storage[binding.uid] = var
+
+    def lower_initializers(self):
+        """The other initial values are stored by a function run before main"""
+        if not self._initializers:
+            return
+        fun = self.fun = ir.Function(ir.INIT)
+        self.start_block(fun.new_block())
+        for var, a in self._initializers:
+            self.emit(Op.Store, None, var, self.visit(a))
+        self.end_block(Op.Ret, Const(0))
+        self.program.functions.append(fun)
+
+
+def lower(defs, symbol_table=None) -> ir.Program:
+    """
+    Lowers the program, symbol_table is the result of check(defs),
+    it is computed if not given.
+    """
+    if symbol_table is None:
+        symbol_table = check(defs)
+    visitor = LoweringVisitor(symbol_table)
+    with gc_paused():
+        for decl in symbol_table.defs:
+            if isinstance(decl, E.StmDecl):
+                visitor.lower_global(decl)
+            else:
+                visitor.visit(decl)
+        visitor.lower_initializers()
+    return visitor.program
@@ -8,27 +8,111 @@ This module is putting everything together, the file is:
 and then the generated assembly is printed out.
 """
 
+import argparse
+import functools
 import sys
 import traceback
 
+import ast_cache
+import parallel_parser
 import pyc_parser
 import type_checker
 import code_generator
+import lowering
+import ssa
+import optimizer
+import backend
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Compiles SIL programs to x86-64")
+    parser.add_argument("files", metavar="filename", nargs="+")
+    parser.add_argument(
+        "--cache-dir",
+        help="where the parsed files are cached "
+        + f"(default: {ast_cache.default_cache_dir()})",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="always parse the files from scratch"
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="the number of processes parsing big files and type checking "
+        + "(default: 1, more also reports all the type errors)",
+    )
+    parser.add_argument(
+        "--debug",
+        action="store_true",
+        help="run the (slow) internal consistency checks of the compiler",
+    )
+    parser.add_argument(
+        "--dump-ir",
+        action="store_true",
+        help="print the intermediate code (in SSA form) instead of the assembly",
+    )
+    parser.add_argument(
+        "--passes",
+        default=",".join(optimizer.PASSES),
+        help="the optimizations of the intermediate code, separated by commas "
+        + f"(default: {','.join(optimizer.PASSES)}, an empty list for none)",
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="print what the optimizations changed in every function",
+    )
+    parser.add_argument(
+        "--no-ir",
+        action="store_true",
+        help="compile straight from the AST, with the old code generator",
+    )
+    return parser.parse_args()
+
 
 if __name__ == "__main__":
     if len(sys.argv) > 1:
-        for file_name in sys.argv[1:]:
+        args = parse_args()
+        passes = [name for name in args.passes.split(",") if name]
+        for name in passes:
+            if name not in optimizer.PASSES:
+                sys.exit(f"unknown optimization: {name}")
+        cache = None if args.no_cache else ast_cache.ASTCache(args.cache_dir)
+        parse = functools.partial(
+            parallel_parser.parse_file_parallel, workers=args.jobs
+        )
+        for file_name in args.files:
             # print("got file name =", sys.argv[1])
             lines = ""
             try:
                 with open(file_name, "r") as f:
                     lines = "".join(f.readlines())
                     # parse
-                    c = pyc_parser.parse_file(lines)
+                    if cache is not None:
+                        c = cache.parse_file(lines, parse)
+                    else:
+                        c = parse(lines)
                     # type check
-                    symbol_table = type_checker.check(c)
+                    workers = args.jobs if args.jobs > 1 else None
+                    symbol_table = type_checker.check(c, workers)
                     # compile
-                    result = code_generator.compile_top(c)
+                    if args.no_ir:
+                        result = code_generator.compile_top(
+                            c, symbol_table, debug=args.debug
+                        )
+                    else:
+                        program = lowering.lower(c, symbol_table)
+                        ssa.program_to_ssa(program)
+                        stats = optimizer.optimize(program, passes)
+                        if args.stats:
+                            print(optimizer.report(stats), file=sys.stderr)
+                        if args.dump_ir:
+                            result = str(program)
+                        else:
+                            ssa.program_from_ssa(program)
+                            result = backend.compile_program(program)
                     # output
                     print(result)
             except FileNotFoundError:
@@ -49,7 +133,8 @@ if __name__ == "__main__":
                     # TODO: add line information
                     print("\n/Error/ Type Error:", file=dest)
                     # print(f"\tError on line {line}:{pos}", file=dest)
-                    print(f"\t{err.msg}", file=dest)
+                    for error in getattr(err, "errors", [err]):
+                        print(f"\t{error.msg}", file=dest)
                     sys.exit(2)
             except NotImplementedError as e:
                 print("Work in progress, NonImplmentedError", file=sys.stderr)
@@ -65,6 +150,8 @@ if __name__ == "__main__":
                 print("Failed to compile the file", file=sys.stderr)
                 print(f"Error: {e}")
                 raise e
+        if cache is not None:
+            print(cache.stats(), file=sys.stderr)
     else:
         print("usage:")
         print(f"{sys.argv[0]} filename")
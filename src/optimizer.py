@@ -0,0 +1,74 @@
+"""
+The optimizations of the intermediate code (see ir).
+
+They run on the SSA form (see ssa), one function at a time (inlining on
+the whole program), in the order of PASSES. Every pass returns a Counter
+which tells what it changed (e.g. the number of folded instructions), they
+are collected for --stats.
+"""
+
+from collections import Counter
+from typing import Iterable
+
+from gc_pause import gc_paused
+from ir import Program
+import dce
+import gvn
+import induction
+import inline
+import licm
+import sccp
+import tail
+
+# the optimizations, by their names
+PASSES = {
+    "inline": inline.inline_calls,
+    "tail": tail.eliminate_tail_recursion,
+    "sccp": sccp.propagate_constants,
+    "gvn": gvn.number_values,
+    "licm": licm.hoist_invariants,
+    "iv": induction.reduce_strength,
+    "dce": dce.eliminate_dead_code,
+}
+# the optimizations of the whole program, they return the Counters of the
+# functions by their names
+PROGRAM_PASSES = frozenset({"inline"})
+
+
+def optimize(program: Program, passes: Iterable[str] = PASSES) -> dict:
+    """
+    Runs the passes on the program in SSA form, returns their statistics:
+    the Counters of every pass, by the names of the functions.
+    """
+    stats: dict[str, dict[str, Counter]] = {}
+    with gc_paused():
+        for name in passes:
+            optimization = PASSES[name]
+            if name in PROGRAM_PASSES:
+                for fun_name, counter in optimization(program).items():
+                    counts = stats.setdefault(fun_name, {}).setdefault(name, Counter())
+                    counts.update(counter)
+                continue
+            for fun in program.functions:
+                counts = stats.setdefault(fun.name, {}).setdefault(name, Counter())
+                counts.update(optimization(fun))
+    return stats
+
+
+def report(stats: dict) -> str:
+    """The statistics, one function per line"""
+    lines = []
+    for fun_name, passes in stats.items():
+        # the inlined calls, e.g. addone() at L1:2, are listed one by one
+        counts = [
+            (
+                f"{name} {key}"
+                if "()" in key
+                else f"{name} {key.replace('_', ' ')} {count}"
+            )
+            for name, counter in passes.items()
+            for key, count in counter.items()
+            if count
+        ]
+        lines.append(f"{fun_name}: {', '.join(counts) or 'unchanged'}")
+    return "\n".join(lines)
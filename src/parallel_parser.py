@@ -0,0 +1,165 @@
+"""
+Parsing the top-level definitions of a file in parallel.
+
+Once we know where they start, the definitions (functions and global
+variables) can be parsed independently. A quick pre-scan of the tokens,
+which only balances the brackets, splits the file into definitions. They
+are grouped into batches which are parsed in a pool of processes, and the
+results are merged in the source order.
+
+The workers send the ASTs back in the compact format of ast_cache, which
+is faster (and, unlike pickle, not recursive) for big trees.
+
+If anything goes wrong, e.g. there is a parse error or the pre-scan was
+fooled by an incorrect input, the file is parsed again sequentially,
+so the errors are exactly the same as from pyc_parser.parse_file.
+"""
+
+import gc
+import multiprocessing
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+import ast_cache
+import pyc_ast as E
+from lexer import Token, TokenStream, token_ids
+from pyc_parser import ParseError, Parser
+
+# Smaller files are not worth starting the processes
+MIN_TOKENS = 200_000
+
+# Batches per worker, more of them balance the load better
+BATCHES_PER_WORKER = 4
+
+_LBRACE = token_ids[Token.LBRACE]
+_RBRACE = token_ids[Token.RBRACE]
+_LPAREN = token_ids[Token.LPAREN]
+_RPAREN = token_ids[Token.RPAREN]
+_SEMI = token_ids[Token.SEMI]
+
+_brackets_re = re.compile(
+    b"[" + re.escape(bytes([_LBRACE, _RBRACE, _LPAREN, _RPAREN, _SEMI])) + b"]"
+)
+
+
+def split_definitions(stream: TokenStream) -> list[int]:
+    """
+    Returns the indices of the tokens which start the top-level
+    definitions, followed by the index of the final EOF token.
+
+    A definition ends with a `;` or a `}` which is not nested in any
+    brackets. For incorrect programs the result may be wrong, but then
+    parsing the definitions will fail.
+    """
+    tags = stream._tags.tobytes()
+    eof = len(tags) - 1
+    starts = [0]
+    depth = 0
+    for match in _brackets_re.finditer(tags, 0, eof):
+        tag = tags[match.start()]
+        if tag == _LBRACE or tag == _LPAREN:
+            depth += 1
+        elif tag == _RBRACE or tag == _RPAREN:
+            depth -= 1
+            if depth == 0 and tag == _RBRACE:
+                starts.append(match.end())
+        elif depth == 0:
+            starts.append(match.end())
+    if starts[-1] != eof:
+        starts.append(eof)
+    return starts
+
+
+def batches(starts: list[int], count: int) -> list[tuple[int, int]]:
+    """Groups the definitions into (at most) count ranges of similar size"""
+    total = starts[-1] - starts[0]
+    ranges = []
+    begin = starts[0]
+    for start in starts[1:]:
+        if (start - starts[0]) * count >= total * (len(ranges) + 1):
+            ranges.append((begin, start))
+            begin = start
+    if begin != starts[-1]:
+        ranges.append((begin, starts[-1]))
+    return ranges
+
+
+# -----------------------------------------
+# The worker processes
+# -----------------------------------------
+
+_stream: Optional[TokenStream] = None
+
+
+def _init_worker(stream):
+    global _stream
+    _stream = stream
+    # The workers only build (acyclic) trees, so there is nothing to collect,
+    # while the collector would keep scanning all the nodes parsed so far.
+    gc.disable()
+
+
+def _parse_batch(start: int, end: int) -> Optional[bytes]:
+    """The encoded definitions from start to end, or None if that fails"""
+    assert _stream is not None
+    parser = Parser(_stream, start)
+    defs = []
+    try:
+        while parser.position < end:
+            defs.append(parser.parse_definition())
+    except ParseError:
+        return None
+    if parser.position != end:
+        return None
+    return ast_cache.encode(defs)
+
+
+def _mp_context():
+    # With fork the workers get the token stream without pickling it
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+# -----------------------------------------
+# The entry point
+# -----------------------------------------
+
+
+def parse_file_parallel(
+    s: str, workers: Optional[int] = None, min_tokens: int = MIN_TOKENS
+) -> list[E.Decl]:
+    """
+    The same as pyc_parser.parse_file, but uses workers processes
+    (by default one per CPU) for big files
+    """
+    stream = TokenStream(s)
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    starts = split_definitions(stream)
+    if workers <= 1 or len(starts) <= 2 or len(stream) < min_tokens:
+        return Parser(stream).parse_file_top()
+
+    ranges = batches(starts, workers * BATCHES_PER_WORKER)
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(ranges)),
+        mp_context=_mp_context(),
+        initializer=_init_worker,
+        initargs=(stream,),
+    ) as pool:
+        results = list(
+            pool.map(_parse_batch, [r[0] for r in ranges], [r[1] for r in ranges])
+        )
+
+    encoded = [data for data in results if data is not None]
+    if len(encoded) != len(results):
+        # report the first error, just like the sequential parser
+        return Parser(stream).parse_file_top()
+
+    defs: list[E.Decl] = []
+    for data in encoded:
+        defs += ast_cache.decode(data)
+    return defs
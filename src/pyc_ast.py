@@ -1,8 +1,14 @@
 from __future__ import annotations
 from enum import Enum
-from typing import Optional, Any
+from typing import Optional, Sequence
 from dataclasses import dataclass
 
+from slots import add_slots
+
+# The nodes are frozen dataclasses with __slots__, so that big trees take
+# little memory. The lists of children (e.g. statements in a block) are kept
+# as tuples, the constructors accept any sequence and convert it.
+
 # -----------------------------------------
 # Types
 # -----------------------------------------
@@ -10,6 +16,8 @@ from dataclasses import dataclass
 class Type:
     """Abstract Type class"""
 
+    __slots__ = ()
+
 class AtomType(Type, Enum):
     Int = "int"
     Long = "long"
@@ -20,10 +28,14 @@ class AtomType(Type, Enum):
         return self.value
 
 
+@add_slots
 @dataclass(frozen=True)
 class FunType(Type):
     ret: CType
-    args: list[CType]
+    args: Sequence[CType]
+
+    def __post_init__(self):
+        object.__setattr__(self, "args", tuple(self.args))
 
     def __str__(self):
         args = ",".join(map(str, self.args))
@@ -38,6 +50,7 @@ class TypeKind(Enum):
         return self.value
 
 
+@add_slots
 @dataclass(frozen=True)
 class CType():
     kind: TypeKind
@@ -97,6 +110,7 @@ class LValueKind(Enum):
         return self.value
 
 
+@add_slots
 @dataclass(frozen=True)
 class LValue:
     kind: LValueKind
@@ -134,10 +148,15 @@ def lvalue_pointer(var: str) -> LValue:
 class Expr:
     """Absract Expr class"""
 
+    __slots__ = ()
+
 class Arith(Expr):
     """Abstract Arith class"""
 
+    __slots__ = ()
+
 
+@add_slots
 @dataclass(frozen=True)
 class Var(Arith):
     var: str
@@ -149,6 +168,7 @@ class Var(Arith):
         return visitor.visit_Var(self.var)
 
 
+@add_slots
 @dataclass(frozen=True)
 class ArithLit(Arith):
     num: int
@@ -160,6 +180,7 @@ class ArithLit(Arith):
         return visitor.visit_ArithLit(self.num)
 
 
+@add_slots
 @dataclass(frozen=True)
 class ArithUnaryop(Arith):
     op: ArithUnaryOp
@@ -173,6 +194,7 @@ class ArithUnaryop(Arith):
         return visitor.visit_ArithUnaryop(self.op, self.a)
 
 
+@add_slots
 @dataclass(frozen=True)
 class ArithBinop(Arith):
     op: ArithOp
@@ -187,6 +209,7 @@ class ArithBinop(Arith):
         return visitor.visit_ArithBinop(self.op, self.a1, self.a2)
 
 
+@add_slots
 @dataclass(frozen=True)
 class ArithAssign(Arith):
     lvalue: LValue
@@ -228,6 +251,9 @@ class ArithCmp(Enum):
 class BoolExpr(Expr):
     """Abstract BoolExpr class"""
 
+    __slots__ = ()
+
+@add_slots
 @dataclass(frozen=True)
 class BoolArithCmp(BoolExpr):
     op: ArithCmp
@@ -241,6 +267,7 @@ class BoolArithCmp(BoolExpr):
     def accept(self, visitor):
         return visitor.visit_BoolArithCmp(self.op, self.a1, self.a2)
 
+@add_slots
 @dataclass(frozen=True)
 class BoolNeg(BoolExpr):
     b: Expr
@@ -260,6 +287,7 @@ class BoolOp(Enum):
         return self.value
 
 
+@add_slots
 @dataclass(frozen=True)
 class BoolBinop(BoolExpr):
     op: BoolOp
@@ -279,10 +307,14 @@ class BoolBinop(BoolExpr):
 # -----------------------------------------
 
 
+@add_slots
 @dataclass(frozen=True)
 class FunCall(Arith):
     name: str
-    args: list[Any]
+    args: Sequence[Expr]
+
+    def __post_init__(self):
+        object.__setattr__(self, "args", tuple(self.args))
 
     def __str__(self):
         args = ", ".join(map(str, self.args))
@@ -299,9 +331,14 @@ class FunCall(Arith):
 class Decl:
     """Abstract declaration type"""
 
+    __slots__ = ()
+
 class Stm:
     """Abstract Statement class"""
 
+    __slots__ = ()
+
+@add_slots
 @dataclass(frozen=True)
 class StmExpr(Stm):
     a: Expr
@@ -312,6 +349,7 @@ class StmExpr(Stm):
     def accept(self, visitor):
         return visitor.visit_StmExpr(self.a)
 
+@add_slots
 @dataclass(frozen=True)
 class StmDecl(Stm, Decl):
     type: CType
@@ -328,11 +366,16 @@ class StmDecl(Stm, Decl):
     def accept(self, visitor):
         return visitor.visit_StmDecl(self.type, self.var, self.a, self.kind)
 
+@add_slots
 @dataclass(frozen=True)
 class StmIf(Stm):
     b: Expr
-    ss1: list[Stm]
-    ss2: list[Stm]
+    ss1: Sequence[Stm]
+    ss2: Sequence[Stm]
+
+    def __post_init__(self):
+        object.__setattr__(self, "ss1", tuple(self.ss1))
+        object.__setattr__(self, "ss2", tuple(self.ss2))
 
     def __str__(self):
         ss1 = "\n".join(map(str, self.ss1))
@@ -342,10 +385,14 @@ class StmIf(Stm):
     def accept(self, visitor):
         return visitor.visit_StmIf(self.b, self.ss1, self.ss2)
 
+@add_slots
 @dataclass(frozen=True)
 class StmWhile(Stm):
     b: Expr
-    ss: list[Stm]
+    ss: Sequence[Stm]
+
+    def __post_init__(self):
+        object.__setattr__(self, "ss", tuple(self.ss))
 
     def __str__(self):
         ss = "\n".join(map(str, self.ss))
@@ -354,6 +401,7 @@ class StmWhile(Stm):
     def accept(self, visitor):
         return visitor.visit_StmWhile(self.b, self.ss)
 
+@add_slots
 @dataclass(frozen=True)
 class StmPrint(Stm):
     a: Expr
@@ -365,6 +413,7 @@ class StmPrint(Stm):
         return visitor.visit_StmPrint(self.a)
 
 
+@add_slots
 @dataclass(frozen=True)
 class StmReturn(Stm):
     a: Expr
@@ -375,6 +424,7 @@ class StmReturn(Stm):
     def accept(self, visitor):
         return visitor.visit_StmReturn(self.a)
 
+@add_slots
 @dataclass(frozen=True)
 class StmBreak(Stm):
     def __str__(self):
@@ -383,6 +433,7 @@ class StmBreak(Stm):
     def accept(self, visitor):
         return visitor.visit_StmBreak()
 
+@add_slots
 @dataclass(frozen=True)
 class StmContinue(Stm):
     def __str__(self):
@@ -391,9 +442,13 @@ class StmContinue(Stm):
     def accept(self, visitor):
         return visitor.visit_StmContinue()
 
+@add_slots
 @dataclass(frozen=True)
 class StmBlock(Stm):
-    ss: list[Stm]
+    ss: Sequence[Stm]
+
+    def __post_init__(self):
+        object.__setattr__(self, "ss", tuple(self.ss))
 
     def __str__(self):
         ss = "\n".join(map(str, self.ss))
@@ -407,6 +462,7 @@ class StmBlock(Stm):
 # Top level declarations
 # -----------------------------------------
 
+@add_slots
 @dataclass(frozen=True)
 class FunArg():
     type: CType
@@ -415,12 +471,17 @@ class FunArg():
     def __str__(self):
         return f"{self.type} {self.var}"
 
+@add_slots
 @dataclass(frozen=True)
 class FunDecl(Decl):
     type: CType
     name: str
-    params: list[FunArg]
-    body: list[Stm]
+    params: Sequence[FunArg]
+    body: Sequence[Stm]
+
+    def __post_init__(self):
+        object.__setattr__(self, "params", tuple(self.params))
+        object.__setattr__(self, "body", tuple(self.body))
 
     def __str__(self):
         params = ", ".join(map(str, self.params))
@@ -431,6 +492,89 @@ class FunDecl(Decl):
         return visitor.visit_FunDecl(self.type, self.name, self.params, self.body)
 
 
+# -----------------------------------------
+# Building trees
+# -----------------------------------------
+
+
+class TreeBuilder:
+    """
+    Creates the nodes for the parser.
+
+    This is the default builder, which creates the classes above. The other
+    one is arena.ArenaBuilder, which has the same interface.
+    """
+
+    Var = Var
+    ArithLit = ArithLit
+    ArithUnaryop = ArithUnaryop
+    ArithBinop = ArithBinop
+    ArithAssign = ArithAssign
+    BoolArithCmp = BoolArithCmp
+    BoolNeg = BoolNeg
+    BoolBinop = BoolBinop
+    FunCall = FunCall
+    StmExpr = StmExpr
+    StmDecl = StmDecl
+    StmIf = StmIf
+    StmWhile = StmWhile
+    StmPrint = StmPrint
+    StmReturn = StmReturn
+    StmBreak = StmBreak
+    StmContinue = StmContinue
+    StmBlock = StmBlock
+    FunDecl = FunDecl
+
+    @staticmethod
+    def as_lvalue(e: Expr) -> Optional[LValue]:
+        """The lvalue if the expression can be assigned to, otherwise None"""
+        if isinstance(e, Var):
+            return lvalue_var(e.var)
+        elif isinstance(e, ArithUnaryop) and e.op == ArithUnaryOp.Deref:
+            assert isinstance(e.a, Var)
+            return lvalue_pointer(e.a.var)
+        else:
+            return None
+
+    @staticmethod
+    def lvalue_expr(lvalue: LValue) -> Expr:
+        return lvalue.expr
+
+    @staticmethod
+    def describe(e: Expr) -> str:
+        return str(e)
+
+
+# -----------------------------------------
+# Comparing trees
+# -----------------------------------------
+
+
+def ast_equal(t1, t2) -> bool:
+    """
+    Structural equality of two trees (or lists of trees).
+
+    Same as ==, but it does not recurse, so it also works for very deep trees.
+    """
+    todo = [(t1, t2)]
+    while todo:
+        (a, b) = todo.pop()
+        if a is b:
+            continue
+        if type(a) is not type(b):
+            return False
+        if type(a) is list or type(a) is tuple:
+            if len(a) != len(b):
+                return False
+            todo.extend(zip(a, b))
+        elif hasattr(a, "__dataclass_fields__"):
+            for field in a.__dataclass_fields__:
+                todo.append((getattr(a, field), getattr(b, field)))
+        elif a != b:
+            return False
+    return True
+
+
 # -----------------------------------------
 # Tests
 # -----------------------------------------
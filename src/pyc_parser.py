@@ -1,5 +1,6 @@
-from typing import Iterator
-from lexer import tokenize, Token, TokenInfo
+from enum import Enum
+from typing import Any, Iterable, Union
+from lexer import Token, TokenInfo, TokenStream, TokenList, TokenCursor
 import pyc_ast as E
 from pyc_ast import StmDecl
 
@@ -12,40 +13,186 @@ class ParseError(Exception):
         return f"{self.msg}"
 
 
+class Assoc(Enum):
+    Left = "left"
+    Right = "right"
+    Neither = "neither"
+
+
+# Binding power of the operators, from the loosest to the tightest.
+PREC_ASSIGN = 1
+PREC_NOT = 2
+PREC_BOOL = 3
+PREC_CMP = 4
+PREC_ADD = 5
+PREC_MUL = 6
+
+
+class _StmKind(Enum):
+    List = "list"  # statements up to an end token
+    Body = "body"  # if/while body without braces
+    While = "while"
+    If = "if"
+    Single = "single"  # see Parser.parse_stm
+
+
+class _StmFrame:
+    """A statement waiting for the statements nested inside"""
+
+    __slots__ = ("kind", "end", "block", "items", "cond", "then")
+
+    def __init__(self, kind, *, end=None, block=False, cond=None):
+        self.kind = kind
+        self.end = end
+        self.block = block
+        self.items: list[E.Stm] = []
+        self.cond = cond
+        self.then = None
+
+
+class _ExprKind(Enum):
+    Top = "top"
+    Paren = "paren"
+    Args = "args"
+
+
+class _ExprFrame:
+    """An expression, a parenthesized subexpression or a function argument"""
+
+    __slots__ = ("kind", "min_prec", "unary", "name", "args", "operands", "pending")
+
+    def __init__(self, kind, min_prec, unary=None, name: str = ""):
+        self.kind = kind
+        self.min_prec = min_prec
+        # a unary operator applied to the parenthesis or function call
+        self.unary = unary
+        self.name = name
+        self.args: list[E.Expr] = []
+        self.operands: list[E.Expr] = []
+        self.pending: list[tuple[int, Any, Any]] = []
+
+
 class Parser:
-    def __init__(self, tokens: Iterator[TokenInfo]):
-        self._tokens = tokens
+    # Operator tables, shared by all parsers
+
+    _compound_assingments = {
+        Token.PLUS_EQ: E.ArithOp.Add,
+        Token.MINUS_EQ: E.ArithOp.Sub,
+        Token.TIMES_EQ: E.ArithOp.Mul,
+        Token.DIVIDE_EQ: E.ArithOp.Div,
+        Token.MOD_EQ: E.ArithOp.Mod,
+    }
+
+    _bool_ops = {Token.AND: E.BoolOp.And, Token.OR: E.BoolOp.Or}
+
+    _arith_cmps = {
+        Token.DBL_EQ: E.ArithCmp.Eq,
+        Token.NOT_EQ: E.ArithCmp.Neq,
+        Token.GREATER_EQ: E.ArithCmp.Geq,
+        Token.GREATER: E.ArithCmp.Gt,
+        Token.LESS_EQ: E.ArithCmp.Leq,
+        Token.LESS: E.ArithCmp.Lt,
+    }
+
+    _additive_ops = {Token.PLUS: E.ArithOp.Add, Token.MINUS: E.ArithOp.Sub}
+
+    _multiplicative_ops = {
+        Token.TIMES: E.ArithOp.Mul,
+        Token.DIVIDE: E.ArithOp.Div,
+        Token.MOD: E.ArithOp.Mod,
+    }
+
+    _unary_ops = {
+        Token.TIMES: E.ArithUnaryOp.Deref,
+        Token.AMPERSAND: E.ArithUnaryOp.Addr,
+    }
+
+    # token => (precedence, associativity, node constructor, operator)
+    # NOTE: arithmetic operators are right associative, a - b - c is parsed
+    # as a - (b - c); comparisons and boolean operators can't be chained.
+    _binary_ops = {
+        Token.EQUAL: (PREC_ASSIGN, Assoc.Right, E.ArithAssign, None),
+        **{
+            tag: (PREC_ASSIGN, Assoc.Right, E.ArithAssign, op)
+            for tag, op in _compound_assingments.items()
+        },
+        **{
+            tag: (PREC_BOOL, Assoc.Neither, E.BoolBinop, op)
+            for tag, op in _bool_ops.items()
+        },
+        **{
+            tag: (PREC_CMP, Assoc.Neither, E.BoolArithCmp, op)
+            for tag, op in _arith_cmps.items()
+        },
+        **{
+            tag: (PREC_ADD, Assoc.Right, E.ArithBinop, op)
+            for tag, op in _additive_ops.items()
+        },
+        **{
+            tag: (PREC_MUL, Assoc.Right, E.ArithBinop, op)
+            for tag, op in _multiplicative_ops.items()
+        },
+    }
+
+    def __init__(
+        self,
+        tokens: Union[Iterable[TokenInfo], TokenStream],
+        start: int = 0,
+        builder=None,
+    ):
+        """
+        The nodes are created by the builder, pyc_ast.TreeBuilder by default
+        (see arena.ArenaBuilder for the other one)
+        """
+        if not isinstance(tokens, TokenStream):
+            tokens = TokenList(tokens)
+        self._cursor = TokenCursor(tokens, start)
+
+        self.ast = builder if builder is not None else E.TreeBuilder()
+        self._binary_ops = {
+            tag: (prec, assoc, getattr(self.ast, node.__name__), op)
+            for tag, (prec, assoc, node, op) in Parser._binary_ops.items()
+        }
 
     @property
-    def get_token(self) -> TokenInfo:
-        return next(self._tokens)
-        # print(f"  {token.tag}, {token.line}", file=sys.stderr)
+    def position(self) -> int:
+        """The index of the next token to be consumed"""
+        return self._cursor.pos
 
-    @property
-    def peek(self) -> TokenInfo:
-        self._tokens = self.peekable(self._tokens)
-        return next(self._tokens)
+    # -----------------------------------
+    # Token access, all operations are O(1)
+
+    def peek(self, k: int = 0) -> TokenInfo:
+        """The k-th token ahead, peek() is the next token to be consumed"""
+        return self._cursor.peek(k)
+
+    def peek_tag(self, k: int = 0) -> Token:
+        return self._cursor.peek_tag(k)
 
-    def peekable(self, gen):
-        val = next(gen)
-        yield val
-        yield val
-        yield from gen
+    def peek_value(self, k: int = 0) -> Any:
+        return self._cursor.peek_value(k)
+
+    def advance(self) -> TokenInfo:
+        """Consumes the next token and returns it"""
+        token = self._cursor.peek()
+        self._cursor.advance()
+        return token
 
     def expect(self, *expected_tags):
-        token = self.get_token
-        if token.tag not in expected_tags:
+        tag = self._cursor.peek_tag()
+        if tag not in expected_tags:
+            token = self._cursor.peek()
             tags = [str(tok) for tok in expected_tags]
             raise ParseError(
                 token=token, msg=f"Found {token.tag}, expected one of {tags}"
             )
-        assert token.tag in expected_tags
+        self._cursor.advance()
 
     def parse_many(self, parser, *, sep=None, end):
         results = []
-        if self.peek.tag != end:
+        if self.peek_tag() != end:
             results.append(parser())
-            while self.peek.tag != end:
+            while self.peek_tag() != end:
                 if sep is not None:
                     self.expect(sep)
                 results.append(parser())
@@ -80,21 +227,21 @@ class Parser:
         ...
 
     def parse_ctype(self) -> E.CType:
-        token = self.peek
+        token = self.peek()
         self.expect(Token.TYPE)
         atom_tp = self.parse_atomic_type(token)
 
         # normal type or pointer?
-        if self.peek.tag == Token.TIMES:
+        if self.peek_tag() == Token.TIMES:
             self.expect(Token.TIMES)
             return E.CType(E.TypeKind.Pointer, atom_tp)
         else:
             return E.CType(E.TypeKind.Normal, atom_tp)
 
     def parse_id(self) -> str:
-        token = self.get_token
-        assert token.tag == Token.ID
-        return token.value
+        name = self.peek_value()
+        self.expect(Token.ID)
+        return name
 
     def parse_param(self) -> E.FunArg:
         "E.g. long a"
@@ -117,11 +264,11 @@ class Parser:
         """
         tp = self.parse_ctype()
         name = self.parse_id()
-        if self.peek.tag == Token.LPAREN:
+        if self.peek_tag() == Token.LPAREN:
             params = self.parse_params()
             self.expect(Token.LBRACE)
             body = self.parse_stms(end=Token.RBRACE)
-            return E.FunDecl(tp, name, params, body)
+            return self.ast.FunDecl(tp, name, params, body)
         else:
             return self.parse_var_decl(tp, name, E.VarKind.Global)
 
@@ -132,7 +279,8 @@ class Parser:
         return self.parse_stms()
 
     def parse_stms(self, end=Token.EOF):
-        return self.parse_many(self.parse_stm, sep=None, end=end)
+        """Parses statements up to the `end` token, which is consumed"""
+        return self.parse_statements(_StmFrame(_StmKind.List, end=end))
 
     def parse_stm_print(self):
         self.expect(Token.PRINT)
@@ -140,26 +288,21 @@ class Parser:
         a = self.parse_expr()
         self.expect(Token.RPAREN)
         self.expect(Token.SEMI)
-        return E.StmPrint(a)
-
-    def parse_stm_block(self):
-        self.expect(Token.LBRACE)
-        ss = self.parse_stms(end=Token.RBRACE)
-        return E.StmBlock(ss)
+        return self.ast.StmPrint(a)
 
     def parse_var_decl(self, tp, var, kind) -> StmDecl:
-        if self.peek.tag == Token.SEMI:
+        if self.peek_tag() == Token.SEMI:
             self.expect(Token.SEMI)
             # only declaration
-            return E.StmDecl(tp, var, a=None, kind=kind)
-        elif self.peek.tag == Token.EQUAL:
+            return self.ast.StmDecl(tp, var, None, kind)
+        elif self.peek_tag() == Token.EQUAL:
             # declaration with initialization
             self.expect(Token.EQUAL)
             e = self.parse_expr()
             self.expect(Token.SEMI)
-            return E.StmDecl(tp, var, e, kind)
+            return self.ast.StmDecl(tp, var, e, kind)
         else:
-            raise ParseError(msg="expected SEMI or EQUAL", token=self.peek.tag)
+            raise ParseError(msg="expected SEMI or EQUAL", token=self.peek())
 
     def parse_stm_var_decl(self, kind=E.VarKind.Local):
         tp = self.parse_ctype()
@@ -167,71 +310,46 @@ class Parser:
         return self.parse_var_decl(tp, var, kind)
 
     def parse_lvalue(self):
-        token = self.peek
+        token = self.peek()
         self.expect(Token.ID, Token.TIMES)
         if token.tag == Token.ID:
             return E.LValue(E.LValueKind.Var, token.value)
         else:
             # *n
-            id_token = self.peek
+            id_token = self.peek()
             self.expect(Token.ID)
             return E.LValue(E.LValueKind.Pointer, id_token.value)
 
-    @property
-    def _compound_assingments(self):
-        return {
-            Token.PLUS_EQ: E.ArithOp.Add,
-            Token.MINUS_EQ: E.ArithOp.Sub,
-            Token.TIMES_EQ: E.ArithOp.Mul,
-            Token.DIVIDE_EQ: E.ArithOp.Div,
-            Token.MOD_EQ: E.ArithOp.Mod,
-        }
-
-    def parse_stm_while(self):
-        self.expect(Token.WHILE)
-        self.expect(Token.LPAREN)
-        b = self.parse_expr()
-        self.expect(Token.RPAREN)
-        ss = self.parse_block_or_stm()
-        return E.StmWhile(b, ss)
-
-    def parse_stm_if(self):
-        self.expect(Token.IF)
+    def parse_condition(self) -> E.Expr:
+        """The condition of if and while, e.g. (x > 0)"""
         self.expect(Token.LPAREN)
         b = self.parse_expr()
         self.expect(Token.RPAREN)
-        ss1 = self.parse_block_or_stm()
-        if self.peek.tag == Token.ELSE:
-            self.expect(Token.ELSE)
-            ss2 = self.parse_block_or_stm()
-        else:
-            ss2 = []
-        return E.StmIf(b, ss1, ss2)
+        return b
 
     def parse_return(self):
         self.expect(Token.RETURN)
         e = self.parse_expr()
         self.expect(Token.SEMI)
-        return E.StmReturn(e)
+        return self.ast.StmReturn(e)
 
     def parse_break(self):
         self.expect(Token.BREAK)
         self.expect(Token.SEMI)
-        return E.StmBreak()
+        return self.ast.StmBreak()
 
     def parse_continue(self):
         self.expect(Token.CONTINUE)
         self.expect(Token.SEMI)
-        return E.StmContinue()
+        return self.ast.StmContinue()
 
     def parse_stm(self):
-        token = self.peek
-        tag = token.tag
-
-        if tag == Token.LBRACE:
-            return self.parse_stm_block()
+        """Parses a single statement"""
+        return self.parse_statements(_StmFrame(_StmKind.Single))
 
-        elif tag == Token.PRINT:
+    def parse_simple_stm(self, tag):
+        """Statements which don't contain other statements"""
+        if tag == Token.PRINT:
             return self.parse_stm_print()
 
         elif tag == Token.RETURN:
@@ -246,107 +364,261 @@ class Parser:
         elif tag == Token.TYPE:
             return self.parse_stm_var_decl()
 
-        elif tag == Token.WHILE:
-            return self.parse_stm_while()
-
-        elif tag == Token.IF:
-            return self.parse_stm_if()
-
         else:
             a = self.parse_expr()
             self.expect(Token.SEMI)
-            return E.StmExpr(a)
+            return self.ast.StmExpr(a)
 
-    def parse_block_or_stm(self):
-        token = self.peek
-        if token.tag == Token.LBRACE:
+    def open_body(self, frames):
+        """The body of if/while, a block or a single statement"""
+        if self.peek_tag() == Token.LBRACE:
             self.expect(Token.LBRACE)
-            return self.parse_stms(end=Token.RBRACE)
+            frames.append(_StmFrame(_StmKind.List, end=Token.RBRACE))
         else:
-            return self.parse_stm()
+            frames.append(_StmFrame(_StmKind.Body))
+
+    def parse_statements(self, root) -> Any:
+        """
+        Statements nest (blocks and if/while bodies), but instead of recursive
+        calls we keep the constructs waiting for their bodies on an explicit
+        stack of frames, so the nesting depth is only limited by memory.
+        """
+        frames = [root]
+        # a statement, or a list of them (a block or the body of if/while)
+        stm: Any
+        while True:
+            frame = frames[-1]
+            tag = self.peek_tag()
+
+            if frame.kind == _StmKind.List and tag == frame.end:
+                self.expect(frame.end)
+                frames.pop()
+                stm = frame.items if not frame.block else self.ast.StmBlock(frame.items)
+
+            elif tag == Token.LBRACE:
+                self.expect(Token.LBRACE)
+                frames.append(_StmFrame(_StmKind.List, end=Token.RBRACE, block=True))
+                continue
+
+            elif tag == Token.WHILE:
+                self.expect(Token.WHILE)
+                frames.append(_StmFrame(_StmKind.While, cond=self.parse_condition()))
+                self.open_body(frames)
+                continue
+
+            elif tag == Token.IF:
+                self.expect(Token.IF)
+                frames.append(_StmFrame(_StmKind.If, cond=self.parse_condition()))
+                self.open_body(frames)
+                continue
+
+            else:
+                stm = self.parse_simple_stm(tag)
+
+            # pass the finished statement (or list of statements)
+            # to the enclosing constructs
+            while frames:
+                frame = frames[-1]
+                kind = frame.kind
+                if kind == _StmKind.List:
+                    frame.items.append(stm)
+                    break
+                elif kind == _StmKind.If and frame.then is None:
+                    if self.peek_tag() == Token.ELSE:
+                        self.expect(Token.ELSE)
+                        frame.then = stm
+                        self.open_body(frames)
+                        break
+                    frames.pop()
+                    stm = self.ast.StmIf(frame.cond, stm, [])
+                elif kind == _StmKind.If:
+                    frames.pop()
+                    stm = self.ast.StmIf(frame.cond, frame.then, stm)
+                elif kind == _StmKind.While:
+                    frames.pop()
+                    stm = self.ast.StmWhile(frame.cond, stm)
+                elif kind == _StmKind.Body:
+                    frames.pop()
+                    stm = [stm]
+                else:
+                    assert kind == _StmKind.Single
+                    frames.pop()
+            else:
+                return stm
 
     # -----------------------------------
-    # Boolean Expressions
+    # Expressions
 
     def parse_expr_top(self):
         b = self.parse_expr()
         self.expect(Token.EOF)
         return b
 
-    def parse_expr(self) -> E.Expr:
-        compounds = self._compound_assingments
-        assignments = [Token.EQUAL] + list(compounds.keys())
-        lhs = self.parse_expr4()
-        assign = self.peek.tag
-        if assign in assignments:
-            if isinstance(lhs, E.Var):
-                lvalue = E.lvalue_var(lhs.var)
-            elif isinstance(lhs, E.ArithUnaryop) and lhs.op == E.ArithUnaryOp.Deref:
-                assert isinstance(lhs.a, E.Var)
-                lvalue = E.lvalue_pointer(lhs.a.var)
-            else:
-                raise ParseError(self.peek, f"wrong lvalue in assignment: {lhs}")
-
-            self.expect(*assignments)
-            rhs = self.parse_expr()
-            if assign == Token.EQUAL:
-                return E.ArithAssign(lvalue, rhs)
-            else:
-                assert assign in compounds.keys()
-                op = compounds[assign]
-                # rewrite x += 1 into x = x + 1
-                return E.ArithAssign(lvalue, E.ArithBinop(op, lvalue.expr, rhs))
-        else:
-            return lhs
+    def parse_expr(self, min_prec: int = PREC_ASSIGN) -> E.Expr:
+        """
+        Parses an expression using operator precedence ("shunting-yard").
 
-    @property
-    def _bool_ops(self):
-        operators = {Token.AND: E.BoolOp.And, Token.OR: E.BoolOp.Or}
-        return operators
+        Operands and the operators waiting for their right-hand side are kept
+        on explicit stacks. Every open parenthesis or argument list gets
+        its own frame, which is also kept on an explicit stack, so neither
+        the length nor the nesting of expressions is limited by recursion.
 
-    @property
-    def _arith_cmps(self):
-        operators = {
-            Token.DBL_EQ: E.ArithCmp.Eq,
-            Token.NOT_EQ: E.ArithCmp.Neq,
-            Token.GREATER_EQ: E.ArithCmp.Geq,
-            Token.GREATER: E.ArithCmp.Gt,
-            Token.LESS_EQ: E.ArithCmp.Leq,
-            Token.LESS: E.ArithCmp.Lt,
-        }
-        return operators
-
-    def parse_expr4(self):
-        token = self.peek
-        if token.tag == Token.BANG:
-            self.expect(Token.BANG)
-            b = self.parse_expr4()
-            return E.BoolNeg(b)
-        else:
-            return self.parse_expr5()
+        Only operators binding at least as tight as min_prec are consumed.
+        """
+        unary_ops = self._unary_ops
+        frame = _ExprFrame(_ExprKind.Top, min_prec)
+        frames: list[_ExprFrame] = []
+
+        while True:
+            # an operand is expected
+            pending = frame.pending
+
+            # `!` is only allowed at the start of an expression,
+            # right after another `!` or after an assignment
+            while (
+                self.peek_tag() == Token.BANG
+                and frame.min_prec <= PREC_NOT
+                and (not pending or pending[-1][0] <= PREC_NOT)
+            ):
+                self.expect(Token.BANG)
+                pending.append((PREC_NOT, self.ast.BoolNeg, None))
+
+            tag = self.peek_tag()
+            unary = unary_ops.get(tag)
+            if unary is not None:
+                self.expect(tag)
+                tag = self.peek_tag()
+
+            if tag == Token.LPAREN:
+                self.expect(Token.LPAREN)
+                frames.append(frame)
+                frame = _ExprFrame(_ExprKind.Paren, PREC_ASSIGN, unary)
+                continue
+            elif tag == Token.NUMBER:
+                operand = self.ast.ArithLit(self.peek_value())
+                self.expect(Token.NUMBER)
+            elif tag == Token.ID:
+                # variable or funcall
+                name = self.peek_value()
+                self.expect(Token.ID)
+                if self.peek_tag() == Token.LPAREN:
+                    self.expect(Token.LPAREN)
+                    if self.peek_tag() != Token.RPAREN:
+                        frames.append(frame)
+                        frame = _ExprFrame(_ExprKind.Args, PREC_ASSIGN, unary, name)
+                        continue
+                    self.expect(Token.RPAREN)
+                    operand = self.ast.FunCall(name, [])
+                else:
+                    operand = self.ast.Var(name)
+            else:
+                token = self.advance()
+                msg = (
+                    f"Unexpected token: {token.tag}\n"
+                    "Expected expression, namely one of LPAREN, "
+                    "NUMBER or ID"
+                )
+                raise ParseError(token, msg)
+
+            if unary is not None:
+                operand = self.ast.ArithUnaryop(unary, operand)
+
+            # an operator is expected, if there is none, the current
+            # frame is finished and we return to the enclosing one
+            while True:
+                frame.operands.append(operand)
+                if self.push_operator(frame):
+                    break
+
+                value = self.finish(frame)
+                if frame.kind == _ExprKind.Top:
+                    return value
+                elif frame.kind == _ExprKind.Paren:
+                    self.expect(Token.RPAREN)
+                    operand = value
+                else:
+                    frame.args.append(value)
+                    if self.peek_tag() != Token.RPAREN:
+                        # the next argument
+                        self.expect(Token.COMMA)
+                        frame.operands = []
+                        frame.pending = []
+                        break
+                    self.expect(Token.RPAREN)
+                    operand = self.ast.FunCall(frame.name, frame.args)
+
+                if frame.unary is not None:
+                    operand = self.ast.ArithUnaryop(frame.unary, operand)
+                frame = frames.pop()
+
+    def push_operator(self, frame) -> bool:
+        """
+        Consumes the next token if it is a binary operator which continues
+        the expression of the given frame.
+        """
+        entry = self._binary_ops.get(self.peek_tag())
+        if entry is None:
+            return False
+        prec, assoc, node, op = entry
+        if prec < frame.min_prec:
+            return False
+
+        operands = frame.operands
+        pending = frame.pending
+
+        # finish the operators which bind tighter than the current one
+        while pending:
+            top = pending[-1][0]
+            if top > prec or (top == prec and assoc == Assoc.Left):
+                self.reduce(operands, pending)
+            else:
+                break
 
-    def parse_expr5(self):
-        operators = self._bool_ops
+        if pending and pending[-1][0] == prec and assoc == Assoc.Neither:
+            # e.g. a < b < c, the operator is left for our caller
+            return False
 
-        b1 = self.parse_bool_atom()
-        token = self.peek
-        if token.tag in operators.keys():
-            self.expect(*operators.keys())
-            b2 = self.parse_bool_atom()
-            return E.BoolBinop(operators[token.tag], b1, b2)
+        if prec == PREC_ASSIGN:
+            lvalue = self.to_lvalue(operands.pop())
+            pending.append((prec, lvalue, op))
         else:
-            return b1
-
-    def parse_bool_atom(self):
-        operators = self._arith_cmps
-        a1 = self.parse_arith()
-        operator = self.peek.tag
-        if operator in operators.keys():
-            self.expect(*operators.keys())
-            a2 = self.parse_arith()
-            return E.BoolArithCmp(operators[operator], a1, a2)
+            pending.append((prec, node, op))
+        self._cursor.advance()
+        return True
+
+    def finish(self, frame) -> E.Expr:
+        operands = frame.operands
+        pending = frame.pending
+        while pending:
+            self.reduce(operands, pending)
+        assert len(operands) == 1
+        return operands[0]
+
+    def reduce(self, operands, pending):
+        """Applies the topmost pending operator to its operand(s)"""
+        prec, node, op = pending.pop()
+        if prec == PREC_NOT:
+            operands.append(node(operands.pop()))
+        elif prec == PREC_ASSIGN:
+            lvalue = node
+            rhs = operands.pop()
+            if op is None:
+                operands.append(self.ast.ArithAssign(lvalue, rhs))
+            else:
+                # rewrite x += 1 into x = x + 1
+                rhs = self.ast.ArithBinop(op, self.ast.lvalue_expr(lvalue), rhs)
+                operands.append(self.ast.ArithAssign(lvalue, rhs))
         else:
-            return a1
+            rhs = operands.pop()
+            lhs = operands.pop()
+            operands.append(node(op, lhs, rhs))
+
+    def to_lvalue(self, lhs) -> E.LValue:
+        lvalue = self.ast.as_lvalue(lhs)
+        if lvalue is None:
+            lhs = self.ast.describe(lhs)
+            raise ParseError(self.peek(), f"wrong lvalue in assignment: {lhs}")
+        return lvalue
 
     # -----------------------------------
     # Arith Expressions
@@ -357,86 +629,14 @@ class Parser:
         return e
 
     def parse_arith(self):
-        factor = self.parse_factor()
-        token = self.peek
-        if token.tag not in [Token.PLUS, Token.MINUS]:
-            return factor
-        else:
-            tags = {Token.PLUS: E.ArithOp.Add, Token.MINUS: E.ArithOp.Sub}
-            self.expect(Token.PLUS, Token.MINUS)
-            expr = self.parse_arith()
-            tag = tags[token.tag]
-            return E.ArithBinop(tag, factor, expr)
-
-    def parse_factor(self):
-        atom = self.parse_unary()
-        token = self.peek
-        tags = {
-            Token.TIMES: E.ArithOp.Mul,
-            Token.DIVIDE: E.ArithOp.Div,
-            Token.MOD: E.ArithOp.Mod,
-        }
-
-        if token.tag not in tags.keys():
-            return atom
-        else:
-            self.expect(*tags.keys())
-            factor = self.parse_factor()
-            binop = tags[token.tag]
-            return E.ArithBinop(binop, atom, factor)
-
-    # -----------------------------------
-    # Unary operators
-
-    def parse_unary(self):
-        tags = {Token.TIMES: E.ArithUnaryOp.Deref, Token.AMPERSAND: E.ArithUnaryOp.Addr}
-
-        token = self.peek
-        if token.tag not in tags.keys():
-            return self.parse_atom()
-        else:
-            self.expect(*tags.keys())
-            atom = self.parse_atom()
-            unary = tags[token.tag]
-            return E.ArithUnaryop(unary, atom)
-
-    # -----------------------------------
-    # Function calls
-
-    def parse_args(self):
-        return self.parse_many(self.parse_expr, sep=Token.COMMA, end=Token.RPAREN)
-
-    def parse_atom(self):
-        token = self.get_token
-        if token.tag == Token.LPAREN:
-            e = self.parse_expr()
-            self.expect(Token.RPAREN)
-            return e
-        elif token.tag == Token.NUMBER:
-            return E.ArithLit(token.value)
-        elif token.tag == Token.ID:
-            # variable or funcall
-            if self.peek.tag == Token.LPAREN:
-                name = token.value
-                self.expect(Token.LPAREN)
-                args = self.parse_args()
-                return E.FunCall(name, args)
-            else:
-                return E.Var(token.value)
-        else:
-            msg = (
-                f"Unexpected token: {token.tag}\n"
-                "Expected expression, namely one of LPAREN, "
-                "NUMBER or ID"
-            )
-            raise ParseError(token, msg)
+        return self.parse_expr(min_prec=PREC_ADD)
 
 
 def parse_arith(s):
     """
     Takes an input string and outputs an expr AST
     """
-    tokens = tokenize(s)
+    tokens = TokenStream(s)
     return Parser(tokens).parse_expr_top()
 
 
@@ -444,7 +644,7 @@ def parse_expr(s):
     """
     Takes an input string and outputs a bool expr AST
     """
-    tokens = tokenize(s)
+    tokens = TokenStream(s)
     return Parser(tokens).parse_expr_top()
 
 
@@ -452,7 +652,7 @@ def parse_stm(s):
     """
     Takes an input string and outputs a stm AST
     """
-    tokens = tokenize(s)
+    tokens = TokenStream(s)
     return Parser(tokens).parse_stm_top()
 
 
@@ -460,5 +660,5 @@ def parse_file(s):
     """
     Takes an input string and outputs a definition list or stm AST
     """
-    tokens = tokenize(s)
+    tokens = TokenStream(s)
     return Parser(tokens).parse_file_top()
@@ -1,16 +1,20 @@
 import pyc_ast as E
 from collections import defaultdict
 
-from visitor import Visitor
+from visitor import Pass, Walk
 
 
-class RenameVarsVisitor(Visitor):
+class RenameVarsPass(Pass):
     def __init__(self):
         self._var_counts = defaultdict(int)
-        self._history = [self._var_counts.copy()]
+        # the variables declared in the open blocks, and where each block starts
+        # (so leaving a block doesn't require copying all the counts)
+        self._declared = []
+        self._blocks = []
 
     def push_variable(self, var):
         self._var_counts[var] += 1
+        self._declared.append(var)
 
     def mangle_var(self, var):
         count = self._var_counts[var]
@@ -19,100 +23,35 @@ class RenameVarsVisitor(Visitor):
         else:
             return var
 
-    def push_block(self):
-        self._history.append(self._var_counts.copy())
+    def enter_block(self):
+        self._blocks.append(len(self._declared))
 
-    def pop_block(self):
-        self._var_counts = self._history.pop()
+    def leave_block(self):
+        start = self._blocks.pop()
+        for var in self._declared[start:]:
+            self._var_counts[var] -= 1
+        del self._declared[start:]
 
-    def visit_ArithLit(self, val):
-        return E.ArithLit(val)
+    # Only the nodes with a renamed variable are replaced
 
-    def visit_Var(self, var):
-        var1 = self.mangle_var(var)
-        return E.Var(var1)
+    def leave_Var(self, node):
+        var1 = self.mangle_var(node.var)
+        if var1 != node.var:
+            return E.Var(var1)
 
-    def visit_ArithUnaryop(self, op, a):
-        a1 = a.accept(self)
-        return E.ArithUnaryop(op, a1)
+    def leave_ArithAssign(self, node):
+        var1 = self.mangle_var(node.lvalue.loc)
+        if var1 != node.lvalue.loc:
+            return E.ArithAssign(node.lvalue.rename(var1), node.a)
 
-    def visit_ArithBinop(self, op, a1, a2):
-        a11 = a1.accept(self)
-        a21 = a2.accept(self)
-        return E.ArithBinop(op, a11, a21)
+    def enter_StmDecl(self, node):
+        # the variable is in scope in its initializer
+        self.push_variable(node.var)
 
-    def visit_BoolNeg(self, b):
-        b1 = b.accept(self)
-        return E.BoolNeg(b1)
-
-    def visit_BoolArithCmp(self, op, a1, a2):
-        a11 = a1.accept(self)
-        a21 = a2.accept(self)
-        return E.BoolArithCmp(op, a11, a21)
-
-    def visit_BoolBinop(self, op, b1, b2):
-        b11 = b1.accept(self)
-        b21 = b2.accept(self)
-        return E.BoolBinop(op, b11, b21)
-
-    def visit_ArithAssign(self, lvalue, a):
-        var = lvalue.loc
-        var1 = self.mangle_var(var)
-        lvalue1 = lvalue.rename(var1)
-        a1 = a.accept(self)
-        return E.ArithAssign(lvalue1, a1)
-
-    def visit_StmExpr(self, a):
-        a1 = a.accept(self)
-        return E.StmExpr(a1)
-
-    def visit_StmIf(self, b, ss1, ss2):
-        b1 = b.accept(self)
-        ss11 = self.visit_many(ss1)
-        ss21 = self.visit_many(ss2)
-        return E.StmIf(b1, ss11, ss21)
-
-    def visit_StmWhile(self, b, ss):
-        b1 = b.accept(self)
-        ss1 = self.visit_many(ss)
-        return E.StmWhile(b1, ss1)
-
-    def visit_StmPrint(self, a):
-        a1 = a.accept(self)
-        return E.StmPrint(a1)
-
-    def visit_StmReturn(self, a):
-        a1 = a.accept(self)
-        return E.StmReturn(a1)
-
-    def visit_StmBreak(self):
-        return E.StmBreak()
-
-    def visit_StmContinue(self):
-        return E.StmContinue()
-
-    def visit_StmBlock(self, stms):
-        return E.StmBlock(self.visit_many(stms))
-
-    def visit_FunDecl(self, type, name, params, body):
-        body1 = self.visit_many(body)
-        return E.FunDecl(type, name, params, body1)
-
-    def visit_FunCall(self, name, args):
-        args1 = self.visit_many(args)
-        return E.FunCall(name, args1)
-
-    def visit_StmDecl(self, tp, var, a, kind):
-        self.push_variable(var)
-        var1 = self.mangle_var(var)
-        a1 = a.accept(self) if a is not None else None
-        return E.StmDecl(tp, var1, a1, kind)
-
-    def visit_many(self, stms):
-        self.push_block()
-        stms1 = [stm.accept(self) for stm in stms]
-        self.pop_block()
-        return stms1
+    def leave_StmDecl(self, node):
+        var1 = self.mangle_var(node.var)
+        if var1 != node.var:
+            return E.StmDecl(node.type, var1, node.a, node.kind)
 
 
 def rename_vars(stms):
@@ -120,4 +59,4 @@ def rename_vars(stms):
     Returns an equivalent program, but one where all
     variables are unique.
     """
-    return RenameVarsVisitor().visit_many(stms)
+    return Walk([RenameVarsPass()]).run(stms)
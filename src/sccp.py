@@ -0,0 +1,163 @@
+"""
+Sparse conditional constant propagation (Wegman and Zadeck, "Constant
+Propagation with Conditional Branches") on the SSA form (see ssa).
+
+Every temporary starts as unknown (the code computing it was not reached
+yet), may become a constant and then varying, it never goes back. Only the
+blocks which can be reached are evaluated: a branch on a constant only
+makes one of its targets reachable, and the phis ignore the values coming
+along the edges which are never taken. So e.g. in
+
+    x = 1;
+    while (x < 10) { if (x != 1) x = 2; }
+
+x stays 1 and the loop never ends.
+
+The constants are folded with the semantics of the backend (ir.EVALUATE:
+64-bit words, unsigned division), a division by 0 is left to happen at
+run time.
+
+Afterwards the uses of the constants are replaced by their values, the
+instructions computing them are removed, the branches on constants become
+jumps and the blocks which cannot be reached are removed.
+"""
+
+from collections import Counter
+
+from cfg import fold_branch, remove_unreachable
+from ir import BINARY, EVALUATE, Const, Function, Instr, Op, Temp, word
+
+# the values in between the unknown (missing) ones and the constants (ints)
+VARYING = "varying"
+
+
+def meet(a, b):
+    if a is None:
+        return b
+    if b is None or a == b:
+        return a
+    return VARYING
+
+
+def propagate_constants(fun: Function) -> Counter:
+    """Folds the constants, returns the number of folded instructions"""
+    if not fun.blocks:
+        return Counter()
+    # the instructions using every temporary, and the block of every instruction
+    users: dict[Temp, list[Instr]] = {}
+    block_of = {}
+    for block in fun.blocks:
+        for instr in block.instrs:
+            block_of[instr] = block
+            for arg in instr.args:
+                if type(arg) is Temp:
+                    users.setdefault(arg, []).append(instr)
+
+    values: dict = {param: VARYING for param in fun.params}
+    reached = set()
+    edges = set()
+    # the edges which were found to be taken, and the temporaries which changed
+    flow = [(None, fun.blocks[0])]
+    changed: list[Temp] = []
+
+    def value(x):
+        if type(x) is Const:
+            return word(x.value)
+        if type(x) is Temp:
+            return values.get(x)
+        return VARYING
+
+    def take(source, target):
+        if (source, target) not in edges:
+            flow.append((source, target))
+
+    def evaluate(instr):
+        op = instr.op
+        args = instr.args
+        if op in BINARY:
+            a = value(args[0])
+            b = value(args[1])
+            if op == Op.Mul and (a == 0 or b == 0):
+                result = 0
+            elif a is VARYING or b is VARYING:
+                result = VARYING
+            elif a is None or b is None:
+                result = None
+            else:
+                try:
+                    result = EVALUATE[op](a, b)
+                except ZeroDivisionError:
+                    result = VARYING
+        elif op == Op.Copy:
+            result = value(args[0])
+        elif op == Op.Phi:
+            target = block_of[instr]
+            result = None
+            for k in range(0, len(args), 2):
+                if (args[k], target) in edges:
+                    result = meet(result, value(args[k + 1]))
+        elif op == Op.Jmp:
+            take(block_of[instr], args[0])
+            return
+        elif op == Op.Br:
+            cond = value(args[0])
+            if cond is VARYING:
+                take(block_of[instr], args[1])
+                take(block_of[instr], args[2])
+            elif cond is not None:
+                take(block_of[instr], args[1] if cond != 0 else args[2])
+            return
+        else:
+            # loads, calls and addresses
+            result = VARYING
+        dst = instr.dst
+        if dst is not None and values.get(dst) != result:
+            values[dst] = result
+            changed.append(dst)
+
+    while flow or changed:
+        while flow:
+            edge = flow.pop()
+            edges.add(edge)
+            target = edge[1]
+            if target in reached:
+                # only the phis see a new edge
+                for phi in target.phis:
+                    evaluate(phi)
+            else:
+                reached.add(target)
+                for instr in target.instrs:
+                    evaluate(instr)
+        while changed and not flow:
+            for instr in users.get(changed.pop(), ()):
+                if block_of[instr] in reached:
+                    evaluate(instr)
+
+    return Counter(folded=_rewrite(fun, values, reached))
+
+
+def _rewrite(fun: Function, values: dict, reached: set) -> int:
+    folded = 0
+    for block in fun.blocks:
+        if block not in reached:
+            continue
+        instrs = []
+        for instr in block.instrs:
+            dst = instr.dst
+            if dst is not None and type(values.get(dst)) is int:
+                folded += 1
+                continue
+            args = instr.args
+            if any(type(arg) is Temp and type(values.get(arg)) is int for arg in args):
+                instr.args = tuple(
+                    Const(values[arg])
+                    if type(arg) is Temp and type(values.get(arg)) is int
+                    else arg
+                    for arg in args
+                )
+            instrs.append(instr)
+        block.instrs = instrs
+        if fold_branch(block):
+            folded += 1
+    remove_unreachable(fun)
+    return folded
@@ -0,0 +1,39 @@
+"""
+__slots__ for dataclasses.
+
+dataclass(slots=True) needs Python 3.10, so add_slots does the same on 3.9:
+the class is made again, with a slot for every field and without __dict__.
+"""
+
+from dataclasses import fields
+from typing import TypeVar, cast
+
+T = TypeVar("T", bound=type)
+
+
+def _getstate(self):
+    return [getattr(self, f.name) for f in fields(self)]
+
+
+def _setstate(self, state):
+    # a frozen dataclass raises in __setattr__
+    for f, value in zip(fields(self), state):
+        object.__setattr__(self, f.name, value)
+
+
+def add_slots(cls: T) -> T:
+    """The dataclass cls, with __slots__ for its fields"""
+    names = tuple(f.name for f in fields(cls))
+    body = dict(cls.__dict__)
+    # the defaults are class attributes, they would hide the slots (they are
+    # also in __init__)
+    for name in names:
+        body.pop(name, None)
+    body.pop("__dict__", None)
+    body.pop("__weakref__", None)
+    body["__slots__"] = names
+    if cls.__dataclass_params__.frozen:
+        # pickle restores the fields with setattr, which a frozen class forbids
+        body["__getstate__"] = _getstate
+        body["__setstate__"] = _setstate
+    return cast(T, type(cls)(cls.__name__, cls.__bases__, body))
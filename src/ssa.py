@@ -0,0 +1,274 @@
+"""
+The static single assignment (SSA) form of the intermediate code (see ir).
+
+In SSA form every temporary is assigned by one instruction, which dominates
+all its uses. Where the values of a variable coming from different paths
+meet, a phi picks the one of the path which was taken.
+
+The construction follows Cytron et al., "Efficiently Computing Static Single
+Assignment Form and the Control Dependence Graph":
+- the phis of a variable go to the iterated dominance frontier of the blocks
+  assigning it. Only the variables which are read in other blocks than the
+  ones assigning them need phis (the semi-pruned form of Briggs et al.), and
+  a variable which is assigned in a block dominating all its uses gets no
+  phis outside of that block's subtree, e.g. the counter of an inner loop
+  gets none at the headers of the outer loops (without that, the phis of
+  deeply nested loops would grow quadratically),
+- the variables are renamed in a walk of the dominator tree, which keeps the
+  current version of every variable on a stack,
+- the phis whose values are never used are removed.
+Nothing in it is quadratic, e.g. there is no liveness analysis: the dead
+phis are found from the uses of the values, with a worklist.
+
+Only the temporaries are renamed. The variables whose address is taken
+stay in memory (they are Mems, see lowering), and are read and written with
+load and store.
+
+The destruction (out of SSA, before the backend) replaces the phis with
+copies at the ends of the predecessors. The copies of one edge happen at
+the same time (a parallel copy, e.g. swapping two variables), so they are
+sequentialized, with an extra temporary to break the cycles. The critical
+edges (from a block with more successors to a block with more predecessors)
+are split first, so the copies only run on their edge.
+"""
+
+from __future__ import annotations
+
+from cfg import CFG, remove_unreachable
+from gc_pause import gc_paused
+from ir import Block, Const, Function, Instr, Op, Operand, Program, Temp
+
+# the value of a variable which is read before it is written (any would do)
+UNDEFINED = Const(0)
+
+
+def to_ssa(fun: Function):
+    """Puts the function into SSA form (unreachable blocks are removed)"""
+    remove_unreachable(fun)
+    if not fun.blocks:
+        return
+    graph = CFG(fun)
+    blocks = fun.blocks
+
+    # the blocks which assign every temporary, and the blocks which read it
+    # before assigning it (where it is live on entry), without repetitions
+    defs: dict[Temp, list[int]] = {param: [0] for param in fun.params}
+    exposed: dict[Temp, list[int]] = {}
+    def_count: dict[Temp, int] = {param: 1 for param in fun.params}
+    for i, block in enumerate(blocks):
+        assigned = set()
+        for instr in block.instrs:
+            for arg in instr.args:
+                if type(arg) is Temp and arg not in assigned:
+                    uses = exposed.setdefault(arg, [])
+                    if not uses or uses[-1] != i:
+                        uses.append(i)
+            dst = instr.dst
+            if dst is not None:
+                assigned.add(dst)
+                where = defs.setdefault(dst, [])
+                if not where or where[-1] != i:
+                    where.append(i)
+                def_count[dst] = def_count.get(dst, 0) + 1
+
+    # the phis of every block, with their variables
+    phis: list[list[Instr]] = [[] for _ in blocks]
+    phi_var: dict[Instr, Temp] = {}
+    frontiers = graph.dominance_frontiers()
+    dominates = graph.dominates
+    idom = graph.idom
+    for var, uses in exposed.items():
+        if var not in defs:
+            continue
+        def_blocks = set(defs[var])
+        # the nearest block dominating all the uses and the assignments
+        scope = uses[0]
+        for i in [*uses, *def_blocks]:
+            while not dominates(scope, i):
+                scope = idom[scope]
+        if scope in uses or scope not in def_blocks:
+            # the value may come from above the scope, e.g. it is undefined
+            scope = 0
+        placed = set()
+        todo = list(def_blocks)
+        while todo:
+            for j in frontiers[todo.pop()]:
+                if j in placed or not dominates(scope, j):
+                    continue
+                placed.add(j)
+                phi = Instr(Op.Phi, var, ())
+                phis[j].append(phi)
+                phi_var[phi] = var
+                if j not in def_blocks:
+                    todo.append(j)
+        def_count[var] += len(placed)
+    for block, block_phis in zip(blocks, phis):
+        if block_phis:
+            block.instrs[0:0] = block_phis
+
+    # the current versions of the variables which are renamed, the others are
+    # assigned once and only read after that in the same block
+    versions: dict[Temp, list[Operand]] = {var: [] for var in exposed}
+    for var, count in def_count.items():
+        if count > 1:
+            versions[var] = []
+    for param in fun.params:
+        if param in versions:
+            versions[param].append(param)
+
+    def new_version(var):
+        if def_count[var] == 1:
+            return var
+        # the intermediate values are numbered, the variables named
+        return fun.new_temp(var.type, None if var.name.isdigit() else var.name)
+
+    # the variables pushed by every block, popped after its dominator subtree
+    pushed: list[list[Temp]] = [[] for _ in blocks]
+    todo = [(0, False)]
+    while todo:
+        (i, done) = todo.pop()
+        if done:
+            for var in pushed[i]:
+                versions[var].pop()
+            continue
+        todo.append((i, True))
+        todo.extend((child, False) for child in graph.dom_children[i])
+
+        block = blocks[i]
+        for instr in block.instrs:
+            if instr.op != Op.Phi:
+                args = instr.args
+                new_args = None
+                for k, arg in enumerate(args):
+                    if type(arg) is Temp:
+                        stack = versions.get(arg)
+                        if stack is not None:
+                            if new_args is None:
+                                new_args = list(args)
+                            new_args[k] = stack[-1] if stack else UNDEFINED
+                if new_args is not None:
+                    instr.args = tuple(new_args)
+            dst = instr.dst
+            if dst is not None:
+                stack = versions.get(dst)
+                if stack is not None:
+                    instr.dst = new_version(dst)
+                    stack.append(instr.dst)
+                    pushed[i].append(dst)
+
+        for j in dict.fromkeys(graph.succs[i]):
+            for phi in phis[j]:
+                stack = versions[phi_var[phi]]
+                phi.args += (block, stack[-1] if stack else UNDEFINED)
+
+    _remove_dead_phis(fun, phis)
+
+
+def _remove_dead_phis(fun: Function, phis: list[list[Instr]]):
+    """Removes the phis whose values are only used by other dead phis"""
+    phi_of = {phi.dst: phi for block_phis in phis for phi in block_phis}
+    if not phi_of:
+        return
+    live = set()
+    todo = []
+    for block in fun.blocks:
+        for instr in block.instrs:
+            if instr.op == Op.Phi:
+                continue
+            for arg in instr.args:
+                phi = phi_of.get(arg)
+                if phi is not None and phi not in live:
+                    live.add(phi)
+                    todo.append(phi)
+    while todo:
+        for value in todo.pop().args[1::2]:
+            phi = phi_of.get(value)
+            if phi is not None and phi not in live:
+                live.add(phi)
+                todo.append(phi)
+    for block, block_phis in zip(fun.blocks, phis):
+        dead = len(block_phis) - sum(phi in live for phi in block_phis)
+        if dead:
+            block.instrs[: len(block_phis)] = [p for p in block_phis if p in live]
+
+
+def from_ssa(fun: Function):
+    """Replaces the phis of the function with copies"""
+    # the blocks splitting the critical edges, they go after their sources
+    edges: dict[Block, list[Block]] = {}
+    for block in fun.blocks:
+        block_phis = block.phis
+        if not block_phis:
+            continue
+        del block.instrs[: len(block_phis)]
+        copies: dict[Block, list[tuple[Temp, Operand]]] = {}
+        for phi in block_phis:
+            assert phi.dst is not None
+            for source, value in phi.incoming:
+                copies.setdefault(source, []).append((phi.dst, value))
+        for source, pairs in copies.items():
+            # the sources jump to the block, so they end with a terminator
+            terminator = source.terminator
+            assert terminator is not None
+            if terminator.op == Op.Jmp:
+                target = source
+            else:
+                target = fun.new_block()
+                target.instrs.append(Instr(Op.Jmp, None, (block,)))
+                terminator.args = tuple(
+                    target if arg is block else arg for arg in terminator.args
+                )
+                edges.setdefault(source, []).append(target)
+            target.instrs[-1:-1] = sequentialize(fun, pairs)
+    if edges:
+        fun.blocks = [
+            b for block in fun.blocks for b in [block, *edges.get(block, ())]
+        ]
+
+
+def sequentialize(fun: Function, copies: list[tuple[Temp, Operand]]) -> list[Instr]:
+    """
+    The copies (dst, value), which happen at the same time, one after another.
+    A copy waits until its destination is not read by the other copies, the
+    cycles (e.g. a swap) are broken by saving a destination in a temporary.
+    """
+    pending = {dst: value for (dst, value) in copies if dst is not value}
+    readers: dict[Operand, int] = {}
+    for value in pending.values():
+        readers[value] = readers.get(value, 0) + 1
+    result = []
+    ready = [dst for dst in pending if dst not in readers]
+    while pending:
+        while ready:
+            dst = ready.pop()
+            value = pending.pop(dst)
+            result.append(Instr(Op.Copy, dst, (value,)))
+            readers[value] -= 1
+            if readers[value] == 0 and value in pending:
+                ready.append(value)
+        if pending:
+            # only cycles are left, every destination is read by one copy
+            dst = next(iter(pending))
+            saved = fun.new_temp(dst.type)
+            result.append(Instr(Op.Copy, saved, (dst,)))
+            for other, value in pending.items():
+                if value is dst:
+                    pending[other] = saved
+            readers[saved] = readers[dst]
+            readers[dst] = 0
+            ready.append(dst)
+    return result
+
+
+def program_to_ssa(program: Program):
+    _run(to_ssa, program)
+
+
+def program_from_ssa(program: Program):
+    _run(from_ssa, program)
+
+
+def _run(transform, program: Program):
+    with gc_paused():
+        for fun in program.functions:
+            transform(fun)
@@ -0,0 +1,78 @@
+"""
+Tail recursion elimination on the SSA form (see ssa).
+
+A function which returns the result of a call of itself (return f(...))
+does not need a new stack frame for the call: the call becomes a jump back
+to the start of the function, with the arguments as the new values of the
+params. The old entry becomes the header of a loop, where a phi of every
+param picks its initial value (coming from a new, empty entry) or the
+argument of one of the calls, so the loop passes (see licm, induction)
+optimize it like any other.
+
+The frame is reused, so the functions which take the addresses of their
+locals (which have slots) are left alone: a pointer to a slot may be passed
+to the call, which would then change the slot of its caller.
+
+The other calls in tail positions are left to the backend (see backend),
+which reuses the frame for them.
+"""
+
+from collections import Counter
+
+from ir import Function, Instr, Op, Temp
+
+
+def eliminate_tail_recursion(fun: Function) -> Counter:
+    """Replaces the self calls in tail positions with jumps, returns their number"""
+    if not fun.blocks or fun.slots:
+        return Counter()
+    tail_blocks = [block for block in fun.blocks if is_self_tail_call(fun, block)]
+    if not tail_blocks:
+        return Counter()
+
+    header = fun.blocks[0]
+    if any(header in block.successors for block in fun.blocks):
+        # the entry is a loop header already
+        return Counter()
+
+    # the params, as read in the body of the loop
+    values: dict[Temp, Temp] = {
+        param: fun.new_temp(param.type, param.name) for param in fun.params
+    }
+    for block in fun.blocks:
+        for instr in block.instrs:
+            if any(arg in values for arg in instr.uses):
+                instr.args = tuple(
+                    values.get(arg, arg) if type(arg) is Temp else arg
+                    for arg in instr.args
+                )
+
+    entry = fun.new_block()
+    entry.instrs.append(Instr(Op.Jmp, None, (header,)))
+    incoming: list[list] = [[entry, param] for param in fun.params]
+    for block in tail_blocks:
+        call = block.instrs[-2]
+        for i, arg in enumerate(call.args[1:]):
+            incoming[i] += [block, arg]
+        block.instrs[-2:] = [Instr(Op.Jmp, None, (header,))]
+    header.instrs[:0] = [
+        Instr(Op.Phi, values[param], tuple(args))
+        for param, args in zip(fun.params, incoming)
+    ]
+    fun.blocks.insert(0, entry)
+    return Counter(calls=len(tail_blocks))
+
+
+def is_self_tail_call(fun: Function, block) -> bool:
+    """The block ends with return f(...), where f is the function"""
+    instrs = block.instrs
+    if len(instrs) < 2 or instrs[-1].op != Op.Ret:
+        return False
+    call = instrs[-2]
+    return (
+        call.op == Op.Call
+        and call.args[0] == fun.name
+        and call.dst is not None
+        and instrs[-1].args[0] is call.dst
+        and len(call.args) - 1 == len(fun.params)
+    )
@@ -1,10 +1,35 @@
+import glob
+import os
+import pickle
+import random
+import tempfile
 import unittest
 
 from pyc_ast import *
-from lexer import tokenize, simplify
-from pyc_parser import parse_file, parse_stm, parse_expr, parse_arith
+from lexer import tokenize, tokenize_reference, simplify, TokenInfo, Token, TokenStream
+from pyc_parser import parse_file, parse_stm, parse_expr, parse_arith, Parser, ParseError
 from local_vars import get_local_vars
-from rename import rename_vars
+from rename import rename_vars, RenameVarsPass
+from type_checker import check, Env, CTypeError, CTypeErrors, Binding, BindingKind
+from code_generator import compile_top
+import code_generator
+from visitor import BLOCK_FIELDS, CHILD_FIELDS, LIST_FIELDS, Pass, Walk
+import ast_cache
+import backend
+from cfg import CFG
+import ssa
+import optimizer
+import licm
+import induction
+import inline
+import division
+import interpreter
+from ir import EVALUATE, MASK, Op
+from lowering import lower
+from parallel_parser import split_definitions, batches, parse_file_parallel
+import arena
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "examples")
 
 class LexerTests(unittest.TestCase):
     def test_lexer(self):
@@ -217,6 +242,92 @@ class LexerTests(unittest.TestCase):
                     list(simplify(tokenize(input))),
                     expected)
 
+    def test_lexer_divide(self):
+        input_str = "x/2"
+
+        result = list(simplify(tokenize(input_str)))
+
+        expected = [('ID', 'x'), 'DIVIDE', ('NUMBER', 2), 'EOF']
+
+        self.assertEqual(expected, result)
+
+    def test_lexer_positions(self):
+        input_str = "long x;\n  x = 10; // ten\n"
+
+        result = list(tokenize(input_str))
+
+        expected = [
+            TokenInfo(Token.TYPE, 'long', 1, 5),
+            TokenInfo(Token.ID, 'x', 1, 7),
+            TokenInfo(Token.SEMI, None, 1, 7),
+            TokenInfo(Token.ID, 'x', 2, 4),
+            TokenInfo(Token.EQUAL, None, 2, 6),
+            TokenInfo(Token.NUMBER, 10, 2, 9),
+            TokenInfo(Token.SEMI, None, 2, 9),
+            TokenInfo(Token.EOF, None, 3, 2),
+        ]
+
+        self.assertEqual(expected, result)
+
+    def test_lexer_same_as_reference(self):
+        files = glob.glob(os.path.join(EXAMPLES_DIR, "*.sil"))
+        self.assertTrue(files)
+        for file_name in files:
+            with self.subTest(file=os.path.basename(file_name)):
+                with open(file_name) as f:
+                    source = f.read()
+                self.assertEqual(
+                    list(tokenize(source)),
+                    list(tokenize_reference(source)))
+
+class TokenStreamTests(unittest.TestCase):
+    def test_stream_simplify(self):
+        input_str = "(1 + 11 * x)"
+
+        result = list(simplify(TokenStream(input_str)))
+
+        expected = ['LPAREN', ('NUMBER', 1), 'PLUS', ('NUMBER', 11),
+            'TIMES', ('ID', 'x'), 'RPAREN', 'EOF']
+
+        self.assertEqual(expected, result)
+
+    def test_stream_same_as_tokenize(self):
+        files = glob.glob(os.path.join(EXAMPLES_DIR, "*.sil"))
+        for file_name in files:
+            with self.subTest(file=os.path.basename(file_name)):
+                with open(file_name) as f:
+                    source = f.read()
+                stream = TokenStream(source)
+                tokens = list(tokenize(source))
+                self.assertEqual(list(stream), tokens)
+                self.assertEqual(
+                    [stream[i] for i in range(len(stream))], tokens)
+
+    def test_stream_values_shared(self):
+        stream = TokenStream("x = x + 1;\nlong y = x;")
+        self.assertEqual(stream.value(0), 'x')
+        self.assertEqual(stream.tag(6), Token.TYPE)
+        self.assertEqual(stream.value(6), 'long')
+        self.assertEqual(stream._values[0], stream._values[2])
+        self.assertEqual(stream._values[0], stream._values[9])
+
+    def test_stream_position(self):
+        stream = TokenStream("long x;\n  x = 10;\n")
+        self.assertEqual(stream.position(1), (1, 7))
+        self.assertEqual(stream.position(3), (2, 4))
+        self.assertEqual(stream.position(len(stream) - 1), (3, 2))
+
+    def test_cursor(self):
+        cursor = TokenStream("x = 1;").cursor()
+        self.assertEqual(cursor.peek().tag, Token.ID)
+        self.assertEqual(cursor.peek(2), TokenInfo(Token.NUMBER, 1, 1, 6))
+        self.assertEqual(next(cursor).value, 'x')
+        self.assertEqual(cursor.peek_tag(), Token.EQUAL)
+        self.assertEqual(cursor.peek_tag(10), Token.EOF)
+        self.assertEqual(
+            [token.tag for token in cursor],
+            [Token.EQUAL, Token.NUMBER, Token.SEMI, Token.EOF])
+
 class ParserTests(unittest.TestCase):
 
     def test_parser_expr(self):
@@ -715,6 +826,62 @@ class ParserTests(unittest.TestCase):
                 ))
             ])
 
+    def test_parser_bool_neg_scope(self):
+        self.assertEqual(parse_expr("!x && y"),
+            BoolNeg(BoolBinop(BoolOp.And, Var("x"), Var("y"))))
+        self.assertEqual(parse_expr("x = !y"),
+            ArithAssign(lvalue_var("x"), BoolNeg(Var("y"))))
+
+    def test_parser_assign_chain(self):
+        self.assertEqual(parse_expr("x = y += 1"),
+            ArithAssign(lvalue_var("x"),
+                ArithAssign(lvalue_var("y"),
+                    ArithBinop(ArithOp.Add, Var("y"), ArithLit(1)))))
+
+    def test_parser_long_sum(self):
+        n = 20000
+        e = parse_expr(" + ".join(["x"] * n))
+        count = 1
+        while isinstance(e, ArithBinop):
+            self.assertEqual(e.a1, Var("x"))
+            e = e.a2
+            count += 1
+        self.assertEqual(count, n)
+
+    def test_parser_chained_cmp_error(self):
+        for input in ["x < y < z", "x && y || z", "x && !y"]:
+            with self.subTest(input=input):
+                with self.assertRaises(ParseError):
+                    parse_expr(input)
+
+    def test_parser_lookahead(self):
+        parser = Parser(TokenStream("long x = 1;"))
+        self.assertEqual(parser.peek_tag(), Token.TYPE)
+        self.assertEqual(parser.peek(1).value, "x")
+        self.assertEqual(parser.peek_tag(3), Token.NUMBER)
+        self.assertEqual(parser.peek_tag(100), Token.EOF)
+        self.assertEqual(parser.advance().value, "long")
+        self.assertEqual(parser.peek().value, "x")
+
+    def test_parser_token_iterator(self):
+        parser = Parser(tokenize("x = 1;"))
+        self.assertEqual(parser.parse_stm_top(),
+            [StmExpr(ArithAssign(lvalue_var("x"), ArithLit(1)))])
+
+    def test_parser_long_program(self):
+        body = "x = x + 1;\n" * 20000
+        stms = parse_stm(body)
+        self.assertEqual(len(stms), 20000)
+
+    def test_parser_unbraced_body(self):
+        assign = StmExpr(ArithAssign(lvalue_var("x"), ArithLit(1)))
+        self.assertEqual(parse_stm("while (x) x = 1;"),
+            [StmWhile(Var("x"), [assign])])
+        self.assertEqual(parse_stm("if (x) x = 1; else { x = 1; }"),
+            [StmIf(Var("x"), [assign], [assign])])
+        self.assertEqual(parse_stm("if (x) { x = 1; } else if (x) x = 1;"),
+            [StmIf(Var("x"), [assign], [StmIf(Var("x"), [assign], [])])])
+
 class ParserErrorTests(unittest.TestCase):
     def test_non_balanced_expr(self):
         inputs = [
@@ -802,5 +969,1739 @@ class LocalVarsTests(unittest.TestCase):
             ['x', 'x'])
 
 
+class EnvTests(unittest.TestCase):
+    def test_scopes(self):
+        env = Env()
+        x1 = Binding(BindingKind.Global, "x", 0, tp_normal(AtomType.Long), 1)
+        x2 = Binding(BindingKind.Local, "x", 0, tp_pointer(AtomType.Long), 2)
+        y = Binding(BindingKind.Local, "y", 1, tp_normal(AtomType.Int), 3)
+        env.add("x", x1)
+        env.push_scope()
+        env.add("x", x2)
+        env.add("y", y)
+        self.assertEqual(env.get("x"), x2)
+        env.pop_scope()
+        self.assertEqual(env.get("x"), x1)
+        self.assertNotIn("y", env)
+
+    def test_no_state_between_checks(self):
+        check(parse_file("long g = 1;\nint main() {\n  return g;\n}\n"))
+        with self.assertRaises(CTypeError):
+            check(parse_file("int main() {\n  return g;\n}\n"))
+
+    def test_block_scope(self):
+        with self.assertRaises(CTypeError):
+            check(parse_file("int main() {\n  { long x = 1; }\n  return x;\n}\n"))
+        with self.assertRaises(CTypeError):
+            check(parse_file("long f(long a) {\n  return a;\n}\nint main() {\n  return a;\n}\n"))
+
+    def test_address_of_expression(self):
+        for source in [
+            "int main() {\n  print(&5);\n  return 0;\n}\n",
+            "long f() {\n  return 1;\n}\nint main() {\n  return *f();\n}\n",
+        ]:
+            with self.subTest(source=source), self.assertRaises(CTypeError):
+                check(parse_file(source))
+
+
+class SymbolTableTests(unittest.TestCase):
+    source = """
+long g = 1;
+long f(long a, long b) {
+  long x = a;
+  if (x) {
+    long a = b;
+    x = a;
+  }
+  { long y; }
+  return a + g;
+}
+int main() {
+  return f(1, 2);
+}
+"""
+
+    class Collect(Pass):
+        def __init__(self):
+            self.nodes = []
+
+        def leave_Var(self, node):
+            self.nodes.append(node)
+
+        def leave_ArithAssign(self, node):
+            self.nodes.append(node)
+
+        def leave_StmDecl(self, node):
+            self.nodes.append(node)
+
+    def test_bindings(self):
+        symbol_table = check(parse_file(self.source))
+        collect = self.Collect()
+        Walk([collect]).run(symbol_table.defs)
+        bindings = [symbol_table.bindings[id(node)] for node in collect.nodes]
+        self.assertEqual(
+            [(b.kind, b.name, b.index) for b in bindings],
+            [
+                (BindingKind.Global, "g", 0),
+                (BindingKind.Param, "a", 0),
+                (BindingKind.Local, "x", 0),
+                (BindingKind.Local, "x", 0),
+                (BindingKind.Param, "b", 1),
+                (BindingKind.Local, "a", 1),
+                (BindingKind.Local, "a", 1),
+                (BindingKind.Local, "x", 0),
+                (BindingKind.Local, "y", 2),
+                (BindingKind.Param, "a", 0),
+                (BindingKind.Global, "g", 0),
+            ],
+        )
+        self.assertEqual(bindings[0].type, tp_normal(AtomType.Long))
+        [f, main] = symbol_table.defs[1:]
+        frame = symbol_table.frames[id(f)]
+        self.assertEqual([b.name for b in frame.params], ["a", "b"])
+        self.assertEqual([b.name for b in frame.locals], ["x", "a", "y"])
+        self.assertEqual(symbol_table.frames[id(main)].locals, [])
+        # the two a's are different variables
+        self.assertNotEqual(bindings[1], bindings[5])
+        self.assertEqual(len({b.uid for b in bindings}), 6)
+
+    def test_compile_with_symbol_table(self):
+        defs = parse_file(self.source)
+        symbol_table = check(defs)
+        self.assertIs(symbol_table.defs[0], defs[0])
+        code_generator.CompileVisitor.labelId = 0
+        code = compile_top(defs, symbol_table)
+        self.assertIn("mov rax, [rbp - 8 * 2]", code)  # the inner a
+        self.assertIn("sub rsp, 24", code)
+        code_generator.CompileVisitor.labelId = 0
+        self.assertEqual(compile_top(defs, debug=True), code)
+
+
+class ParallelCheckTests(unittest.TestCase):
+    errors = """
+long f(long a) {
+  return b;
+}
+long g = h;
+long h = 1;
+long k(long a) {
+  return f(a, a);
+}
+int main() {
+  return k(x) + g;
+}
+"""
+
+    def test_same_as_sequential(self):
+        for file_name in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*.sil"))):
+            with self.subTest(file=os.path.basename(file_name)):
+                with open(file_name) as f:
+                    defs = parse_file(f.read())
+                code_generator.CompileVisitor.labelId = 0
+                expected = compile_top(defs)
+                for workers in [1, 3]:
+                    symbol_table = check(defs, workers=workers)
+                    code_generator.CompileVisitor.labelId = 0
+                    self.assertEqual(compile_top(defs, symbol_table), expected)
+
+    def test_all_errors(self):
+        defs = parse_file(self.errors)
+        with self.assertRaises(CTypeError) as sequential:
+            check(defs)
+        for workers in [1, 2]:
+            with self.assertRaises(CTypeErrors) as parallel:
+                check(defs, workers=workers)
+            messages = [err.msg for err in parallel.exception.errors]
+            self.assertEqual(len(messages), 4)
+            self.assertEqual(messages[0], sequential.exception.msg)
+            self.assertTrue(messages[1].startswith("name h is not defined"))
+            self.assertTrue(messages[2].startswith("function f got 2 args"))
+            self.assertTrue(messages[3].startswith("name x is not defined"))
+
+    def test_globals_defined_later(self):
+        source = "long f() {\n  return g;\n}\nlong g = 1;\nint main() {\n  return g;\n}\n"
+        with self.assertRaises(CTypeErrors) as cm:
+            check(parse_file(source), workers=1)
+        self.assertEqual(len(cm.exception.errors), 1)
+
+    def test_arena_views(self):
+        source = "long g = 2;\nlong f(long a) {\n  return a * g;\n}\nint main() {\n  return f(3);\n}\n"
+        code_generator.CompileVisitor.labelId = 0
+        expected = compile_top(parse_file(source))
+        views = arena.parse_file(source).views()
+        symbol_table = check(views, workers=2)
+        code_generator.CompileVisitor.labelId = 0
+        self.assertEqual(compile_top(views, symbol_table), expected)
+
+
+class WalkTests(unittest.TestCase):
+    class Counter(Pass):
+        def __init__(self, log):
+            self.log = log
+
+        def enter_StmIf(self, node):
+            self.log.append("if")
+
+        def leave_Var(self, node):
+            self.log.append(node.var)
+
+        def enter_block(self):
+            self.log.append("{")
+
+        def leave_block(self):
+            self.log.append("}")
+
+    def test_hooks_order(self):
+        log = []
+        stms = parse_stm("if (x) { y = z; } else { }")
+        self.assertIs(Walk([self.Counter(log)]).run(stms)[0], stms[0])
+        self.assertEqual(log, ["{", "if", "x", "{", "z", "}", "{", "}", "}"])
+
+    def test_child_fields(self):
+        # from the types of the fields, e.g. Optional[Expr] or Sequence[Stm]
+        self.assertEqual(CHILD_FIELDS[StmDecl], (2,))
+        self.assertEqual(CHILD_FIELDS[BoolNeg], (0,))
+        self.assertEqual(CHILD_FIELDS[FunCall], (1,))
+        self.assertEqual(LIST_FIELDS[FunCall], (1,))
+        self.assertEqual(BLOCK_FIELDS[FunCall], ())
+        # the params are not nodes
+        self.assertEqual(CHILD_FIELDS[FunDecl], (3,))
+        self.assertEqual(BLOCK_FIELDS[StmIf], (1, 2))
+
+    def test_fused(self):
+        stms = parse_stm("long x; { long x = f(x); print(x); }")
+        (log1, log2) = ([], [])
+        renamed = Walk([RenameVarsPass(), self.Counter(log1), self.Counter(log2)]).run(stms)
+        self.assertEqual(renamed, rename_vars(stms))
+        # the later passes see the renamed nodes
+        self.assertEqual(log1, ["{", "{", "x2", "x2", "}", "}"])
+        self.assertEqual(log1, log2)
+
+    def test_unchanged_nodes_are_shared(self):
+        stms = parse_stm("long x; { long y = x * 2; long x; }")
+        renamed = rename_vars(stms)
+        self.assertIs(renamed[0], stms[0])
+        self.assertIs(renamed[1].ss[0], stms[1].ss[0])
+        self.assertIsNot(renamed[1].ss[1], stms[1].ss[1])
+
+    def test_compile_debug(self):
+        for file_name in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*.sil"))):
+            with self.subTest(file=os.path.basename(file_name)):
+                with open(file_name) as f:
+                    defs = parse_file(f.read())
+                code_generator.CompileVisitor.labelId = 0
+                code = compile_top(defs)
+                code_generator.CompileVisitor.labelId = 0
+                self.assertEqual(compile_top(defs, debug=True), code)
+
+
+class DeepProgramTests(unittest.TestCase):
+    """Deep nesting must not hit the recursion limit anywhere"""
+
+    depth = 10000
+
+    def compile(self, body, decls=""):
+        source = f"{decls}int main() {{\nlong x = 1;\n{body}\nreturn 0;\n}}\n"
+        defs = parse_file(source)
+        check(defs)
+        self.assertTrue(ast_equal(defs, parse_file(source)))
+        return compile_top(defs)
+
+    def test_nested_ifs(self):
+        n = self.depth
+        code = self.compile("if (x > 0) {\n" * n + "print(x);" + "\n}" * n)
+        self.assertEqual(code.count("_if_true"), n)
+
+    def test_nested_blocks_and_whiles(self):
+        n = self.depth
+        body = "while (x) {\nlong x = 0;\n" * n + "print(x);" + "\n}" * n
+        code = self.compile(body)
+        self.assertEqual(code.count("jmp _loop_while"), n)
+        self.assertIn(f"sub rsp, {8 * (n + 1)}", code)
+
+    def test_else_if_chain(self):
+        body = "".join(f"if (x == {i}) print({i});\nelse " for i in range(self.depth))
+        code = self.compile(body + "print(x);")
+        self.assertEqual(code.count("printint"), self.depth + 1)
+
+    def test_deep_expressions(self):
+        n = self.depth
+        id_fun = "long id(long a) {\nreturn a;\n}\n"
+        parens = "(id(" * n + "x" + "))" * n
+        sum = " + ".join(["x"] * n)
+        code = self.compile(f"print({parens});\nprint({sum});", id_fun)
+        self.assertEqual(code.count("call __id__"), n)
+
+
+    def test_lowering(self):
+        n = self.depth
+        body = "if (x > 0) {\nwhile (x && x < 5) {\n" * n + "x += 1;" + "\n}\n}" * n
+        defs = parse_file(f"int main() {{\nlong x = 1;\n{body}\nprint(x);\nreturn 0;\n}}\n")
+        program = lower(defs)
+        self.assertEqual(interpreter.run(program), [5])
+        # every level has the if and while blocks and the right side of &&
+        self.assertEqual(backend.compile_program(program).count("\n.L"), 6 * n + 1)
+
+
+class IRTests(unittest.TestCase):
+    # too slow for the interpreter
+    slow_examples = {"ex09", "ex34"}
+
+    def run_source(self, source):
+        return interpreter.run(lower(parse_file(source)))
+
+    def test_examples(self):
+        for file_name in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*.sil"))):
+            base = os.path.basename(file_name)[:-4]
+            if base in self.slow_examples:
+                continue
+            with self.subTest(file=base):
+                with open(file_name) as f:
+                    program = lower(parse_file(f.read()))
+                with open(os.path.join(EXAMPLES_DIR, "outputs", base + ".output")) as f:
+                    expected = [int(line) for line in f]
+                self.assertEqual(interpreter.run(program), expected)
+                self.assertIn("call __main__", backend.compile_program(program))
+
+    def test_dump(self):
+        source = """
+long g = 7;
+long f(long a, long b) {
+  long *p = &b;
+  while (a < g && *p) {
+    a = a + 1;
+  }
+  return a;
+}
+int main() {
+  return f(1, 2);
+}
+"""
+        expected = """\
+global @g = 7
+function f(%a, %b) {
+    slots $b.1
+L0:
+    store $b.1, %b
+    %1:ptr = addr $b.1
+    %p:ptr = copy %1
+    jmp L1
+L1:
+    %2 = load @g
+    %3 = lt %a, %2
+    br %3, L4, L3
+L4:
+    %4 = load %p
+    br %4, L2, L3
+L2:
+    %5 = add %a, 1
+    %a = copy %5
+    jmp L1
+L3:
+    ret %a
+}
+function main() {
+L0:
+    %1 = call f(1, 2)
+    ret %1
+}
+"""
+        self.assertEqual(str(lower(parse_file(source))), expected)
+
+    def test_evaluation_order(self):
+        source = """
+long f(long a, long b) {
+  return a - b;
+}
+int main() {
+  long x = 1;
+  print(x + (x = 5));
+  print(f(x, x = 2));
+  print(f(x = 3, x));
+  print((x = 4) * (x = 6) + x);
+  print(x && 7);
+  print(0 || x);
+  print(!x);
+  return 0;
+}
+"""
+        self.assertEqual(self.run_source(source), [6, 0, 1, 30, 7, 6, -5])
+
+    def test_words(self):
+        source = """
+int main() {
+  long big = 9223372036854775807;
+  print(big + 1);
+  print((0 - 7) / 2);
+  print((0 - 7) % 2);
+  print(big * big);
+  return 0;
+}
+"""
+        # unsigned division, as in the old code generator
+        self.assertEqual(self.run_source(source), [-2**63, 2**63 - 4, 1, 1])
+
+    def test_global_initializers(self):
+        source = """
+long a = 5;
+long b = a * 2 + 1;
+long sq(long x) {
+  return x * x;
+}
+long c = sq(b) - 1;
+long d = (a < 9) && (b > 3);
+int main() {
+  print(a + b + c + d);
+  return 0;
+}
+"""
+        # the numbers are in the data section, the others are stored by INIT
+        program = lower(parse_file(source))
+        self.assertEqual([var.init for var in program.globals], [5, 0, 0, 0])
+        self.assertEqual(interpreter.run(program), [137])
+        ssa.program_to_ssa(program)
+        optimizer.optimize(program)
+        ssa.program_from_ssa(program)
+        self.assertEqual(interpreter.run(program), [137])
+        for asm in [backend.compile_program(program), compile_top(parse_file(source))]:
+            self.assertIn("_start:\n    call __globals.init__\n    call __main__\n", asm)
+            self.assertIn("\n__globals.init__:\n", asm)
+            self.assertIn("  var_a dq 5\n", asm)
+
+    def test_global_initializers_run_once(self):
+        # main calls itself, the initial value is stored before the first call
+        source = """
+long n = 1 + 0;
+long main() {
+  if (n > 3) {
+    return 0;
+  }
+  n = n + 1;
+  print(n);
+  return main();
+}
+"""
+        for passes in [[], optimizer.PASSES]:
+            with self.subTest(passes=passes):
+                program = lower(parse_file(source))
+                ssa.program_to_ssa(program)
+                optimizer.optimize(program, passes)
+                ssa.program_from_ssa(program)
+                self.assertEqual(interpreter.run(program, 10**5), [2, 3, 4])
+
+    def test_redeclared_globals(self):
+        source = """
+long x = 3;
+long x = x + 4;
+long main() {
+  print(x);
+  return 0;
+}
+"""
+        program = lower(parse_file(source))
+        self.assertEqual([var.name for var in program.globals], ["x", "x.1"])
+        self.assertEqual(interpreter.run(program), [7])
+        for asm in [
+            backend.compile_program(program),
+            compile_top(parse_file(source)),
+        ]:
+            self.assertIn("  var_x dq 3\n  var_x.1 dq 0\n", asm)
+            self.assertIn("[var_x.1]", asm)
+
+    def test_backend(self):
+        source = """
+long sq(long n) {
+  long r = n * n;
+  if (r > 100) {
+    return 0;
+  }
+  return r;
+}
+int main() {
+  print(sq(5));
+  return 0;
+}
+"""
+        code = backend.compile_program(lower(parse_file(source)))
+        # the compare and the branch are fused, the params are in the caller's frame
+        self.assertIn("    imul rax, [rbp + 16]\n    mov [rbp - 8], rax\n", code)
+        self.assertIn("    cmp rax, 100\n    jle .L2\n", code)
+        self.assertIn("    push 5\n    call __sq__\n    add rsp, 8\n", code)
+
+
+class CFGTests(unittest.TestCase):
+    source = """
+int main() {
+  long x = 0;
+  long y = 0;
+  while (x < 10) {
+    y = 0;
+    while (y < x) {
+      if (y == 3) {
+        break;
+      }
+      y += 1;
+    }
+    if (x == 5) {
+      continue;
+    }
+    x += 1;
+  }
+  if (x) {
+    return 1;
+  } else {
+    return 2;
+  }
+  print(x);
+}
+"""
+
+    def graph(self, source):
+        return CFG(lower(parse_file(source)).function("main"))
+
+    def labels(self, graph, blocks):
+        return sorted(graph.blocks[i].label for i in blocks)
+
+    def test_edges(self):
+        graph = self.graph(self.source)
+        entry = graph.blocks[0]
+        self.assertEqual(self.labels(graph, graph.succs[0]), ["L1"])
+        # the loop header: the entry and the ends of the body
+        header = graph.number[entry.successors[0]]
+        self.assertEqual(self.labels(graph, graph.preds[header]), ["L0", "L10", "L9"])
+        self.assertEqual(graph.rpo[0], 0)
+        # the code after the if is unreachable
+        [unreachable] = [i for i in range(len(graph)) if not graph.reachable(i)]
+        self.assertEqual(graph.blocks[unreachable].instrs[0].op.value, "print")
+        self.assertEqual(graph.idom[unreachable], -1)
+
+    def test_dominators(self):
+        graph = self.graph(self.source)
+        for i in graph.rpo:
+            with self.subTest(block=graph.blocks[i].label):
+                self.assertTrue(graph.dominates(0, i))
+                self.assertTrue(graph.dominates(i, i))
+                if i:
+                    self.assertTrue(graph.dominates(graph.idom[i], i))
+                    self.assertLess(graph.rpo_number[graph.idom[i]], graph.rpo_number[i])
+        # the join after the inner loop is dominated by its header
+        [outer, inner] = graph.loops
+        join = graph.number[graph.blocks[inner.header].instrs[-1].args[2]]
+        self.assertEqual(graph.idom[join], inner.header)
+        self.assertFalse(graph.dominates(join, inner.header))
+
+    def test_loops(self):
+        graph = self.graph(self.source)
+        [outer, inner] = graph.loops
+        self.assertEqual((outer.depth, inner.depth), (1, 2))
+        self.assertIs(inner.parent, outer)
+        self.assertEqual(outer.children, [inner])
+        self.assertEqual(self.labels(graph, outer.back_edges), ["L10", "L9"])
+        self.assertEqual(self.labels(graph, inner.back_edges), ["L8"])
+        self.assertEqual(self.labels(graph, inner.all_blocks()), ["L4", "L5", "L8"])
+        # the break leaves the inner loop
+        self.assertEqual(len(outer.all_blocks()), 9)
+        self.assertEqual(graph.loop_depth(graph.number[graph.fun.blocks[5]]), 1)
+        for i in inner.all_blocks():
+            self.assertTrue(graph.in_loop(i, outer))
+            self.assertEqual(graph.loop_depth(i), 2)
+        self.assertEqual(graph.loop_depth(0), 0)
+
+    def test_deep_loops(self):
+        n = 10000
+        head = "".join(f"long i{k} = 0;\nwhile (i{k} < 1) {{\n" for k in range(n))
+        tail = "".join(f"\ni{k} += 1;\n}}" for k in reversed(range(n)))
+        graph = self.graph(f"int main() {{\n{head}print(1);{tail}\nreturn 0;\n}}\n")
+        self.assertEqual(len(graph.loops), n)
+        self.assertEqual(max(loop.depth for loop in graph.loops), n)
+        self.assertEqual(len(graph.loops[0].all_blocks()), 3 * n - 1)
+
+    def test_dominance_frontiers(self):
+        graph = self.graph(self.source)
+        frontiers = graph.dominance_frontiers()
+        [outer, inner] = graph.loops
+        for i in graph.rpo:
+            for j in frontiers[i]:
+                # i dominates a predecessor of j, but not j itself (or i is j)
+                self.assertTrue(any(graph.dominates(i, p) for p in graph.preds[j]))
+                self.assertTrue(i == j or not graph.dominates(i, j))
+        self.assertEqual(frontiers[outer.header], [outer.header])
+        self.assertEqual(sorted(frontiers[inner.header]), [outer.header, inner.header])
+
+
+class SSATests(unittest.TestCase):
+    def to_ssa(self, source):
+        program = lower(parse_file(source))
+        ssa.program_to_ssa(program)
+        return program
+
+    def check_ssa(self, fun):
+        """Every temporary is assigned once, before all its uses"""
+        graph = CFG(fun)
+        defined = {param: (0, -1) for param in fun.params}
+        for i, block in enumerate(fun.blocks):
+            for k, instr in enumerate(block.instrs):
+                if instr.dst is not None:
+                    self.assertNotIn(instr.dst, defined)
+                    defined[instr.dst] = (i, k)
+        for i, block in enumerate(fun.blocks):
+            for k, instr in enumerate(block.instrs):
+                if instr.op == ssa.Op.Phi:
+                    preds = [graph.blocks[p] for p in graph.preds[i]]
+                    self.assertCountEqual([b for (b, _) in instr.incoming], preds)
+                    # the values are used at the ends of the predecessors
+                    uses = [(v, graph.number[b], len(b.instrs)) for (b, v) in instr.incoming]
+                else:
+                    uses = [(v, i, k) for v in instr.args]
+                for (var, j, position) in uses:
+                    if type(var) is ssa.Temp:
+                        (d, where) = defined[var]
+                        self.assertTrue(graph.dominates(d, j) and (d != j or where < position))
+
+    def test_examples(self):
+        for file_name in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*.sil"))):
+            base = os.path.basename(file_name)[:-4]
+            if base in IRTests.slow_examples:
+                continue
+            with self.subTest(file=base):
+                with open(file_name) as f:
+                    program = self.to_ssa(f.read())
+                with open(os.path.join(EXAMPLES_DIR, "outputs", base + ".output")) as f:
+                    expected = [int(line) for line in f]
+                for fun in program.functions:
+                    self.check_ssa(fun)
+                self.assertEqual(interpreter.run(program), expected)
+                ssa.program_from_ssa(program)
+                self.assertNotIn(" phi ", str(program))
+                self.assertEqual(interpreter.run(program), expected)
+
+    def test_phis(self):
+        source = """
+int main() {
+  long x = 0;
+  long y;
+  long *p = &y;
+  while (x < 10) {
+    long t = x;
+    if (x % 2) { x = x + 3; } else { x = x + 1; }
+    *p = t;
+  }
+  print(x + y);
+  return 0;
+}
+"""
+        fun = self.to_ssa(source).function("main")
+        phis = [instr for block in fun.blocks for instr in block.phis]
+        # x at the loop header and after the if, t and y need none
+        self.assertEqual([str(phi.dst) for phi in phis], ["%x.2", "%x.3"])
+        self.assertEqual(str(fun.blocks[1].instrs[0]), "%x.2 = phi [L0: %x.1], [L5: %x.3]")
+        # y stays in memory
+        self.assertEqual(fun.slots[0].name, "y")
+        self.assertIn("store %p, %t", str(fun))
+
+    def test_pruned(self):
+        # the counters of the inner loops are dead at the outer headers
+        n = 200
+        head = "".join(f"long i{k} = 0;\nwhile (i{k} < 1) {{\n" for k in range(n))
+        tail = "".join(f"\ni{k} += 1;\n}}" for k in reversed(range(n)))
+        program = self.to_ssa(f"int main() {{\n{head}print(i{n - 1});{tail}\nreturn 0;\n}}\n")
+        fun = program.function("main")
+        self.check_ssa(fun)
+        self.assertEqual(sum(len(block.phis) for block in fun.blocks), n)
+        self.assertEqual(interpreter.run(program), [0])
+
+    def test_undefined(self):
+        source = """
+int main() {
+  long i = 0;
+  while (i < 3) {
+    long x;
+    print(x);
+    x = i * 10;
+    i += 1;
+  }
+  return 0;
+}
+"""
+        program = self.to_ssa(source)
+        # the value of x is kept from one iteration to the next
+        self.assertEqual(interpreter.run(program), [0, 0, 10])
+        ssa.program_from_ssa(program)
+        self.assertEqual(interpreter.run(program), [0, 0, 10])
+
+    def test_sequentialize(self):
+        fun = ssa.Function("f")
+        [a, b, c, d] = [fun.new_temp(name=name) for name in "abcd"]
+        one = ssa.Const(1)
+        cases = [
+            [(a, b), (b, a)],
+            [(a, b), (b, c), (c, a), (d, a)],
+            [(a, b), (b, a), (c, d), (d, c)],
+            [(a, one), (b, a), (c, b)],
+            [(a, a), (b, b)],
+        ]
+        for copies in cases:
+            with self.subTest(copies=copies):
+                values = {a: 10, b: 20, c: 30, d: 40, one: 1}
+                expected = dict(values)
+                expected.update({dst: values[src] for (dst, src) in copies})
+                for instr in ssa.sequentialize(fun, copies):
+                    values[instr.dst] = values[instr.args[0]]
+                self.assertEqual({x: values[x] for x in (a, b, c, d)},
+                                 {x: expected[x] for x in (a, b, c, d)})
+
+    def test_critical_edges(self):
+        source = """
+int main() {
+  long i = 0;
+  long x = 0;
+  while (i < 5) {
+    if (i % 2) x = i;
+    print(x);
+    i += 1;
+  }
+  return 0;
+}
+"""
+        program = self.to_ssa(source)
+        fun = program.function("main")
+        blocks = set(fun.blocks)
+        ssa.program_from_ssa(program)
+        self.assertEqual(interpreter.run(program), [0, 1, 1, 3, 3])
+        # the edge from the test of the if to the join gets its own block,
+        # which keeps the old x
+        [edge] = [block for block in fun.blocks if block not in blocks]
+        self.assertEqual([instr.op for instr in edge.instrs], [ssa.Op.Copy, ssa.Op.Jmp])
+        self.assertEqual(edge.instrs[0].args[0].name, "x.2")
+
+
+def optimized(source, passes=optimizer.PASSES):
+    """The program in SSA form after the optimizations, and their statistics"""
+    program = lower(parse_file(source))
+    ssa.program_to_ssa(program)
+    stats = optimizer.optimize(program, passes)
+    return program, stats
+
+
+# for the tests of the calls, which inlining would remove
+NO_INLINING = [name for name in optimizer.PASSES if name != "inline"]
+
+
+class OptimizerTests(unittest.TestCase):
+    def test_examples(self):
+        for file_name in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*.sil"))):
+            base = os.path.basename(file_name)[:-4]
+            if base in IRTests.slow_examples:
+                continue
+            with self.subTest(file=base):
+                with open(file_name) as f:
+                    (program, _) = optimized(f.read())
+                with open(os.path.join(EXAMPLES_DIR, "outputs", base + ".output")) as f:
+                    expected = [int(line) for line in f]
+                self.assertEqual(interpreter.run(program), expected)
+                ssa.program_from_ssa(program)
+                self.assertEqual(interpreter.run(program), expected)
+
+
+class SCCPTests(unittest.TestCase):
+    def constants(self, source):
+        """The printed values, which must be known at compile time"""
+        (program, _) = optimized(source, ["sccp"])
+        instrs = [instr for block in program.function("main").blocks for instr in block.instrs]
+        self.assertNotIn(ssa.Op.Br, [instr.op for instr in instrs])
+        prints = [instr.args[0] for instr in instrs if instr.op == ssa.Op.Print]
+        self.assertTrue(all(type(x) is ssa.Const for x in prints), str(program))
+        return [x.value for x in prints]
+
+    def test_folding(self):
+        source = """
+int main() {
+  long x = 3 + 4;
+  long y = x * x - 1;
+  print(y);
+  print(!(y == 48));
+  print((x > 0) && (y % 5));
+  print((x < 0) || (0 - y));
+  print((x = 5) + x);
+  return 0;
+}
+"""
+        self.assertEqual(self.constants(source), [48, 0, 3, -48, 10])
+
+    def test_words(self):
+        values = [0, 1, 2, 7, -1, -7, 2**32, 2**63 - 1, -2**63]
+        def literal(v):
+            if v == -2**63:
+                return "((0 - 9223372036854775807) - 1)"
+            return str(v) if v >= 0 else f"(0 - {-v})"
+        mask = 2**64 - 1
+        def wrap(v):
+            return (v + 2**63 & mask) - 2**63
+        reference = {
+            "+": lambda a, b: wrap(a + b),
+            "-": lambda a, b: wrap(a - b),
+            "*": lambda a, b: wrap(a * b),
+            # unsigned, like div in the backend
+            "/": lambda a, b: wrap((a & mask) // (b & mask)),
+            "%": lambda a, b: wrap((a & mask) % (b & mask)),
+            "==": lambda a, b: int(a == b),
+            "!=": lambda a, b: int(a != b),
+            "<": lambda a, b: int(a < b),
+            "<=": lambda a, b: int(a <= b),
+            ">": lambda a, b: int(a > b),
+            ">=": lambda a, b: int(a >= b),
+        }
+        lines = []
+        expected = []
+        for op, evaluate in reference.items():
+            for a in values:
+                for b in values:
+                    if op in "/%" and b == 0:
+                        continue
+                    lines.append(f"  print({literal(a)} {op} {literal(b)});")
+                    expected.append(evaluate(a, b))
+        source = "int main() {\n" + "\n".join(lines) + "\n  return 0;\n}\n"
+        self.assertEqual(self.constants(source), expected)
+
+    def test_branches(self):
+        source = """
+int main() {
+  long x = 1;
+  long n = 0;
+  while (n < 10) {
+    if (x != 1) { x = 2; }
+    n += 1;
+  }
+  if (1 == 1) { print(x); } else { print(n); }
+  return 0;
+}
+"""
+        (program, _) = optimized(source, ["sccp"])
+        code = str(program)
+        # x is always 1, the never taken branches are gone
+        self.assertNotIn("ne ", code)
+        self.assertIn("print 1", code)
+        self.assertNotIn("print %n", code)
+        self.assertEqual(code.count("br "), 1)
+        self.assertEqual(interpreter.run(program), [1])
+
+    def test_not_folded(self):
+        source = """
+long f(long a) {
+  return a * 0 + a / 0;
+}
+int main() {
+  long y = 0;
+  long *p = &y;
+  *p = 5;
+  print(y + 1);
+  return 0;
+}
+"""
+        (program, stats) = optimized(source, ["sccp"])
+        # the division by 0 happens at run time, the memory is not tracked
+        self.assertIn("div %a, 0", str(program.function("f")))
+        self.assertNotIn("mul", str(program.function("f")))
+        self.assertIn("load $y", str(program.function("main")))
+        # only the multiplication by 0
+        self.assertEqual(stats["f"]["sccp"]["folded"], 1)
+        self.assertEqual(interpreter.run(program), [6])
+
+
+
+class DCETests(unittest.TestCase):
+    source = """
+long g;
+long f(long a) {
+  long unused = a * 3;
+  long z;
+  long *q = &z;
+  z = 4;
+  z = 5;
+  a + 1;
+  g = 1;
+  g = 2;
+  if (1) {
+    long w = a / (a - 1) + a / 2;
+    return a;
+  }
+  print(a);
+}
+int main() {
+  long y = 1;
+  long *p = &y;
+  *p = 2;
+  f(y);
+  print(f(y) + y);
+  return 0;
+}
+"""
+
+    def test_dead_code(self):
+        (program, stats) = optimized(self.source, NO_INLINING)
+        # the last store to the global, the division which may fail stays
+        self.assertEqual(str(program.function("f")), """\
+function f(%a) {
+L0:
+    store @g, 2
+    %4 = sub %a, 1
+    %5 = div %a, %4
+    ret %a
+}""")
+        main = str(program.function("main"))
+        # the stores through the pointer may change y
+        self.assertIn("    store $y, 1\n", main)
+        self.assertIn("    call f(%2)\n", main)
+        self.assertEqual(interpreter.run(program), [4])
+
+    def test_stats(self):
+        (program, stats) = optimized(self.source, ["sccp", "dce"])
+        # z, unused, q, a + 1, the first store to g, the jump to the block of
+        # the if and most of w (8 bytes for every temporary and local)
+        self.assertEqual(stats["f"]["dce"], {"instrs": 12, "frame_bytes": 72})
+        self.assertEqual(stats["main"]["dce"], {"instrs": 0, "frame_bytes": 8})
+        self.assertEqual(optimizer.report(stats).splitlines()[1],
+                         "main: dce frame bytes 8")
+        # the frame of the compiled function shrinks as well
+        ssa.program_from_ssa(program)
+        self.assertIn("\n__f__:\n    push rbp\n    mov rbp, rsp\n    sub rsp, 16\n",
+                      backend.compile_program(program))
+
+    def test_dead_loop_variable(self):
+        source = """
+int main() {
+  long i = 0;
+  long n = 0;
+  while (i < 3) {
+    n = n + i * i;
+    i += 1;
+  }
+  print(i);
+  return 0;
+}
+"""
+        (program, _) = optimized(source)
+        # n only feeds itself
+        self.assertNotIn("%n", str(program))
+        self.assertEqual(interpreter.run(program), [3])
+
+
+
+class GVNTests(unittest.TestCase):
+    def count(self, fun, op):
+        return sum(instr.op == op for block in fun.blocks for instr in block.instrs)
+
+    def test_expressions(self):
+        source = """
+int main() {
+  long cand = 3;
+  long current = 30;
+  while (cand * cand <= current) {
+    if (current % cand == 0) {
+      print(current % cand + cand * cand);
+    }
+    long a = cand + current;
+    if (current + cand > a) { print(1); }
+    if (a < current) { print(2); }
+    if (current > a) { print(3); }
+    cand += 1;
+  }
+  return 0;
+}
+"""
+        # (without iv, which would replace cand * cand)
+        (program, stats) = optimized(source, ["sccp", "gvn", "dce"])
+        fun = program.function("main")
+        self.assertEqual(self.count(fun, ssa.Op.Mul), 1)
+        self.assertEqual(self.count(fun, ssa.Op.Mod), 1)
+        self.assertEqual(self.count(fun, ssa.Op.Add), 3)
+        # x > x is 0, a < current is current > a
+        self.assertEqual(self.count(fun, ssa.Op.Gt) + self.count(fun, ssa.Op.Lt), 1)
+        self.assertNotIn("print 1", str(fun))
+        self.assertEqual(interpreter.run(program), [9, 25])
+
+    def test_loads(self):
+        source = """
+long g;
+long h;
+long f() {
+  g = g + 1;
+  return 0;
+}
+int main() {
+  long x = 1;
+  long *p = &x;
+  long *q = &h;
+  g = 5;
+  print(g + *p + *p);
+  *q = 7;
+  print(g + *p);
+  h = 8;
+  print(*q + *p);
+  f();
+  print(g + x);
+  return 0;
+}
+"""
+        (program, stats) = optimized(source, NO_INLINING)
+        main = str(program.function("main"))
+        # g = 5 is forwarded until the store through q (which may point to
+        # g), the loads through the pointers are repeated after every store
+        # which may change them, g and x after the call
+        self.assertEqual(main.count("load @g"), 2)
+        self.assertEqual(main.count("load %"), 4)
+        self.assertEqual(main.count("load $x"), 1)
+        self.assertEqual(interpreter.run(program), [7, 6, 9, 7])
+
+    def test_joins(self):
+        source = """
+int main() {
+  long x = 1;
+  long *p = &x;
+  long y = *p;
+  if (y) { *p = 2; }
+  print(*p + y);
+  return 0;
+}
+"""
+        (program, _) = optimized(source)
+        # the load after the if may see the store
+        self.assertEqual(str(program).count("load "), 2)
+        self.assertEqual(interpreter.run(program), [3])
+
+
+class LICMTests(unittest.TestCase):
+    def depths(self, fun):
+        """The loop depths of the instructions of the function, by their texts"""
+        graph = CFG(fun)
+        return {str(instr).split(" = ")[-1]: graph.loop_depth(i)
+                for i, block in enumerate(fun.blocks) for instr in block.instrs}
+
+    def test_hoisting(self):
+        source = """
+long g;
+long f(long a, long n) {
+  long i = 0;
+  long s = 0;
+  while (i < n) {
+    long j = 0;
+    while (j < n) {
+      s = s + a * a + g + n / 4 + n / a;
+      j += 1;
+    }
+    i += 1;
+  }
+  return s;
+}
+int main() {
+  g = 1;
+  print(f(3, 2));
+  print(f(3, 0));
+  return 0;
+}
+"""
+        (program, stats) = optimized(source)
+        depths = self.depths(program.function("f"))
+        # out of both loops, but not the division by a variable
+        self.assertEqual(depths["mul %a, %a"], 0)
+        self.assertEqual(depths["load @g"], 0)
+        self.assertEqual(depths["div %n, 4"], 0)
+        self.assertEqual(depths["div %n, %a"], 2)
+        self.assertEqual(stats["f"]["licm"]["hoisted"], 3)
+        self.assertEqual(interpreter.run(program), [4 * (9 + 1), 0])
+
+    def test_memory(self):
+        source = """
+long g;
+long h;
+long f(long *p, long n) {
+  long i = 0;
+  long s = 0;
+  while (i < *p) {
+    s = s + *p + h;
+    i += 1;
+  }
+  while (i < n) {
+    s = s + g + *p;
+    *p = i;
+    i += 1;
+  }
+  while (i < 2 * n) {
+    s = s + g + h;
+    g = i;
+    i += 1;
+  }
+  return s;
+}
+int main() {
+  long x = 2;
+  h = 10;
+  print(f(&x, 4));
+  return 0;
+}
+"""
+        (program, _) = optimized(source)
+        fun = program.function("f")
+        graph = CFG(fun)
+        loads = [(str(instr), graph.loop_depth(i))
+                 for i, block in enumerate(fun.blocks)
+                 for instr in block.instrs if instr.op == ssa.Op.Load]
+        loads = [(text.split(" = ")[-1], depth) for (text, depth) in loads]
+        self.assertEqual(sorted(loads), sorted([
+            # the first loop (*p in the body is the one of the condition)
+            ("load %p", 0), ("load @h", 0),
+            # the second one stores through p, which may point to g
+            ("load %p", 1), ("load @g", 1),
+            # the third one stores to g
+            ("load @g", 1), ("load @h", 0),
+        ]))
+        self.assertEqual(interpreter.run(program), [24 + 4 + 55])
+
+    def test_preheader(self):
+        # the loop is entered straight from a branch
+        fun = ssa.Function("main")
+        [a, n] = [fun.new_param(name) for name in "an"]
+        [entry, header, end] = [fun.new_block() for _ in range(3)]
+        [i, j, m, c] = [fun.new_temp(name=name) for name in "ijmc"]
+        Instr = ssa.Instr
+        Op = ssa.Op
+        entry.instrs = [Instr(Op.Br, None, (a, header, end))]
+        header.instrs = [
+            Instr(Op.Phi, i, (entry, ssa.Const(0), header, j)),
+            Instr(Op.Mul, m, (a, a)),
+            Instr(Op.Print, None, (m,)),
+            Instr(Op.Add, j, (i, ssa.Const(1))),
+            Instr(Op.Lt, c, (j, n)),
+            Instr(Op.Br, None, (c, header, end)),
+        ]
+        end.instrs = [Instr(Op.Ret, None, (ssa.Const(0),))]
+        fun.blocks = [entry, header, end]
+        program = ssa.Program()
+        program.functions.append(fun)
+        self.assertEqual(licm.hoist_invariants(fun)["hoisted"], 1)
+        preheader = fun.blocks[1]
+        self.assertEqual([instr.op for instr in preheader.instrs], [Op.Mul, Op.Jmp])
+        self.assertEqual(header.phis[0].args, (header, j, preheader, ssa.Const(0)))
+        for run in (lambda: None, lambda: ssa.from_ssa(fun)):
+            run()
+            machine = interpreter.Interpreter(program)
+            machine.run("main", (5, 3))
+            self.assertEqual(machine.output, [25, 25, 25])
+
+
+class InductionTests(unittest.TestCase):
+    def count(self, fun, op):
+        return sum(instr.op == op for block in fun.blocks for instr in block.instrs)
+
+    def reduced(self, source, mul_cost=induction.MUL_COST):
+        """The optimized program, and the statistics of reduce_strength"""
+        program = lower(parse_file(source))
+        ssa.program_to_ssa(program)
+        optimizer.optimize(program, ["sccp", "gvn", "licm"])
+        stats = {fun.name: dict(induction.reduce_strength(fun, mul_cost))
+                 for fun in program.functions}
+        optimizer.optimize(program, ["dce"])
+        return (program, stats)
+
+    def test_square(self):
+        source = """
+long f(long n) {
+  long c = 3;
+  long s = 0;
+  while (c * c <= n) {
+    s = s + c * c;
+    c += 2;
+  }
+  return s;
+}
+int main() {
+  print(f(100));
+  print(f(5));
+  return 0;
+}
+"""
+        # two additions and two phis cost more than the multiplication
+        (program, stats) = self.reduced(source)
+        self.assertEqual(stats["f"], {})
+        (program, stats) = self.reduced(source, mul_cost=20)
+        self.assertEqual(stats["f"], {"reduced": 1})
+        self.assertEqual(self.count(program.function("f"), ssa.Op.Mul), 0)
+        self.assertEqual(interpreter.run(program), [9 + 25 + 49 + 81, 0])
+
+    def test_linear(self):
+        source = """
+long f(long k) {
+  long i = 0;
+  long j = 0;
+  long s = 0;
+  while (i < 100) {
+    s = s + i * 8 + j * k;
+    i += 1;
+    j += 1;
+  }
+  return s;
+}
+int main() {
+  print(f(2));
+  return 0;
+}
+"""
+        (program, stats) = optimized(source)
+        fun = program.function("f")
+        self.assertEqual(dict(stats["f"]["iv"]), {"merged": 1, "reduced": 2, "tests": 1})
+        # j * k starts at 0 and grows by k
+        self.assertEqual(self.count(fun, ssa.Op.Mul), 0)
+        # s and the two products, the test is i * 8 < 800 and i is gone
+        header = fun.blocks[1]
+        self.assertEqual(len(header.phis), 3)
+        self.assertIn("800", str(header))
+        self.assertEqual(interpreter.run(program), [(8 + 2) * 4950])
+
+    def test_wraparound(self):
+        source = """
+long f() {
+  long i = 0;
+  long s = 0;
+  while (i < 2000000000000000000) {
+    s = s + i * 8;
+    i += 1;
+  }
+  return s;
+}
+int main() {
+  print(f());
+  return 0;
+}
+"""
+        # i * 8 would wrap around before the end of the loop, so i stays
+        (program, stats) = self.reduced(source)
+        self.assertEqual(stats["f"], {})
+        (program, stats) = self.reduced(source, mul_cost=20)
+        self.assertEqual(stats["f"], {"reduced": 1})
+        self.assertIn("lt %i", str(program.function("f")))
+
+    def test_other_exit(self):
+        source = """
+int main() {
+  long i = 0;
+  long j = 100;
+  long s = 0;
+  while (j < 110) {
+    if (i < 1) {
+      s = s + 1;
+    }
+    s = s + i * 2305843009213693952;
+    i = i + 1;
+    j = j + 1;
+  }
+  print(s);
+  return 0;
+}
+"""
+        # j ends the loop, i * 2^61 wraps around, so i < 1 cannot be i * 2^61 < 2^61
+        expected = interpreter.run(lower(parse_file(source)))
+        self.assertEqual(expected, [-6917529027641081855])
+        for mul_cost in [induction.MUL_COST, 20]:
+            with self.subTest(mul_cost=mul_cost):
+                (program, stats) = self.reduced(source, mul_cost)
+                self.assertNotIn("tests", stats["main"])
+                self.assertEqual(interpreter.run(program), expected)
+                ssa.program_from_ssa(program)
+                self.assertEqual(interpreter.run(program), expected)
+
+
+class InlineTests(unittest.TestCase):
+    source = """
+long g;
+long twice(long x) {
+  return x + x;
+}
+long quad(long x) {
+  return twice(twice(x));
+}
+long clamp(long x) {
+  if (x < 0) {
+    return 0;
+  }
+  if (x > 100) {
+    return 100;
+  }
+  return x;
+}
+long bump(long x) {
+  long *p = &x;
+  *p = *p + 1;
+  g = g + x;
+  return x;
+}
+long fact(long n) {
+  if (n < 2) {
+    return 1;
+  }
+  return n * fact(n - 1);
+}
+int main() {
+  long x = 3;
+  long i = 0;
+  while (i < 5) {
+    x = clamp(quad(x) - 20);
+    print(x);
+    i += 1;
+  }
+  print(bump(x) + bump(1));
+  print(g);
+  print(fact(10));
+  return 0;
+}
+"""
+
+    def test_bottom_up(self):
+        (program, stats) = optimized(self.source, ["inline"])
+        inlined = {name: dict(passes["inline"]) for name, passes in stats.items()}
+        # quad gets the copies of twice before it is copied itself,
+        # the recursive fact stays; the calls are where they were before
+        self.assertEqual(inlined, {
+            "twice": {}, "quad": {"twice() at L0:0": 1, "twice() at L0:1": 1},
+            "clamp": {}, "bump": {}, "fact": {},
+            "main": {"quad() at L2:0": 1, "clamp() at L2:2": 1,
+                     "bump() at L3:0": 1, "bump() at L3:1": 1},
+        })
+        self.assertIn("main: inline quad() at L2:0, inline clamp() at L2:2",
+                      optimizer.report(stats))
+        main = str(program.function("main"))
+        self.assertEqual(main.count("call "), 1)
+        self.assertIn("call fact(10)", main)
+        self.assertEqual(interpreter.run(program), [0, 0, 0, 0, 0, 3, 3, 3628800])
+        ssa.program_from_ssa(program)
+        self.assertEqual(interpreter.run(program), [0, 0, 0, 0, 0, 3, 3, 3628800])
+
+    def test_renaming(self):
+        (program, _) = optimized(self.source, ["inline"])
+        main = program.function("main")
+        # the x of every copy of bump has its own slot, x of main is a temp
+        self.assertEqual([slot.name for slot in main.slots], ["x.1.1", "x.1.2"])
+        names = [instr.dst.name for block in main.blocks for instr in block.instrs
+                 if instr.dst is not None]
+        self.assertEqual(len(names), len(set(names)))
+        self.assertIn("p", names)
+        self.assertIn("p.1", names)
+
+    def test_cost_model(self):
+        source = """
+long poly(long x) {
+  long s = x * x + 1;
+%s  return s %% 1000;
+}
+int main() {
+  long i = 0;
+  long t = poly(2);
+  while (i < 10) {
+    t = t + poly(i);
+    i += 1;
+  }
+  print(t);
+  return 0;
+}
+""" % "".join(f"  s = s * x + {k};\n" for k in range(2, 10))
+        # only the call in the loop is worth it with the default growth
+        in_loop = {"poly() at L2:0": 1}
+        for (growth, expected) in [
+            (0, {}), (10, in_loop), (100, {"poly() at L0:1": 1, **in_loop})
+        ]:
+            with self.subTest(growth=growth):
+                program = lower(parse_file(source))
+                ssa.program_to_ssa(program)
+                stats = inline.inline_calls(program, growth)
+                self.assertEqual(dict(stats["main"]), expected)
+                self.assertEqual(interpreter.run(program), [4920])
+
+
+class TailTests(unittest.TestCase):
+    source = """
+long sum(long n, long acc) {
+  if (n == 0) {
+    return acc;
+  }
+  return sum(n - 1, acc + n);
+}
+long half(long n) {
+  return sum(n / 2, 0);
+}
+int main() {
+  print(sum(N, 0));
+  print(half(N));
+  return 0;
+}
+"""
+
+    def test_loop(self):
+        (program, stats) = optimized(self.source.replace("N", "10000"), ["tail"])
+        self.assertEqual(dict(stats["sum"]["tail"]), {"calls": 1})
+        self.assertEqual(dict(stats["half"]["tail"]), {})
+        sum_fun = program.function("sum")
+        self.assertNotIn("call", str(sum_fun))
+        # the params come through the phis of the old entry
+        self.assertEqual(len(sum_fun.blocks[1].phis), 2)
+        run = interpreter.Interpreter(program)
+        run.run()
+        self.assertEqual(run.output, [50005000, 12502500])
+        # main and half, which calls sum
+        self.assertEqual(run.max_depth, 2)
+        ssa.program_from_ssa(program)
+        self.assertEqual(interpreter.run(program), [50005000, 12502500])
+
+    def test_slots(self):
+        # a pointer to x may go to the call, which must not change it
+        source = """
+long f(long n, long *p) {
+  long x = n;
+  if (n == 0) {
+    return *p;
+  }
+  return f(n - 1, &x);
+}
+int main() {
+  long y = 7;
+  print(f(3, &y));
+  return 0;
+}
+"""
+        (program, stats) = optimized(source, ["tail"])
+        self.assertEqual(dict(stats["f"]["tail"]), {})
+        self.assertEqual(interpreter.run(program), [1])
+
+    def test_constant_stack(self):
+        # 10^7 frames would not fit into the stack (see examples/ex34), the
+        # recursion is a loop in both code generators
+        source = self.source.replace("N", "10000000")
+        new = compile_top(parse_file(source))
+        body = new[new.index("__sum__:"):new.index("__sum___epilogue:")]
+        self.assertNotIn("call", body)
+        self.assertIn("jmp __sum___body", body)
+        (program, _) = optimized(source)
+        ssa.program_from_ssa(program)
+        old = backend.compile_program(program)
+        body = old[old.index("__sum__:"):old.index("__half__:")]
+        self.assertNotIn("call", body)
+
+    def test_frame_reuse(self):
+        # g reuses its frame for sum (without the optimizations), h has too
+        # few params for the arguments of sum
+        source = """
+long sum(long n, long acc) {
+  if (n == 0) {
+    return acc;
+  }
+  return sum(n - 1, acc + n);
+}
+long g(long a, long b, long c) {
+  return sum(a + b, c);
+}
+long h(long a) {
+  return sum(a, 0);
+}
+int main() {
+  print(g(3, 4, 5) + h(3));
+  return 0;
+}
+"""
+        for name, code in [
+            ("old", compile_top(parse_file(source))),
+            ("new", backend.compile_program(lower(parse_file(source)))),
+        ]:
+            with self.subTest(generator=name):
+                g = code[code.index("__g__:"):code.index("__h__:")]
+                self.assertIn("jmp __sum__\n", g)
+                self.assertNotIn("call", g)
+                self.assertIn("call __sum__", code[code.index("__h__:"):])
+
+
+class DivisionTests(unittest.TestCase):
+    def execute(self, code, n):
+        """Runs the instructions of divide_by_constant with rax = n"""
+        regs = {"rax": n, "rcx": 0, "rdx": 0}
+        flag = False
+        for line in code:
+            name, _, rest = line.partition(" ")
+            args = rest.split(", ")
+            value = lambda arg: regs[arg] if arg in regs else int(arg)
+            if name == "mov":
+                regs[args[0]] = value(args[1])
+            elif name == "mul":
+                product = regs["rax"] * value(args[0])
+                regs["rax"], regs["rdx"] = product & MASK, product >> 64
+            elif name == "imul":
+                factors = [value(arg) for arg in args[-2:]]
+                regs[args[0]] = factors[0] * factors[1] & MASK
+            elif name == "cmp":
+                flag = value(args[0]) >= value(args[1])
+            elif name == "setae":
+                regs["rax"] = regs["rax"] & ~0xff | flag
+            elif name == "cmovae":
+                if flag:
+                    regs[args[0]] = value(args[1])
+            else:
+                operation = {
+                    "add": lambda a, b: a + b,
+                    "sub": lambda a, b: a - b,
+                    "and": lambda a, b: a & b,
+                    "xor": lambda a, b: a ^ b,
+                    "shl": lambda a, b: a << b,
+                    "shr": lambda a, b: a >> b,
+                }[name]
+                regs[args[0]] = operation(value(args[0]), value(args[1])) & MASK
+        return regs["rax"]
+
+    def check(self, divisor, dividends):
+        for op in [Op.Div, Op.Mod]:
+            code = division.divide_by_constant(divisor, op == Op.Mod)
+            assert code is not None
+            self.assertNotIn("div", " ".join(code).split())
+            for n in dividends:
+                with self.subTest(divisor=divisor, op=op, dividend=n):
+                    expected = EVALUATE[op](n, divisor) & MASK
+                    self.assertEqual(self.execute(code, n & MASK), expected)
+
+    def test_edge_cases(self):
+        divisors = [d for k in range(64) for d in [(1 << k) - 1, 1 << k, (1 << k) + 1]]
+        divisors += list(range(1, 300)) + [641, 1000, 10 ** 9, 10 ** 18, -1, -7, 1 - (1 << 63)]
+        for d in divisors:
+            if d == 0:
+                continue
+            u = d & MASK
+            dividends = {0, 1, 2, MASK, MASK - 1, 1 << 63, (1 << 63) - 1, (1 << 63) + 1}
+            for q in [1, 2, 3, 1000, MASK // u - 1, MASK // u]:
+                dividends.update({q * u - 1, q * u, q * u + 1, q * u + u - 1})
+            self.check(d, [n for n in dividends if 0 <= n <= MASK])
+
+    def test_random(self):
+        rng = random.Random(23)
+        for _ in range(300):
+            bits = rng.randint(1, 64)
+            d = rng.getrandbits(bits) or 1
+            self.check(d, [rng.getrandbits(rng.randint(1, 64)) for _ in range(200)])
+
+    def test_zero(self):
+        # left to div, which fails at run time
+        self.assertIsNone(division.divide_by_constant(0, False))
+        self.assertIsNone(division.divide_by_constant(0, True))
+
+    def test_programs(self):
+        source = """
+long f(long x, long y) {
+  print(x / 8 + x % 2 + x % 10 + x / 7);
+  return x / y + x % 10;
+}
+int main() { return f(12345, 7); }
+"""
+        # only x / y is left to div
+        self.assertEqual(compile_top(parse_file(source)).count("div r11"), 1)
+        program = lower(parse_file(source))
+        text = backend.compile_program(program)
+        self.assertEqual(text.count("div rcx"), 1)
+
+
+class AstNodeTests(unittest.TestCase):
+    def test_ast_equal(self):
+        source = "if (x) { y = *p + f(1, 2); } else while (!x) x -= 1;"
+        stms = parse_stm(source)
+        self.assertTrue(ast_equal(stms, parse_stm(source)))
+        self.assertFalse(ast_equal(stms, parse_stm(source.replace("2", "3"))))
+        self.assertFalse(ast_equal(stms, parse_stm(source.replace(", 2", ""))))
+        self.assertFalse(ast_equal(ArithLit(1), Var("x")))
+
+    def test_slots(self):
+        [stm] = parse_stm("if (x) { print(f(1, *p)); } else while (!x) x -= 1;")
+        nodes = [stm, stm.b, stm.ss1[0], stm.ss1[0].a, stm.ss2[0], stm.ss2[0].ss[0].a.lvalue]
+        for node in nodes:
+            with self.subTest(node=type(node).__name__):
+                self.assertFalse(hasattr(node, "__dict__"))
+        self.assertIsInstance(stm.ss1, tuple)
+        self.assertIsInstance(stm.ss1[0].a.args, tuple)
+        # lists are still accepted and compare equal to tuples
+        self.assertEqual(StmWhile(Var("x"), []), StmWhile(Var("x"), ()))
+        self.assertEqual(FunCall("f", [ArithLit(1)]).args, (ArithLit(1),))
+
+    def test_pickle(self):
+        import pickle
+        with open(os.path.join(EXAMPLES_DIR, "ex20.sil")) as f:
+            defs = parse_file(f.read())
+        self.assertEqual(pickle.loads(pickle.dumps(defs)), defs)
+
+class AstCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.dir = self.tmp.name
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_encode_examples(self):
+        for file_name in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*.sil"))):
+            with self.subTest(file=os.path.basename(file_name)):
+                with open(file_name) as f:
+                    defs = parse_file(f.read())
+                self.assertEqual(ast_cache.decode(ast_cache.encode(defs)), defs)
+
+    def test_encode_deep(self):
+        source = "if (x) {\n" * 10000 + "x = 2 + 99999999999999999999;" + "\n}" * 10000
+        stms = parse_stm(source)
+        self.assertTrue(ast_equal(ast_cache.decode(ast_cache.encode(stms)), stms))
+
+    def test_hits_and_misses(self):
+        source = "int main() {\n  return 1;\n}\n"
+        cache = ast_cache.ASTCache(self.dir)
+        defs = cache.parse_file(source)
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+        self.assertEqual(ast_cache.ASTCache(self.dir).parse_file(source), defs)
+        cache.parse_file(source)
+        cache.parse_file(source.replace("1", "2"))
+        self.assertEqual((cache.hits, cache.misses), (1, 2))
+        self.assertEqual(len(cache.entries()), 2)
+
+    def test_parse_errors_not_cached(self):
+        cache = ast_cache.ASTCache(self.dir)
+        for i in range(2):
+            with self.assertRaises(ParseError):
+                cache.parse_file("int main() {")
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertEqual(cache.entries(), [])
+
+    def test_damaged_entry(self):
+        source = "int main() {\n  return 1;\n}\n"
+        cache = ast_cache.ASTCache(self.dir)
+        defs = cache.parse_file(source)
+        key = cache.key(source.encode())
+        with open(cache.path(key), "wb") as f:
+            f.write(b"garbage")
+        self.assertEqual(cache.parse_file(source), defs)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        self.assertEqual(cache.parse_file(source), defs)
+        self.assertEqual(cache.hits, 1)
+
+    def test_lru_eviction(self):
+        sources = [f"long x{i} = {i};\n" for i in range(4)]
+        size = len(ast_cache.encode(parse_file(sources[0])))
+        cache = ast_cache.ASTCache(self.dir, max_size=3 * size + size // 2)
+        for i, source in enumerate(sources[:3]):
+            cache.parse_file(source)
+            os.utime(cache.path(cache.key(source.encode())), (i, i))
+        # x0 is used again, so x1 is the least recently used one
+        cache.parse_file(sources[0])
+        cache.parse_file(sources[3])
+        self.assertEqual(len(cache.entries()), 3)
+        self.assertFalse(os.path.exists(cache.path(cache.key(sources[1].encode()))))
+        cache.parse_file(sources[0])
+        self.assertEqual((cache.hits, cache.misses), (2, 4))
+
+
+class ParallelParserTests(unittest.TestCase):
+    source = "".join(
+        f"long g{i} = {i};\n"
+        f"long f{i}(long a) {{\n  if (a) {{ a = f{i}(a - 1); }}\n  return (a);\n}}\n"
+        for i in range(40)
+    ) + "int main() {\n  return f1(g2);\n}\n"
+
+    def test_split_definitions(self):
+        for file_name in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*.sil"))):
+            with self.subTest(file=os.path.basename(file_name)):
+                with open(file_name) as f:
+                    stream = TokenStream(f.read())
+                starts = split_definitions(stream)
+                self.assertEqual(len(starts) - 1, len(Parser(stream).parse_file_top()))
+                self.assertEqual(starts[-1], len(stream) - 1)
+
+    def test_batches(self):
+        starts = [0, 10, 15, 40, 41, 100]
+        for count in range(1, 7):
+            ranges = batches(starts, count)
+            self.assertLessEqual(len(ranges), count)
+            # contiguous ranges covering all the definitions
+            self.assertEqual(ranges[0][0], 0)
+            self.assertEqual(ranges[-1][1], 100)
+            for (r1, r2) in zip(ranges, ranges[1:]):
+                self.assertEqual(r1[1], r2[0])
+                self.assertIn(r1[1], starts)
+
+    def test_same_as_sequential(self):
+        defs = parse_file_parallel(self.source, workers=3, min_tokens=0)
+        self.assertEqual(defs, parse_file(self.source))
+        self.assertEqual(len(defs), 81)
+
+    def test_errors(self):
+        errors = [
+            ("long f3(long a) {\n  if (a) {", "long f3(long a) {\n  if (a {"),
+            ("  return (a);\n}\nlong g7", "  return (a;\n}\nlong g7"),
+            ("long g39 = 39;", "long g39 = 39"),
+            ("int main() {\n  return f1(g2);\n}\n", "int main() {\n  return f1(g2);\n"),
+        ]
+        for (old, new) in errors:
+            source = self.source.replace(old, new, 1)
+            with self.subTest(error=new):
+                with self.assertRaises(ParseError) as sequential:
+                    parse_file(source)
+                with self.assertRaises(ParseError) as parallel:
+                    parse_file_parallel(source, workers=3, min_tokens=0)
+                self.assertEqual(parallel.exception.token, sequential.exception.token)
+                self.assertEqual(parallel.exception.msg, sequential.exception.msg)
+
+
+class ArenaTests(unittest.TestCase):
+    def examples(self):
+        for file_name in sorted(glob.glob(os.path.join(EXAMPLES_DIR, "*.sil"))):
+            with open(file_name) as f:
+                yield os.path.basename(file_name), f.read()
+
+    def test_same_as_tree(self):
+        for name, source in self.examples():
+            with self.subTest(file=name):
+                defs = parse_file(source)
+                self.assertEqual(arena.parse_file(source).to_tree(), defs)
+                self.assertEqual(arena.Arena.from_tree(defs).to_tree(), defs)
+
+    def test_pickle(self):
+        for name, source in self.examples():
+            with self.subTest(file=name):
+                a = pickle.loads(pickle.dumps(arena.parse_file(source)))
+                self.assertEqual(a.to_tree(), parse_file(source))
+
+    def test_visitors(self):
+        for name, source in self.examples():
+            with self.subTest(file=name):
+                a = arena.parse_file(source)
+                check(a.views())
+                code_generator.CompileVisitor.labelId = 0
+                expected = compile_top(parse_file(source))
+                code_generator.CompileVisitor.labelId = 0
+                self.assertEqual(compile_top(a.views()), expected)
+
+    def test_postorder(self):
+        a = arena.parse_file("int main() { if (x) { y = f(1, *p); } while (!x) x -= 1; }")
+        for i in range(len(a)):
+            for child in a.view(i).__dataclass_fields__:
+                value = getattr(a.view(i), child)
+                for node in (value if isinstance(value, tuple) else [value]):
+                    if isinstance(node, arena.ArenaNode):
+                        self.assertLess(node.id, i)
+
+    def test_lvalue_errors(self):
+        for source in ["int main() { 1 + 2 = 3; }", "int main() { x = f(1) = 2; }"]:
+            with self.subTest(source=source):
+                with self.assertRaises(ParseError) as tree:
+                    parse_file(source)
+                with self.assertRaises(ParseError) as flat:
+                    arena.parse_file(source)
+                self.assertEqual(flat.exception.msg, tree.exception.msg)
+
+    def test_deep(self):
+        n = 10000
+        source = "int main() {" + "if (x) {" * n + "x = 1;" + "}" * n + "}"
+        a = arena.parse_file(source)
+        # the ifs and their conditions, the assignment (and the Var parsed
+        # before we knew it is an lvalue), its statement, 1 and main
+        self.assertEqual(len(a), 2 * n + 5)
+        self.assertTrue(ast_equal(a.to_tree(), parse_file(source)))
+
+
 if __name__ == "__main__":
     unittest.main()
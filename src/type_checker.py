@@ -6,12 +6,28 @@ Type checking of C programs.
 We check that:
 - all names are in scope
 - there are no type errors
+
+In the same walk over the program we resolve every variable to its binding
+and lay out the stack frames of the functions (see SymbolTable), which is
+all the code generator needs to know about the variables.
+
+Big programs can also be checked in two phases (see check_parallel): first
+the global environment is collected, then the definitions are checked
+independently of each other, in a pool of processes, and all the errors
+are reported.
 """
 
+import gc
+import multiprocessing
+from bisect import bisect_left
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from enum import Enum
 from typing import Any, Optional
 
-from visitor import Visitor
-from pyc_ast import FunDecl, LValue, FunArg, FunType
+from slots import add_slots
+from visitor import Pass, Walk
+from pyc_ast import FunDecl, FunArg, FunType
 import pyc_ast as AST
 
 
@@ -23,57 +39,201 @@ class CTypeError(Exception):
         return f"{self.msg}"
 
 
+class CTypeErrors(CTypeError):
+    """All the type errors found in a program, in the source order"""
+
+    def __init__(self, errors: list[CTypeError]):
+        super().__init__("\n".join(err.msg for err in errors))
+        self.errors = errors
+
+    def __reduce__(self):
+        return (CTypeErrors, (self.errors,))
+
+
 Stm = Any
 Var = str
 Tp = AST.CType
 Params = list[FunArg]
 
 
-class Env:
-    env: dict[Var, Tp] = {}
+class BindingKind(Enum):
+    Global = "global"
+    Param = "param"
+    Local = "local"
 
-    def __contains__(self, var: Var):
-        return var in self.env
+    def __str__(self):
+        return self.value
+
+
+@add_slots
+@dataclass(frozen=True)
+class Binding:
+    """
+    Where a variable lives: a global (including the functions), the index-th
+    parameter or the index-th local variable slot of the current function.
+
+    Every declaration gets its own uid, so the variables are unique even if
+    their names are not.
+    """
 
-    def add(self, var: Var, tp: Tp):
-        self.env[var] = tp
+    kind: BindingKind
+    name: Var
+    index: int
+    type: Tp
+    uid: int
 
-    def get(self, var: Var) -> Tp:
-        return self.env[var]
+    def __str__(self):
+        return str(self.type)
+
+
+class Env:
+    """
+    The variables in scope, with their bindings.
+
+    Every variable has a stack of bindings, the innermost on top, and every
+    scope remembers the variables bound in it. So entering a scope is O(1),
+    leaving it costs O(1) per binding made in it, and lookups are O(1):
+    nothing is copied when we enter a block.
+    """
 
-    def copy(self) -> Env:
-        cp = Env()
-        cp.env = self.env.copy()
-        return cp
+    def __init__(self, global_scope: Optional[GlobalScope] = None, limit: int = 0):
+        self._bindings: dict[Var, list[Binding]] = {}
+        self._scopes: list[list[Var]] = [[]]
+        # the globals defined before the limit position are also in scope
+        self._global_scope = global_scope
+        self._limit = limit
+
+    def __contains__(self, var: Var):
+        return self.lookup(var) is not None
+
+    def add(self, var: Var, binding: Binding):
+        stack = self._bindings.get(var)
+        if stack is None:
+            self._bindings[var] = [binding]
+        else:
+            stack.append(binding)
+        self._scopes[-1].append(var)
+
+    def get(self, var: Var) -> Binding:
+        binding = self.lookup(var)
+        if binding is None:
+            raise KeyError(var)
+        return binding
+
+    def lookup(self, var: Var) -> Optional[Binding]:
+        """The binding of the variable, None if it is not in scope"""
+        stack = self._bindings.get(var)
+        if stack is not None:
+            return stack[-1]
+        if self._global_scope is not None:
+            return self._global_scope.lookup(var, self._limit)
+        return None
+
+    def push_scope(self):
+        self._scopes.append([])
+
+    def pop_scope(self):
+        """Removes the bindings made since the matching push_scope"""
+        assert len(self._scopes) > 1
+        for var in self._scopes.pop():
+            stack = self._bindings[var]
+            stack.pop()
+            if not stack:
+                del self._bindings[var]
 
     def __str__(self):
-        inside = "\n\t\t".join([f"{k}:{v}" for k, v in self.env.items()])
+        visible = {}
+        if self._global_scope is not None:
+            visible = self._global_scope.visible(self._limit)
+        for var, stack in self._bindings.items():
+            visible[var] = stack[-1]
+        inside = "\n\t\t".join([f"{k}:{v}" for k, v in visible.items()])
         return f"[\n\t\t{inside}\n\t]"
 
 
+class GlobalScope:
+    """
+    The global variables and functions of a program, collected before the
+    definitions are checked. The definition at a given position only sees
+    the globals defined before it (and a function sees itself).
+    """
+
+    def __init__(self):
+        # the positions of the definitions of every name, and their bindings
+        self._positions: dict[Var, list[int]] = {}
+        self._bindings: dict[Var, list[Binding]] = {}
+        self.by_position: dict[int, Binding] = {}
+
+    def add(self, position: int, binding: Binding):
+        self._positions.setdefault(binding.name, []).append(position)
+        self._bindings.setdefault(binding.name, []).append(binding)
+        self.by_position[position] = binding
+
+    def lookup(self, var: Var, limit: int) -> Optional[Binding]:
+        """The last binding of var defined before the limit position"""
+        positions = self._positions.get(var)
+        if positions is None:
+            return None
+        i = bisect_left(positions, limit)
+        return self._bindings[var][i - 1] if i > 0 else None
+
+    def visible(self, limit: int) -> dict[Var, Binding]:
+        visible = {}
+        for var in self._positions:
+            binding = self.lookup(var, limit)
+            if binding is not None:
+                visible[var] = binding
+        return visible
+
+
+@add_slots
+@dataclass
+class Frame:
+    """The variables in the stack frame of a function"""
+
+    name: Var
+    params: list[Binding]
+    locals: list[Binding] = field(default_factory=list)
+    # the uids of the params and locals used with &, which must stay in memory
+    address_taken: set[int] = field(default_factory=set)
+
+
 class SymbolTable:
-    pass
+    """
+    The result of type checking: the binding of the variable at every
+    declaration (StmDecl) and use (Var, ArithAssign) and the frame of every
+    function (FunDecl).
 
+    Both are keyed by the ids of the nodes in defs, the checked definitions
+    (which are kept here, so the ids stay valid).
+    """
 
-class TypeCheckingVisitor(Visitor):
-    symbol_table: SymbolTable = SymbolTable()
-    env: Env = Env()
+    def __init__(self):
+        self.defs: list = []
+        self.bindings: dict[int, Binding] = {}
+        self.frames: dict[int, Frame] = {}
 
+
+class TypeCheckingPass(Pass):
     # environment
 
-    def add_binding(self, var: Var, tp: Tp):
-        self.env.add(var, tp)
+    def add_binding(self, var: Var, kind: BindingKind, index: int, tp: Tp):
+        binding = Binding(kind, var, index, tp, self.binding_count)
+        self.binding_count += 1
+        self.env.add(var, binding)
+        return binding
 
-    def get_binding(self, var: Var) -> Tp:
+    def get_binding(self, var: Var) -> Binding:
         return self.env.get(var)
 
-    def expect_bound_var(self, var: Var):
-        if var not in self.env:
+    def expect_bound_var(self, var: Var) -> Binding:
+        binding = self.env.lookup(var)
+        if binding is None:
             raise CTypeError(f"name {var} is not defined in env: {self.env}")
+        return binding
 
     def expect_function_type(self, var: Var) -> FunType:
-        self.expect_bound_var(var)
-        c_type: AST.CType = self.get_binding(var)
+        c_type: AST.CType = self.expect_bound_var(var).type
 
         if c_type.kind == AST.TypeKind.Pointer:
             raise CTypeError(
@@ -90,126 +250,255 @@ class TypeCheckingVisitor(Visitor):
 
     # type checking
 
-    def __init__(self):
-        pass
-
-    def visit_ArithLit(self, val):
-        pass
-
-    def visit_Var(self, var: Var):
-        self.expect_bound_var(var)
-
-    def visit_FunCall(self, name: Var, args: list[Any]):
+    def __init__(self, global_scope: Optional[GlobalScope] = None):
+        """
+        By default the pass checks whole programs. Given the global scope it
+        checks single definitions, see start_definition.
+        """
+        self.global_scope = global_scope
+        self.start_definition(0, 0)
+
+    def start_definition(self, limit: int, first_uid: int):
+        """Clears the state, the next definition is the one before limit"""
+        self.symbol_table = SymbolTable()
+        self.limit = limit
+        self.env = Env(self.global_scope, limit)
+        self.binding_count = first_uid
+        # the frame of the current function, None outside of functions
+        self.frame: Optional[Frame] = None
+
+    def enter_block(self):
+        self.env.push_scope()
+
+    def leave_block(self):
+        self.env.pop_scope()
+
+    def leave_Var(self, node):
+        self.symbol_table.bindings[id(node)] = self.expect_bound_var(node.var)
+
+    def enter_FunCall(self, node):
         # TODO: check if C has a different namespace for functions
         # TODO: check if the args have correct types
 
-        fn_type = self.expect_function_type(name)
+        fn_type = self.expect_function_type(node.name)
 
         expected_num = len(fn_type.args)
-        given_num = len(args)
+        given_num = len(node.args)
         if expected_num != given_num:
             raise CTypeError(
-                f"function {name} got {given_num} args, "
+                f"function {node.name} got {given_num} args, "
                 + f"but {expected_num} args were expected"
             )
 
-        self.visit_many(args)
-
-    def visit_ArithUnaryop(self, op, a):
-        a.accept(self)
-
-    def visit_ArithBinop(self, op, a1, a2):
-        a1.accept(self)
-        a2.accept(self)
-
-    def visit_BoolArithCmp(self, op, a1, a2):
-        a1.accept(self)
-        a2.accept(self)
-
-    def visit_BoolNeg(self, b):
-        b.accept(self)
-
-    def visit_BoolBinop(self, op, b1, b2):
-        b1.accept(self)
-        b2.accept(self)
-
-    def visit_ArithAssign(self, lvalue: LValue, a):
-        var: Var = lvalue.loc
-        self.expect_bound_var(var)
-        a.accept(self)
-
-    def visit_StmExpr(self, a):
-        a.accept(self)
-
-    def visit_StmDecl(self, tp: Tp, var: Var, a: Optional[Any], kind):
-        if a is not None:
-            a.accept(self)
-        self.add_binding(var, tp)
+    def leave_ArithUnaryop(self, node):
+        # & and * only take variables
+        if not isinstance(node.a, AST.Var):
+            raise CTypeError(f"{node.op.value} expects a variable, but found {node.a}")
+        frame = self.frame
+        if node.op == AST.ArithUnaryOp.Addr and frame is not None:
+            binding = self.get_binding(node.a.var)
+            if binding.kind != BindingKind.Global:
+                frame.address_taken.add(binding.uid)
+
+    def enter_ArithAssign(self, node):
+        self.expect_bound_var(node.lvalue.loc)
+
+    def leave_ArithAssign(self, node):
+        # the node may have been rebuilt, with new children
+        self.symbol_table.bindings[id(node)] = self.get_binding(node.lvalue.loc)
+
+    def leave_StmDecl(self, node):
+        # the initializer is checked before the variable is in scope
+        frame = self.frame
+        if frame is None and self.global_scope is not None:
+            # already collected
+            binding = self.global_scope.by_position[self.limit]
+        elif frame is None:
+            binding = self.add_binding(node.var, BindingKind.Global, 0, node.type)
+        else:
+            index = len(frame.locals)
+            binding = self.add_binding(node.var, BindingKind.Local, index, node.type)
+            frame.locals.append(binding)
+        self.symbol_table.bindings[id(node)] = binding
+
+    def enter_FunDecl(self, node):
+        if self.global_scope is None:
+            self.add_binding(node.name, BindingKind.Global, 0, function_type(node))
+
+        self.env.push_scope()
+
+        params = [
+            self.add_binding(funarg.var, BindingKind.Param, i, funarg.type)
+            for i, funarg in enumerate(node.params)
+        ]
+        self.frame = Frame(node.name, params)
+
+    def leave_FunDecl(self, node):
+        self.env.pop_scope()
+        assert self.frame is not None
+        self.symbol_table.frames[id(node)] = self.frame
+        self.frame = None
+
+
+def function_type(decl: FunDecl) -> Tp:
+    args = [arg.type for arg in decl.params]
+    return AST.tp_normal(FunType(decl.type, args))
+
+
+def check_main(defs: list[Stm]):
+    fun_names = [defn.name for defn in defs if isinstance(defn, FunDecl)]
+    if "main" not in fun_names:
+        msg = (
+            "A program with function definition must have"
+            + " a 'main' function! Aborting..."
+        )
+        raise CTypeError(msg)
+
+
+def check(defs: list[Stm], workers: Optional[int] = None) -> SymbolTable:
+    """
+    Type checks the given program and returns a symbol table
+    containing the type information for all nodes in the program.
 
-    def visit_StmIf(self, b, ss1, ss2):
-        b.accept(self)
-        self.visit_StmBlock(ss1)
-        self.visit_StmBlock(ss2)
+    Raises a CTypeError if there are some problems with the given input.
 
-    def visit_StmWhile(self, b, ss):
-        b.accept(self)
-        self.visit_StmBlock(ss)
+    Given the number of workers, the program is checked in two phases
+    (see check_parallel), and all the errors are raised together, as
+    CTypeErrors.
+    """
+    if workers is not None:
+        return check_parallel(defs, workers)
 
-    def visit_StmPrint(self, a):
-        a.accept(self)
+    check_main(defs)
 
-    def visit_StmReturn(self, a):
-        a.accept(self)
+    checker = TypeCheckingPass()
+    symbol_table = checker.symbol_table
+    symbol_table.defs = Walk([checker]).run(defs)
+    return symbol_table
 
-    def visit_StmBreak(self):
-        pass
 
-    def visit_StmContinue(self):
-        pass
+# -----------------------------------------
+# Checking the definitions in parallel
+# -----------------------------------------
 
-    def visit_StmBlock(self, stms):
-        env = self.env.copy()
-        self.visit_many(stms)
-        self.env = env
 
-    def visit_many(self, stms):
-        for stm in stms:
-            stm.accept(self)
+def collect_globals(defs: list[Stm]) -> GlobalScope:
+    """The first phase: the types of all the global variables and functions"""
+    scope = GlobalScope()
+    for position, decl in enumerate(defs):
+        # the uids of the globals are their positions
+        if isinstance(decl, FunDecl):
+            tp = function_type(decl)
+            scope.add(position, Binding(BindingKind.Global, decl.name, 0, tp, position))
+        elif isinstance(decl, AST.StmDecl):
+            binding = Binding(BindingKind.Global, decl.var, 0, decl.type, position)
+            scope.add(position, binding)
+    return scope
 
-    def visit_FunDecl(self, tp: Tp, name: Var, params: Params, body: list[Stm]):
-        args = [arg.type for arg in params]
-        fn_type = AST.tp_normal(FunType(tp, args))
 
-        self.add_binding(name, fn_type)
+class DefinitionChecker:
+    """The second phase: checks the definitions one by one"""
 
-        env = self.env.copy()
+    def __init__(self, defs: list[Stm], scope: GlobalScope):
+        self.defs = defs
+        self.checker = TypeCheckingPass(scope)
+        self.walk = Walk([self.checker])
 
-        for funarg in params:
-            self.add_binding(funarg.var, funarg.type)
+    def check(self, position: int) -> tuple:
+        """The checked definition and its symbol table, or the type error"""
+        decl = self.defs[position]
+        # a function is in scope in its own body
+        limit = position + 1 if isinstance(decl, FunDecl) else position
+        # the local uids of every definition are above all the previous ones
+        self.checker.start_definition(limit, (position + 1) << 32)
+        try:
+            [decl] = self.walk.run([decl])
+        except CTypeError as err:
+            return (None, None, err)
+        return (decl, self.checker.symbol_table, None)
 
-        self.visit_many(body)
 
-        self.env = env
+_checker: Optional[DefinitionChecker] = None
 
-    def visit_many_defs(self, defs):
-        fun_names = [defn.name for defn in defs if isinstance(defn, FunDecl)]
-        if "main" not in fun_names:
-            msg = (
-                "A program with function definition must have"
-                + " a 'main' function! Aborting..."
-            )
-            raise CTypeError(msg)
 
-        return self.visit_many(defs)
+def _init_worker(defs, scope):
+    global _checker
+    _checker = DefinitionChecker(defs, scope)
+    gc.disable()
 
 
-def check(defs: list[Stm]) -> SymbolTable:
+def _check_batch(positions: range):
     """
-    Type checks the given program and returns a symbol table
-    containing the type information for all nodes in the program.
+    Checks the definitions in a worker. The workers are forked, so the ids
+    of the nodes are the same as in the parent process and the bindings can
+    be sent back as they are. A definition which had to be rebuilt (e.g.
+    a view of an arena) is sent back as None, to be checked in the parent.
+    """
+    assert _checker is not None
+    results = []
+    for position in positions:
+        (decl, table, err) = _checker.check(position)
+        if decl is not None and decl is not _checker.defs[position]:
+            results.append(None)
+        elif err is not None:
+            results.append((None, None, err))
+        else:
+            results.append((table.bindings, table.frames, None))
+    return results
+
+
+def check_parallel(defs: list[Stm], workers: int = 1) -> SymbolTable:
+    """
+    Type checks the program in two phases. First the global environment is
+    collected, then every definition is checked separately, in a pool of
+    workers processes (or in this process, if there is one worker or the
+    processes can't be forked).
 
-    Raises a CTypeError if there are some problems with the given input.
+    Raises CTypeErrors with the errors of all the definitions.
     """
-    visitor = TypeCheckingVisitor()
-    visitor.visit_many_defs(defs)
-    return visitor.symbol_table
+    errors = []
+    try:
+        check_main(defs)
+    except CTypeError as err:
+        errors.append(err)
+
+    scope = collect_globals(defs)
+    symbol_table = SymbolTable()
+    symbol_table.defs = list(defs)
+    positions = range(len(defs))
+
+    results: list = [None] * len(defs)
+    can_fork = "fork" in multiprocessing.get_all_start_methods()
+    if workers > 1 and can_fork and len(defs) > 1:
+        size = -(-len(defs) // (workers * 4))
+        bounds = range(0, len(defs) + size, size)
+        chunks = [positions[start:end] for start, end in zip(bounds, bounds[1:])]
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(chunks)),
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=_init_worker,
+            initargs=(defs, scope),
+        ) as pool:
+            results = [
+                result for batch in pool.map(_check_batch, chunks) for result in batch
+            ]
+
+    checker = DefinitionChecker(defs, scope)
+    for position, result in enumerate(results):
+        if result is None:
+            (decl, table, err) = checker.check(position)
+            if err is not None:
+                errors.append(err)
+                continue
+            symbol_table.defs[position] = decl
+            result = (table.bindings, table.frames, None)
+        (bindings, frames, err) = result
+        if err is not None:
+            errors.append(err)
+        else:
+            symbol_table.bindings.update(bindings)
+            symbol_table.frames.update(frames)
+
+    if errors:
+        raise CTypeErrors(errors)
+    return symbol_table
@@ -2,92 +2,355 @@
 A generic visitor that all the others should inherit from.
 
 This way we will know if some methods are missing even before we run the code.
+
+Visitors can also be written in a recursion-free style, where the visit_*
+methods are generators. Instead of calling child.accept(self) they
+`yield child` (an AST node, or another generator such as
+self.visit_many(stms)) and get the result of visiting it back. The method's
+own result is its return value. Such visitors are run by Visitor.visit,
+which keeps the pending methods on an explicit stack, so the depth of the
+visited tree is only limited by memory. Visitor.visit also sets self.node
+to the node whose visit_* method is called, e.g. to look it up in a table
+(read it before the first yield, the children overwrite it).
+
+Analyses which only need to look at (or rewrite) the nodes one at a time
+are better written as a Pass. Several passes can be fused by a Walk, which
+goes over the tree once and calls the hooks of all the passes at every node.
 """
 
 from abc import ABC, abstractmethod
+from collections.abc import Sequence
+from dataclasses import fields
+from operator import attrgetter, is_
+from types import GeneratorType
+from typing import Union, get_args, get_origin, get_type_hints
+
+import pyc_ast as E
 
 
 class Visitor(ABC):
+    def visit(self, node):
+        """
+        Visits the given node, or runs the given visit_* generator,
+        using an explicit stack instead of the Python call stack.
+        """
+        stack = []
+        if isinstance(node, GeneratorType):
+            result = node
+        else:
+            self.node = node
+            result = node.accept(self)
+        while True:
+            if isinstance(result, GeneratorType):
+                stack.append(result)
+                result = None
+            if not stack:
+                return result
+            try:
+                child = stack[-1].send(result)
+            except StopIteration as stop:
+                stack.pop()
+                result = stop.value
+                continue
+            if isinstance(child, GeneratorType):
+                result = child
+            else:
+                self.node = child
+                result = child.accept(self)
+
     @abstractmethod
     def visit_ArithLit(self, val):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_Var(self, var):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_FunCall(self, name, args):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_ArithUnaryop(self, op, a):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_ArithBinop(self, op, a1, a2):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_BoolArithCmp(self, op, a1, a2):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_BoolNeg(self, b):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_BoolBinop(self, op, b1, b2):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_ArithAssign(self, lvalue, a):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_StmExpr(self, a):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_StmDecl(self, tp, var, a, kind):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_StmIf(self, b, ss1, ss2):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_StmWhile(self, b, ss):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_StmPrint(self, a):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_StmReturn(self, a):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_StmBreak(self):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_StmContinue(self):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_StmBlock(self, stms):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_many(self, stms):
-        ...
+        raise NotImplementedError
 
     @abstractmethod
     def visit_FunDecl(self, type, name, params, body):
-        ...
+        raise NotImplementedError
 
     # TODO: perhaps we don't need this method
     def visit_many_defs(self, defs):
         return self.visit_many(defs)
+
+
+# -----------------------------------------
+# Fused passes
+# -----------------------------------------
+
+
+def _field_types(cls):
+    """
+    The types of the fields of a node class, as (the type of the items,
+    whether the field is a list), e.g. (Stm, True) for Sequence[Stm]
+    """
+    hints = get_type_hints(cls)
+    for f in fields(cls):
+        tp = hints[f.name]
+        if get_origin(tp) is Union:
+            # Optional[X]
+            [tp] = [arg for arg in get_args(tp) if arg is not type(None)]
+        is_list = get_origin(tp) is Sequence
+        if is_list:
+            [tp] = get_args(tp)
+        yield (tp, is_list)
+
+
+def _is_node_type(tp):
+    return isinstance(tp, type) and issubclass(tp, (E.Expr, E.Stm))
+
+
+# The node classes, with the names of their fields and the positions of the
+# fields which hold child nodes (Exprs or Stms, or lists of them)
+NODE_CLASSES = [
+    cls for cls in vars(E).values() if isinstance(cls, type) and "accept" in vars(cls)
+]
+NODE_FIELDS = {cls: tuple(f.name for f in fields(cls)) for cls in NODE_CLASSES}
+FIELD_TYPES = {cls: tuple(_field_types(cls)) for cls in NODE_CLASSES}
+CHILD_FIELDS = {
+    cls: tuple(i for i, (tp, _) in enumerate(FIELD_TYPES[cls]) if _is_node_type(tp))
+    for cls in NODE_CLASSES
+}
+LIST_FIELDS = {
+    cls: tuple(i for i, (_, is_list) in enumerate(FIELD_TYPES[cls]) if is_list)
+    for cls in NODE_CLASSES
+}
+# the statement lists, i.e. the blocks
+BLOCK_FIELDS = {
+    cls: tuple(
+        i
+        for i, (tp, is_list) in enumerate(FIELD_TYPES[cls])
+        if is_list and _is_node_type(tp) and issubclass(tp, E.Stm)
+    )
+    for cls in NODE_CLASSES
+}
+
+
+class Pass:
+    """
+    One analysis (or rewriting) in a Walk.
+
+    For the node types it is interested in a pass defines enter_X(node),
+    called before the children of an X node are walked, and leave_X(node),
+    called after. If leave_X returns a node, it replaces the walked one
+    (and the parents get rebuilt with the new child). enter_block and
+    leave_block are called around every list of statements, including the
+    top-level one.
+    """
+
+    def enter_block(self):
+        pass
+
+    def leave_block(self):
+        pass
+
+
+# Markers on the stack of Walk.run, the nodes to enter are pushed as they are
+_LEAVE = object()  # leave the node below the marker
+_LEAVE_LIST = object()  # collect the new items of the (list, is_block) below
+_ENTER_BLOCK = object()
+
+
+def _children_getter(cls):
+    """A function giving the tuple of children of a node of the class"""
+    names = [NODE_FIELDS[cls][i] for i in CHILD_FIELDS[cls]]
+    if len(names) == 1:
+        get = attrgetter(names[0])
+        return lambda node: (get(node),)
+    return attrgetter(*names)
+
+
+class Walk:
+    """
+    Runs several passes in a single walk over the tree.
+
+    At every node the hooks are called in the order of the passes, so
+    a leave hook sees the replacements made by the passes before it.
+    The hooks are looked up once, in per-class dispatch tables, so a node
+    type costs nothing for the passes that have no hooks for it.
+    """
+
+    def __init__(self, passes: list[Pass]):
+        self.passes = passes
+        self._enter_block = self._hooks("enter_block")
+        self._leave_block = self._hooks("leave_block")
+        # for every class: the hooks, how to get the children and which of
+        # them are lists (True for blocks, False for other lists, None for
+        # single nodes), in the reverse order
+        self._table = {}
+        for cls in NODE_CLASSES:
+            kinds = []
+            for i in CHILD_FIELDS[cls]:
+                if i in BLOCK_FIELDS[cls]:
+                    kinds.append(True)
+                elif i in LIST_FIELDS[cls]:
+                    kinds.append(False)
+                else:
+                    kinds.append(None)
+            self._table[cls] = (
+                self._hooks(f"enter_{cls.__name__}"),
+                self._hooks(f"leave_{cls.__name__}"),
+                _children_getter(cls) if kinds else None,
+                tuple(reversed(kinds)),
+            )
+
+    def _hooks(self, name: str) -> list:
+        return [
+            getattr(p, name)
+            for p in self.passes
+            if getattr(type(p), name, None) not in (None, getattr(Pass, name, None))
+        ]
+
+    def run(self, stms) -> list:
+        """Walks the statements (or top-level definitions), returns the new ones"""
+        table = self._table
+        values: list = []
+        push_value = values.append
+        todo: list = [(tuple(stms), True), _LEAVE_LIST]
+        todo += reversed(stms)
+        todo.append(_ENTER_BLOCK)
+        push = todo.append
+        pop = todo.pop
+        while todo:
+            x = pop()
+            if x is _LEAVE:
+                x = pop()
+                cls = type(x)
+                (_, leave, children, kinds) = table[cls]
+                n = len(kinds)
+                new = values[-n:]
+                del values[-n:]
+                if not all(map(is_, new, children(x))):
+                    x = _rebuild(x, new)
+                for hook in leave:
+                    y = hook(x)
+                    if y is not None:
+                        x = y
+                push_value(x)
+            elif x is _LEAVE_LIST:
+                (items, is_block) = pop()
+                n = len(items)
+                if n:
+                    new = values[-n:]
+                    del values[-n:]
+                    if not all(map(is_, new, items)):
+                        items = tuple(new)
+                if is_block:
+                    for hook in self._leave_block:
+                        hook()
+                push_value(items)
+            elif x is _ENTER_BLOCK:
+                for hook in self._enter_block:
+                    hook()
+            elif x is None:
+                # a missing child, e.g. in a declaration without a value
+                push_value(None)
+            else:
+                entry = table.get(type(x))
+                if entry is None:
+                    # a node which is materialized lazily, e.g. arena.ArenaNode
+                    x = x.materialize()
+                    entry = table[type(x)]
+                (enter, leave, children, kinds) = entry
+                for hook in enter:
+                    hook(x)
+                if children is None:
+                    # a leaf, we can leave it right away
+                    for hook in leave:
+                        y = hook(x)
+                        if y is not None:
+                            x = y
+                    push_value(x)
+                    continue
+                push(x)
+                push(_LEAVE)
+                for child, is_block in zip(reversed(children(x)), kinds):
+                    if is_block is None:
+                        push(child)
+                    else:
+                        push((child, is_block))
+                        push(_LEAVE_LIST)
+                        todo += child[::-1]
+                        if is_block:
+                            push(_ENTER_BLOCK)
+        [result] = values
+        return list(result)
+
+
+def _rebuild(node, children):
+    """A copy of the node with the given children"""
+    cls = type(node)
+    names = NODE_FIELDS[cls]
+    args = [getattr(node, name) for name in names]
+    for i, child in zip(CHILD_FIELDS[cls], children):
+        args[i] = child
+    return cls(*args)